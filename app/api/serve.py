@@ -0,0 +1,157 @@
+"""
+多 worker 部署入口 (pre-fork)
+
+主进程先以只读 mmap 加载索引 (FAISS 向量、chunk 存储、BM25 倒排表)，
+在 DEVICE=cpu 时一并加载模型，然后 fork 出 WORKERS 个 uvicorn worker 共享监听 socket。
+索引页位于页缓存中，模型权重通过写时复制共享，worker 数增加时内存不会成倍增长。
+
+用法:
+    WORKERS=8 python -m app.api.serve --port 8000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import time
+from typing import Dict
+
+import uvicorn
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.memory import workers_memory_report, format_bytes, log_component_memory
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _preload():
+    """
+    fork 前加载共享组件。GPU 上的模型不能跨 fork 共享，交由各 worker 自行加载。
+    """
+    from app.api.server import app
+    from app.core.registry import components
+
+    # jieba 词典 (含用户词典) 占用较大，在 fork 前加载以便各 worker 共享
+    names = ["tokenizer", "retriever"]
+    if settings.PRELOAD_MODELS and settings.DEVICE == "cpu":
+        names = ["embedding_model", "reranker", "llm_generator"] + names
+    components.warmup(names)
+    components.get("retriever").prepare_filters()
+    log_component_memory("preload")
+    # 冻结预加载对象，避免子进程 GC 扫描时写入对象头导致共享页被复制
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def _run_worker(app, sock: socket.socket):
+    from app.search.reload import index_reloader
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    index_reloader.install_signal_handler()
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    server.run(sockets=[sock])
+    os._exit(0)
+
+
+def _log_memory(children: Dict[int, float]):
+    report = workers_memory_report(children)
+    logger.info(
+        "Memory report: %d workers, total PSS %s, total RSS %s",
+        len(report["workers"]), format_bytes(report["total_pss"]), format_bytes(report["total_rss"]),
+        extra={"event": "memory_report", **report}
+    )
+
+
+def serve(host: str = "0.0.0.0", port: int = 8000, workers: int = None):
+    workers = workers or settings.WORKERS
+    if workers <= 1:
+        from app.api.server import app
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    settings.WORKERS = workers
+    settings.INDEX_MMAP = True
+    sock = _bind(host, port)
+    app = _preload()
+    logger.info("Preloaded shared components, forking %d workers on %s:%d", workers, host, port)
+
+    children: Dict[int, float] = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            _run_worker(app, sock)
+        children[pid] = time.monotonic()
+
+    for _ in range(workers):
+        spawn()
+
+    stopping = False
+
+    def handle_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    def handle_reload(signum, frame):
+        # 各 worker 自行加载新快照 (mmap 的索引文件在页缓存中共享)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGHUP, handle_reload)
+
+    # 首次内存报告在 worker 启动后不久输出
+    next_report = time.monotonic() + min(10.0, settings.MEMORY_REPORT_INTERVAL)
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid, status = 0, 0
+        if pid and pid in children:
+            children.pop(pid)
+            logger.warning("Worker %d exited with status %d, restarting", pid, status)
+            spawn()
+        if time.monotonic() >= next_report:
+            _log_memory(children)
+            next_report = time.monotonic() + settings.MEMORY_REPORT_INTERVAL
+        time.sleep(0.5)
+
+    logger.info("Shutting down %d workers", len(children))
+    for pid in children:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(children):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slope RAG multi-worker server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="默认读取 WORKERS 配置")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
+
+
+if __name__ == "__main__":
+    main()
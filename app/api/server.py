@@ -1,24 +1,84 @@
 import os
 import glob
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse
+import time
+import threading
+import json
+import numpy as np
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Dict, Any, Union
 from app.ingest.parser import DocumentParser
 from app.ingest.chunker import SemanticChunker
+from app.index.filters import MetadataFilter
+from app.tools.engineering import engineering_tool
 from app.pipeline.rag_pipeline import rag_pipeline
+from app.pipeline.batch import batch_runner
 from app.core.config import settings
 from app.core.logging import logger
+from app.core.metrics import registry, HTTP_REQUESTS, HTTP_LATENCY, QUEUE_DEPTH, ADMISSION_REJECTED
+from app.core.admission import admission, Deadline, DeadlineExceeded, Overloaded, deadline_scope, degradation_plan
+from app.core.tracing import tracer
+from app.core.registry import components
+from app.core.memory import (MemoryBudgetExceeded, check_budget, component_memory, log_component_memory,
+                             process_memory, traced_allocations)
+from app.ingest.buffer import IngestBuffer
+from app.index import snapshots
+from app.search.reload import index_reloader
 
-app = FastAPI(title="Slope RAG Agent")
+def _warmup():
+    components.warmup()
+    # 各组件加载后的内存核算，便于定位哪个组件占用最多
+    log_component_memory("startup")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 模型与索引在后台线程中预加载，端口立即可用；就绪状态见 /ready
+    if settings.WARMUP_ON_STARTUP:
+        threading.Thread(target=_warmup, name="warmup", daemon=True).start()
+    # 新索引快照：SIGHUP 或 CURRENT 变化时后台加载并切换
+    index_reloader.install_signal_handler()
+    index_reloader.start_watcher()
+    yield
+
+app = FastAPI(title="Slope RAG Agent", lifespan=lifespan)
+
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    queue = QUEUE_DEPTH.labels("http")
+    queue.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        queue.dec()
+        # 使用路由模板作为标签，避免未知路径造成标签爆炸
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_LATENCY.labels(path).observe(time.perf_counter() - start)
+        HTTP_REQUESTS.labels(path, status).inc()
 
 class IngestResponse(BaseModel):
     message: str
     files_processed: int
     chunks_created: int
+    duplicates_removed: int = 0
+    dedup_ratio: float = 0.0
+    # 导入缓冲超过 INGEST_BUFFER_MB 时提前写入索引的次数
+    spills: int = 0
+    # MEMORY_TRACEMALLOC 开启时的分配对比 (增长最多的代码位置)
+    tracemalloc: Optional[Dict[str, Any]] = None
 
 class AskRequest(BaseModel):
     question: str
+    # 元数据过滤，例如 {"is_table": true, "doc_id": ["GB50330.pdf"], "page": {"gte": 10}}
+    filters: Optional[Dict[str, Any]] = None
+    # 截止时间 (毫秒)，不超过 REQUEST_DEADLINE
+    deadline_ms: Optional[int] = None
 
 class AskResponse(BaseModel):
     risk_level: str
@@ -26,48 +86,279 @@ class AskResponse(BaseModel):
     citations: List[dict]
     recommendations: List[str]
     evidence: List[dict]
+    # rationale 中缺乏上下文支撑的句子 / 无法在所引 chunk 中找到的摘录
+    unsupported_claims: List[str] = []
+    # 负载或截止时间压力下应用的降级 (retrieve_k / rerank_truncated / rerank_skipped / max_output_tokens)
+    degraded: List[str] = []
+
+class BatchRequest(BaseModel):
+    # 问题字符串或 {"id", "question", "filters"}；filters 为整批默认的元数据过滤
+    questions: List[Union[str, Dict[str, Any]]]
+    filters: Optional[Dict[str, Any]] = None
+
+class ReloadRequest(BaseModel):
+    version: Optional[str] = None  # 默认为 CURRENT 指向的版本
+    force: bool = False
+
+class StabilityBatchRequest(BaseModel):
+    # 标量或等长数组 (按 NumPy 广播)
+    c: Union[float, List[float]]
+    phi: Union[float, List[float]]
+    gamma: Union[float, List[float]]
+    h: Union[float, List[float]]
+    beta: Union[float, List[float]]
+    u: Union[float, List[float]] = 0.0
+
+class StabilityGridRequest(BaseModel):
+    # 参数 -> 标量 / 取值列表 / {"start", "stop", "num"}
+    grid: Dict[str, Any]
+    chunk_size: int = 100000
+    summary: bool = False
 
 @app.post("/ingest", response_model=IngestResponse)
 async def ingest_documents(background_tasks: BackgroundTasks):
     """
     扫描 data/sample_docs/，解析→分块→建索引
     """
+    if settings.WORKERS > 1:
+        # 多 worker 下索引为只读共享，单个 worker 内的更新对其他 worker 不可见
+        raise HTTPException(status_code=409, detail="Index is read-only in multi-worker mode; build it offline and restart.")
+    if snapshots.current_version() is not None:
+        # 已发布的快照不可修改，由离线构建生成新版本
+        raise HTTPException(status_code=409, detail="Serving an immutable index snapshot; build a new one with python -m app.index.build.")
+
     files = glob.glob(os.path.join(settings.DATA_DIR, "*.*"))
     if not files:
         return {"message": "No files found", "files_processed": 0, "chunks_created": 0}
 
+    try:
+        # 进程内存已超出预算时直接拒绝
+        check_budget("ingest")
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
     parser = DocumentParser()
     chunker = SemanticChunker(chunk_size=512, chunk_overlap=50)
     
-    all_chunks = []
-    for file_path in files:
-        logger.info(f"Processing {file_path}")
-        raw_docs = parser.parse(file_path)
-        chunks = chunker.chunk_documents(raw_docs)
-        all_chunks.extend(chunks)
-    
-    # 更新索引
-    rag_pipeline.retriever.index_documents(all_chunks)
+    # 更新索引 (近重复 chunk 在向量化前去除)；缓冲超过 INGEST_BUFFER_MB 时分批写入
+    retriever = rag_pipeline.retriever
+    buffer = IngestBuffer(retriever.index_documents, save=retriever.save)
+    with traced_allocations("ingest") as allocations:
+        try:
+            for file_path in files:
+                logger.info("Processing %s", file_path)
+                # 逐页解析并分块，不在内存中保留整份文件的页面
+                buffer.extend(chunker.chunk_documents(parser.iter_parse(file_path)))
+            stats = buffer.close()
+        except MemoryBudgetExceeded as e:
+            raise HTTPException(status_code=503, detail=f"{e}; {buffer.stats.kept} chunks were indexed before aborting")
     
     return {
         "message": "Ingestion complete", 
         "files_processed": len(files), 
-        "chunks_created": len(all_chunks)
+        "chunks_created": stats.kept,
+        "duplicates_removed": stats.duplicates,
+        "dedup_ratio": stats.ratio,
+        "spills": buffer.spills,
+        "tracemalloc": allocations or None
     }
 
 @app.post("/ask", response_model=AskResponse)
-async def ask(request: AskRequest):
+async def ask(request: AskRequest, http_request: Request, response: Response):
+    """
+    准入控制：执行中 + 排队的请求已满时立即返回 429；Pipeline 在线程池中执行，
+    开始执行时按排队压力与剩余时间选择降级方案，超过截止时间返回 504
+    """
+    from starlette.concurrency import run_in_threadpool
+
     try:
-        result = rag_pipeline.run(request.question)
-        return result
+        filters = MetadataFilter.parse(request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        ticket = admission.admit()
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+    seconds = settings.REQUEST_DEADLINE
+    if request.deadline_ms is not None:
+        seconds = min(seconds, max(0, request.deadline_ms) / 1000)
+    deadline = Deadline(seconds)
+    trace_id = http_request.headers.get("X-Trace-Id")
+
+    def answer():
+        pressure = ticket.start(deadline)
+        plan = degradation_plan(pressure, deadline.remaining())
+        with deadline_scope(deadline), tracer.trace("ask", trace_id=trace_id, question=request.question) as trace:
+            response.headers["X-Trace-Id"] = trace.trace_id
+            return rag_pipeline.run(request.question, filters=filters, plan=plan)
+
+    try:
+        result = await run_in_threadpool(answer)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except DeadlineExceeded as e:
+        ADMISSION_REJECTED.labels("deadline").inc()
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        logger.error(f"Error processing request: {e}")
+        logger.exception("Error processing request: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        ticket.close()
+    if result.get("degraded"):
+        response.headers["X-Degraded"] = ",".join(result["degraded"])
+    return result
+
+@app.post("/batch", status_code=202)
+async def submit_batch(http_request: Request):
+    """
+    提交批量问答任务：JSON {"questions": [...], "filters": {...}}，
+    或上传 JSONL (Content-Type: application/x-ndjson，每行一个问题字符串或对象)
+    """
+    body = await http_request.body()
+    content_type = http_request.headers.get("content-type", "")
+    try:
+        if "ndjson" in content_type or "jsonl" in content_type:
+            items = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+            filters = None
+        else:
+            request = BatchRequest.model_validate_json(body)
+            items, filters = request.questions, request.filters
+        parsed = batch_runner.parse_items(items, filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job = batch_runner.submit(parsed)
+    return {**job.to_dict(), "results_url": f"/batch/{job.id}/results"}
+
+@app.get("/batch/{job_id}")
+async def batch_status(job_id: str):
+    status = batch_runner.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown batch job")
+    return status
+
+@app.get("/batch/{job_id}/results")
+async def batch_results(job_id: str):
+    """
+    下载结果 JSONL (每行含 index / id / question 与 /ask 相同的字段)；任务进行中返回已完成的部分
+    """
+    path = batch_runner.results_path(job_id)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No results for this batch job")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{job_id}.jsonl")
+
+@app.post("/tools/stability")
+async def stability_batch(request: StabilityBatchRequest):
+    """
+    批量计算安全系数 (无限边坡模型)，在线程池中计算，不阻塞事件循环
+    """
+    from starlette.concurrency import run_in_threadpool
+    params = request.model_dump()
+    size = max(len(v) if isinstance(v, list) else 1 for v in params.values())
+    if size > settings.STABILITY_MAX_GRID:
+        raise HTTPException(status_code=400, detail=f"At most {settings.STABILITY_MAX_GRID} combinations per request")
+    try:
+        result = await run_in_threadpool(engineering_tool.stability_factor_batch, **params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    fs = result["Fs"]
+    return {"Fs": [None if f != f else round(f, 3) for f in fs.ravel().tolist()], "status": result["status"].ravel().tolist()}
+
+@app.post("/tools/stability/grid")
+async def stability_grid(request: StabilityGridRequest):
+    """
+    网格敏感性分析：summary=true 返回汇总，否则以 NDJSON 分块流式返回每个组合的结果。
+    组合数只由 num / 列表长度计算，超过 STABILITY_MAX_GRID 时在创建任何数组之前拒绝
+    """
+    from starlette.concurrency import run_in_threadpool
+    try:
+        size = engineering_tool.grid_size(request.grid)
+        if size > settings.STABILITY_MAX_GRID:
+            raise HTTPException(status_code=400, detail=f"Grid has {size} combinations, limit is {settings.STABILITY_MAX_GRID}")
+        if request.summary:
+            return await run_in_threadpool(engineering_tool.sweep, request.grid, max(1, request.chunk_size))
+        chunks = await run_in_threadpool(engineering_tool.iter_grid, request.grid, max(1, request.chunk_size))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def stream():
+        for chunk in chunks:
+            fs = np.round(chunk["Fs"], 3)
+            payload = {k: v.tolist() for k, v in chunk.items() if k not in ("Fs", "status")}
+            payload["Fs"] = [None if f != f else f for f in fs.tolist()]
+            payload["status"] = chunk["status"].tolist()
+            yield json.dumps(payload, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready(response: Response):
+    """
+    就绪检查：所有组件加载完成前返回 503 (与存活检查 /health 区分)
+    """
+    is_ready = components.ready()
+    if not is_ready:
+        response.status_code = 503
+    return {"ready": is_ready, "components": components.status(), "admission": admission.status()}
+
+@app.post("/warmup")
+async def warmup():
+    """
+    显式触发组件预加载 (阻塞直到完成)
+    """
+    from starlette.concurrency import run_in_threadpool
+    await run_in_threadpool(components.warmup)
+    return {"ready": components.ready(), "components": components.status()}
+
+@app.get("/index")
+async def index_info():
+    """
+    当前加载的索引快照与 CURRENT 指向的版本
+    """
+    loaded = index_reloader.loaded_version()
+    manifest = snapshots.read_manifest(snapshots.snapshot_path(loaded)) if loaded else None
+    return {
+        "loaded": loaded,
+        "current": snapshots.current_version(),
+        "versions": snapshots.list_versions(),
+        "manifest": {k: v for k, v in manifest.items() if k != "files"} if manifest else None,
+    }
+
+@app.post("/admin/reload")
+async def reload_index(request: ReloadRequest = None):
+    """
+    加载新快照并原子切换，加载期间旧索引继续服务
+    """
+    from starlette.concurrency import run_in_threadpool
+    request = request or ReloadRequest()
+    try:
+        return await run_in_threadpool(index_reloader.reload, request.version, request.force)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/memory")
+async def memory(shards: bool = False):
+    """
+    当前 worker 的内存占用 (PSS 为均摊共享页后的真实占用) 与各已加载组件的内存估算；
+    shards=true 时同时查询各分片进程
+    """
+    from starlette.concurrency import run_in_threadpool
+    report = {**process_memory(), **await run_in_threadpool(component_memory)}
+    if shards and components.is_loaded("retriever") and hasattr(components.get("retriever"), "shard_memory"):
+        report["shards"] = await run_in_threadpool(components.get("retriever").shard_memory)
+    return report
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus 文本格式指标
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     return """
@@ -0,0 +1,197 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional
+from app.core.config import settings
+from app.core.metrics import QUEUE_DEPTH, ADMISSION_REJECTED, DEGRADATIONS
+
+# 请求截止时间、准入控制与降级策略 (/ask)：
+#   - 每个请求带一个 Deadline (REQUEST_DEADLINE，可由请求缩短)，通过 contextvar 传递到各阶段：
+#     工具等待、分片检索超时、生成的时间上限均不超过剩余时间
+#   - 同时执行的请求数不超过 ADMISSION_MAX_INFLIGHT，排队数不超过 ADMISSION_MAX_QUEUE，
+#     队列已满时立即拒绝 (429)，排队超过截止时间同样拒绝，不让延迟无限增长
+#   - 开始执行时按排队压力与剩余时间选择降级级别：减小检索 k、只重排前若干候选或跳过重排、
+#     降低输出 token 上限；实际应用的降级写入响应与指标
+
+_current_deadline: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("current_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """
+    准入队列已满或排队超时
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    请求在进入下一阶段前已超过截止时间
+    """
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.at
+
+    def check(self, stage: str):
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Deadline):
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def remaining_time(default: Optional[float] = None) -> Optional[float]:
+    """
+    当前请求的剩余时间，不在请求中时返回 default；有 default 时取两者较小值
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+    return deadline.remaining() if default is None else min(default, deadline.remaining())
+
+
+@dataclass
+class Degradation:
+    level: int = 0  # 0 正常 | 1 轻度 | 2 重度
+    retrieve_k: int = 0
+    rerank_candidates: Optional[int] = None  # None 重排全部候选，0 跳过重排
+    max_output_tokens: int = 0
+    applied: List[str] = field(default_factory=list)
+
+    def skip_rerank(self, reason: str):
+        if self.rerank_candidates != 0:
+            self.rerank_candidates = 0
+            self.applied = [a for a in self.applied if a != "rerank_truncated"] + [reason]
+
+
+def degradation_plan(pressure: float, remaining: float) -> Degradation:
+    """
+    pressure 为排队数 / ADMISSION_MAX_QUEUE；剩余时间不足 DEGRADE_MIN_GENERATE_SECONDS 时按重度降级
+    """
+    plan = Degradation(retrieve_k=settings.RETRIEVE_K, max_output_tokens=settings.MAX_OUTPUT_TOKENS)
+    if pressure >= settings.DEGRADE_HEAVY_RATIO or remaining < settings.DEGRADE_MIN_GENERATE_SECONDS:
+        plan.level = 2
+    elif pressure >= settings.DEGRADE_LIGHT_RATIO:
+        plan.level = 1
+    if plan.level == 0:
+        return plan
+
+    if settings.DEGRADE_RETRIEVE_K < plan.retrieve_k:
+        plan.retrieve_k = settings.DEGRADE_RETRIEVE_K
+        plan.applied.append("retrieve_k")
+    if plan.level == 1:
+        plan.rerank_candidates = settings.DEGRADE_RERANK_CANDIDATES
+        plan.applied.append("rerank_truncated")
+    else:
+        plan.skip_rerank("rerank_skipped")
+    if settings.DEGRADE_MAX_OUTPUT_TOKENS < plan.max_output_tokens:
+        plan.max_output_tokens = settings.DEGRADE_MAX_OUTPUT_TOKENS
+        plan.applied.append("max_output_tokens")
+    return plan
+
+
+def record_degradation(plan: Degradation):
+    for name in plan.applied:
+        DEGRADATIONS.labels(name).inc()
+
+
+class Ticket:
+    """
+    已通过准入的请求：start() 在执行线程中等待空闲的执行槽位，close() 释放 (可重复调用)
+    """
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = False
+        self.closed = False
+
+    def start(self, deadline: Deadline) -> float:
+        """
+        等待执行槽位，返回开始执行时的排队压力；等到截止时间仍未轮到则抛出 Overloaded
+        """
+        return self.controller._start(self, deadline)
+
+    def close(self):
+        self.controller._close(self)
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = None, max_queue: int = None):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self._admitted = 0
+        self._running = 0
+        self._cond = threading.Condition()
+
+    def _limits(self):
+        return (max(1, self.max_inflight or settings.ADMISSION_MAX_INFLIGHT),
+                max(0, self.max_queue if self.max_queue is not None else settings.ADMISSION_MAX_QUEUE))
+
+    def _update_gauges(self):
+        QUEUE_DEPTH.labels("ask_running").set(self._running)
+        QUEUE_DEPTH.labels("ask_waiting").set(self._admitted - self._running)
+
+    def admit(self) -> Ticket:
+        """
+        非阻塞准入检查 (在事件循环中调用)：执行中 + 排队的请求已达上限时抛出 Overloaded
+        """
+        max_inflight, max_queue = self._limits()
+        with self._cond:
+            if self._admitted >= max_inflight + max_queue:
+                ADMISSION_REJECTED.labels("queue_full").inc()
+                raise Overloaded("Too many requests queued")
+            self._admitted += 1
+            self._update_gauges()
+        return Ticket(self)
+
+    def _start(self, ticket: Ticket, deadline: Deadline) -> float:
+        max_inflight, max_queue = self._limits()
+        with self._cond:
+            while self._running >= max_inflight:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    ADMISSION_REJECTED.labels("queue_timeout").inc()
+                    raise Overloaded("Deadline exceeded while queued")
+                self._cond.wait(remaining)
+            self._running += 1
+            ticket.started = True
+            waiting = self._admitted - self._running
+            self._update_gauges()
+        return waiting / max_queue if max_queue else 0.0
+
+    def _close(self, ticket: Ticket):
+        with self._cond:
+            if ticket.closed:
+                return
+            ticket.closed = True
+            self._admitted -= 1
+            if ticket.started:
+                self._running -= 1
+            self._update_gauges()
+            self._cond.notify()
+
+    def status(self) -> dict:
+        max_inflight, max_queue = self._limits()
+        with self._cond:
+            return {"running": self._running, "waiting": self._admitted - self._running,
+                    "max_inflight": max_inflight, "max_queue": max_queue}
+
+
+admission = AdmissionController()
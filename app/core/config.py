@@ -18,21 +18,142 @@ class Settings(BaseSettings):
     # 工具 API
     WEATHER_API_URL: str = "https://api.weatherapi.com/v1"
     WEATHER_API_KEY: str = "mock_key"
+    TOOL_MAX_WORKERS: int = 8
+    TOOL_TIMEOUT: float = 3.0  # 工具调用截止时间 (秒)，超时后不再等待
+    TOOL_CONNECT_TIMEOUT: float = 1.0
+    TOOL_CACHE_SIZE: int = 1024
+    WEATHER_CACHE_TTL: float = 600.0
+    ENGINEERING_CACHE_TTL: float = 3600.0
+    STABILITY_MAX_GRID: int = 10_000_000  # 安全系数批量/网格计算的最大组合数
     
     # 运行参数
     DEVICE: str = "cpu"
+    INFERENCE_BACKEND: str = "torch"  # 嵌入/重排推理后端: torch | int8 | onnx
+    INFERENCE_THREADS: int = 0  # CPU 推理线程数，0 表示默认
+    ONNX_EXPORT_DIR: str = "models/onnx"
     MAX_INPUT_TOKENS: int = 2048
     MAX_OUTPUT_TOKENS: int = 1024
     MAX_CTX_TOKENS: int = 1500
+    STRUCTURED_OUTPUT: str = "schema"  # 结构化输出: schema | json | off
+    SPECULATIVE_DECODING: str = "off"  # 本地模型投机解码: off | draft | prompt_lookup
+    DRAFT_MODEL_ID: Optional[str] = None  # 草稿模型，需与 SFT_MODEL_ID 使用相同的 tokenizer
+    PROMPT_LOOKUP_TOKENS: int = 10  # prompt_lookup 每步起草的 token 数
+    PROMPT_LOOKUP_NGRAM: int = 3  # prompt_lookup 匹配的最大 n-gram 长度
+    
+    # 请求截止时间与准入控制 (/ask)：超出 ADMISSION_MAX_INFLIGHT + ADMISSION_MAX_QUEUE 的请求直接返回 429
+    REQUEST_DEADLINE: float = 30.0  # 每个请求的截止时间 (秒)，请求可通过 deadline_ms 缩短
+    ADMISSION_MAX_INFLIGHT: int = 4  # 每个 worker 同时执行 Pipeline 的请求数
+    ADMISSION_MAX_QUEUE: int = 16  # 每个 worker 的排队上限
+    # 降级：排队数 / ADMISSION_MAX_QUEUE 达到 LIGHT 比例时轻度降级 (减小 k、只重排前若干候选、降低输出上限)，
+    # 达到 HEAVY 比例或剩余时间不足 DEGRADE_MIN_GENERATE_SECONDS 时重度降级 (跳过重排)
+    DEGRADE_LIGHT_RATIO: float = 0.25
+    DEGRADE_HEAVY_RATIO: float = 0.75
+    DEGRADE_MIN_GENERATE_SECONDS: float = 5.0
+    DEGRADE_RETRIEVE_K: int = 20
+    DEGRADE_RERANK_CANDIDATES: int = 10
+    DEGRADE_MAX_OUTPUT_TOKENS: int = 384
     
     # 检索参数
     INDEX_BACKEND: str = "faiss"
     RERANK_TOPN: int = 5
     RETRIEVE_K: int = 50
+    VECTOR_CODEC: str = "flat"  # 向量编码: flat | fp16 | sq8 | pq
+    PQ_M: int = 64  # PQ 子空间数
+    RESCORE_FACTOR: int = 4  # 压缩编码召回 k * RESCORE_FACTOR 个候选后精确重排
+    VECTOR_TRAIN_SAMPLE: int = 20000  # 非 flat 编码训练量化器的随机样本数 (首批导入中随机抽取，先于其余 chunk 向量化)
+    
+    # BM25 中文分词 (jieba)：总是加载内置的边坡工程用户词典，TOKENIZER_USER_DICT 为额外词典 (jieba 格式)
+    TOKENIZER_MODE: str = "search"  # search (cut_for_search，长词再切出短词) | precise (cut)
+    TOKENIZER_USER_DICT: Optional[str] = None
+    TOKENIZER_CACHE_SIZE: int = 10000  # 查询分词 LRU 缓存条数
+    TOKENIZER_WORKERS: int = 1  # 导入分词进程数
+    TOKENIZER_PARALLEL_MIN: int = 5000  # chunk 数达到此值才启用多进程分词
+    
+    # 分片检索：SHARDS > 1 时按 SHARD_KEY (doc | hash) 将 chunk 划分到多个分片进程，协调进程并发检索后合并
+    SHARDS: int = 1
+    SHARD_ADDRESSES: str = ""  # 逗号分隔的 host:port，为空时在本机启动 SHARDS 个分片子进程
+    SHARD_KEY: str = "doc"
+    SHARD_AUTHKEY: Optional[str] = None  # 跨节点分片的共享密钥 (SHARD_ADDRESSES / --listen 必填，至少 16 字符)；本机分片自动生成
+    SHARD_TIMEOUT: float = 5.0  # 单个分片检索超时 (秒)，超时的分片结果被跳过
+    SHARD_START_TIMEOUT: float = 60.0
+    
+    # 引用校验：检查引用摘录与 rationale 各句在上下文中的字符 n-gram 覆盖率
+    CITATION_SPAN_CHECK: bool = True
+    CITATION_NGRAM: int = 4
+    CITATION_SUPPORT_THRESHOLD: float = 0.5
+    
+    # PDF 解析：逐页流式处理，每 PDF_PAGE_WINDOW 页重新打开文件以释放解析缓存
+    PDF_PAGE_WINDOW: int = 50
+    
+    # 导入时文档向量化：按长度分批，EMBED_WORKERS > 1 时多进程并行 (各绑定一段 CPU 核)
+    EMBED_WORKERS: int = 1
+    EMBED_BATCH_SIZE: int = 32
+    EMBED_WRITE_BATCH: int = 4096  # 每累计这么多条向量写入一次索引
+    
+    # 导入时近重复检测 (MinHash + LSH)，Jaccard 估计值 >= DEDUP_THRESHOLD 视为重复
+    DEDUP_ENABLED: bool = True
+    DEDUP_THRESHOLD: float = 0.85
+    DEDUP_NUM_PERM: int = 128
+    DEDUP_BANDS: int = 16  # 需整除 DEDUP_NUM_PERM
+    DEDUP_SHINGLE: int = 5  # 字符 n-gram 长度
+    
+    # 多 worker 部署 (python -m app.api.serve)：索引以只读 mmap 加载，fork 前预加载共享
+    WORKERS: int = 1
+    INDEX_MMAP: bool = False
+    PRELOAD_MODELS: bool = True  # 仅在 DEVICE=cpu 时于 fork 前加载模型
+    MEMORY_REPORT_INTERVAL: float = 300.0
+
+    # 内存预算与核算 (GET /memory 按组件列出)：导入缓冲超过 INGEST_BUFFER_MB 时先写入索引，
+    # 进程 RSS 超过 MEMORY_BUDGET_MB 时拒绝 / 中止导入 (0 表示不限制)
+    MEMORY_BUDGET_MB: float = 0
+    INGEST_BUFFER_MB: float = 256
+    MEMORY_TRACEMALLOC: bool = False  # 导入前后对比 tracemalloc 快照 (开销较大，仅用于排查)
+    MEMORY_TRACEMALLOC_TOP: int = 20
+    MEMORY_TRACEMALLOC_FRAMES: int = 1
+    
+    # 启动时在后台预加载模型与索引 (端口先绑定，/ready 表示就绪)
+    WARMUP_ON_STARTUP: bool = True
+    
+    # 索引快照 (python -m app.index.build)：服务检测到 INDEX_DIR/CURRENT 变化后热加载
+    SNAPSHOT_WATCH_INTERVAL: float = 30.0  # 检查间隔 (秒)，0 表示只通过 SIGHUP / POST /admin/reload 触发
+    SNAPSHOT_VERIFY_CHECKSUMS: bool = True  # 加载前校验 manifest 中的 sha256
+    SNAPSHOT_GRACE_SECONDS: float = 60.0  # 切换后旧索引保留的时间 (处理中的请求)
+    SNAPSHOT_KEEP: int = 3
+    
+    # 批量问答 (POST /batch)：整组问题合并检索与重排，结果逐条写入 BATCH_DIR/<job_id>.jsonl
+    BATCH_QUESTION_SIZE: int = 32  # 每组合并检索/重排的问题数
+    BATCH_RERANK_SIZE: int = 64  # 交叉编码器 predict 的批大小
+    BATCH_GENERATE_CONCURRENCY: int = 4  # OpenAI 兼容接口的并发生成数 (本地模型逐条生成)
+    BATCH_MAX_QUESTIONS: int = 10000
+    BATCH_DIR: str = "outputs/batch"
+
+    # 离线评估的 LLM 评审 (忠实度)：评审结果按 (问题, 回答, 上下文) 哈希缓存到 EVAL_JUDGE_CACHE，重新评估只评审有变化的输出
+    EVAL_JUDGE_WORKERS: int = 4  # 并发的评审批次数 (本地模型建议为 1，由批量生成提供并行)
+    EVAL_JUDGE_BATCH_SIZE: int = 8  # 每次生成调用的评审 Prompt 数
+    EVAL_JUDGE_MAX_TOKENS: int = 128
+    EVAL_JUDGE_CONTEXT_CHARS: int = 6000  # 送入评审 Prompt 的上下文截断长度
+    EVAL_JUDGE_CACHE: str = "outputs/judge_cache.jsonl"
+    EVAL_JUDGE_MODEL: Optional[str] = None  # 评审模型标识 (计入缓存键)，默认按 OPENAI_BASE_URL / SFT_MODEL_ID 推断
     
     # 路径配置
     DATA_DIR: str = "data/sample_docs"
     INDEX_DIR: str = "data/index"
+    
+    # 日志 (LOG_FORMAT: json | text)
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_RETRIEVAL_SAMPLE: float = 1.0  # 检索高频日志采样比例
+    LOG_RETRIEVAL_MAX_PER_SEC: float = 50.0  # 检索高频日志每秒上限，0 表示不限
+    
+    # 请求追踪 (尾部采样，仅保留最慢的 TRACE_KEEP_RATIO 比例)
+    TRACE_ENABLED: bool = True
+    TRACE_FILE: str = "outputs/traces.jsonl"
+    TRACE_KEEP_RATIO: float = 0.05
+    TRACE_WINDOW: int = 1000
+    TRACE_PROFILE_RATE: float = 0.0  # 开启 profiler 的请求比例，0 表示关闭
+    TRACE_PROFILER: str = "cprofile"  # cprofile | stack
+    TRACE_PROFILE_DIR: str = "outputs/profiles"
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
@@ -1,28 +1,190 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import random
 import sys
-from typing import Any
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+from app.core.config import settings
+
+# 日志写出在独立线程中完成：请求线程只做一次非阻塞入队，
+# 消息格式化 (msg % args) 与 stdout 写入都在 QueueListener 线程中进行。
+
+# LogRecord 自带字段，其余字段视为通过 extra 传入的结构化数据
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    结构化 JSON 日志，extra 中的字段 (如 stage_timings) 原样输出
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TraceContextFilter(logging.Filter):
+    """
+    在请求线程中捕获当前 trace_id (contextvar 无法在 listener 线程中读取)
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        from app.core.tracing import current_trace
+        trace = current_trace()
+        if trace is not None and not hasattr(record, "trace_id"):
+            record.trace_id = trace.trace_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    高频日志的采样与限流：先按 sample_ratio 采样，再用令牌桶限制每秒条数。
+    WARNING 及以上级别不受影响。
+    """
+    def __init__(self, sample_ratio: float = 1.0, max_per_second: float = 0.0):
+        super().__init__()
+        self.sample_ratio = sample_ratio
+        self.max_per_second = max_per_second
+        self._tokens = max_per_second
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        if self.sample_ratio < 1.0 and random.random() >= self.sample_ratio:
+            self.dropped += 1
+            return False
+        if self.max_per_second > 0:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.max_per_second, self._tokens + (now - self._last) * self.max_per_second)
+                self._last = now
+                if self._tokens < 1.0:
+                    self.dropped += 1
+                    return False
+                self._tokens -= 1.0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    队列满时直接丢弃并计数，绝不阻塞请求线程
+    """
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 进程内队列无需序列化，保留 msg/args 交给 listener 线程延迟格式化
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+
+
+def _build_formatter() -> logging.Formatter:
+    if settings.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _reinit_after_fork():
+    """
+    fork 后子进程中没有 listener 线程，且旧队列的锁可能处于被持有状态：换新队列并重启 listener
+    """
+    global _listener
+    if _listener is None:
+        return
+    new_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    for handler in logging.getLogger("slope_rag").handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            handler.queue = new_queue
+    _listener = QueueListener(new_queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reinit_after_fork)
+
 
 def setup_logging(name: str = "slope_rag") -> logging.Logger:
     """
-    配置结构化日志
+    配置结构化日志：QueueHandler 入队，QueueListener 在后台线程写 stdout
     """
+    global _listener
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
+    logger.setLevel(settings.LOG_LEVEL)
+
     if not logger.handlers:
-        handler = logging.StreamHandler(sys.stdout)
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-        
+        log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(TraceContextFilter())
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(_build_formatter())
+        _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_stop_listener)
+
     return logger
 
+
+def get_logger(component: str, sample_ratio: float = 1.0, max_per_second: float = 0.0) -> logging.Logger:
+    """
+    获取子 logger (共享根 logger 的队列)，可为高频组件配置采样/限流
+    """
+    child = logging.getLogger(f"slope_rag.{component}")
+    if (sample_ratio < 1.0 or max_per_second > 0) and not any(isinstance(f, SamplingFilter) for f in child.filters):
+        child.addFilter(SamplingFilter(sample_ratio, max_per_second))
+    return child
+
+
 logger = setup_logging()
 
-def log_retrieval_metrics(query: str, initial_count: int, reranked_count: int, scores: list[float]):
+# 检索相关日志每个请求会输出多条，按配置采样与限流
+retrieval_logger = get_logger(
+    "retrieval",
+    sample_ratio=settings.LOG_RETRIEVAL_SAMPLE,
+    max_per_second=settings.LOG_RETRIEVAL_MAX_PER_SEC,
+)
+
+def log_retrieval_metrics(query: str, initial_count: int, reranked_count: int, scores: list[float], **extra: Any):
     """
     记录检索过程的关键指标
     """
-    logger.info(f"Query: {query} | Initial Docs: {initial_count} | Reranked Docs: {reranked_count} | Top Scores: {scores[:3]}")
+    retrieval_logger.info(
+        "Query: %.100s | Initial Docs: %d | Reranked Docs: %d | Top Scores: %s",
+        query, initial_count, reranked_count, scores[:3],
+        extra={"event": "retrieval", "initial_docs": initial_count, "reranked_docs": reranked_count, **extra}
+    )
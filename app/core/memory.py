@@ -0,0 +1,283 @@
+import itertools
+import os
+import sys
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+from app.core.config import settings
+from app.core.logging import logger
+
+# 进程内存统计：Linux 下读取 /proc/<pid>/smaps_rollup。
+# 多 worker 共享内存时 RSS 会重复计算共享页，PSS (按共享进程数均摊) 才是每个 worker 的真实占用。
+
+_SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared_clean",
+    "Shared_Dirty": "shared_dirty",
+    "Private_Clean": "private_clean",
+    "Private_Dirty": "private_dirty",
+    "Swap": "swap",
+}
+
+
+def process_memory(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    返回进程内存 (字节)：rss / pss / shared_* / private_* / swap
+    """
+    target = "self" if pid is None else str(pid)
+    stats = {"pid": pid or os.getpid()}
+    try:
+        with open(f"/proc/{target}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                key = parts[0].rstrip(":")
+                if key in _SMAPS_FIELDS:
+                    stats[_SMAPS_FIELDS[key]] = int(parts[1]) * 1024
+    except OSError:
+        # 非 Linux 平台仅能获取峰值 RSS
+        import resource
+        stats["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return stats
+
+
+def workers_memory_report(pids: Iterable[int]) -> Dict[str, object]:
+    """
+    汇总多个 worker 的内存：total_pss 才能反映整机真实占用
+    """
+    workers: List[Dict[str, int]] = [process_memory(pid) for pid in pids]
+    return {
+        "workers": workers,
+        "total_rss": sum(w.get("rss", 0) for w in workers),
+        "total_pss": sum(w.get("pss", 0) for w in workers),
+        "shared": sum(w.get("shared_clean", 0) + w.get("shared_dirty", 0) for w in workers),
+    }
+
+
+def format_bytes(num: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num) < 1024:
+            return f"{num:.1f}{unit}"
+        num /= 1024
+    return f"{num:.1f}TB"
+
+
+# 按组件的内存核算 (GET /memory 与启动日志)：
+#   - 已加载的组件实现 memory_usage() -> {类别: 字节}，如索引向量、chunk 文本、倒排表、模型权重、缓存；
+#     Python 对象按抽样估算 (sys.getsizeof)，numpy / torch 按实际缓冲区大小统计
+#   - mmap 加载的索引 (INDEX_MMAP) 位于页缓存，按文件大小计入，多 worker 间共享
+#   - 进行中的导入缓冲 (IngestBuffer) 单独列出；RSS 减去已核算部分为 unaccounted (解释器、分配器碎片等)
+#   - 预算：导入缓冲超过 INGEST_BUFFER_MB 时先写入索引 (spill)，进程 RSS 超过 MEMORY_BUDGET_MB 时拒绝导入
+
+SAMPLE_SIZE = 1000
+
+_active_buffers: "weakref.WeakSet" = weakref.WeakSet()
+
+
+class MemoryBudgetExceeded(Exception):
+    """
+    进程内存超过 MEMORY_BUDGET_MB
+    """
+
+
+def current_rss() -> int:
+    """
+    当前 RSS (字节)，读取 /proc/self/statm，开销远小于 smaps_rollup，可在导入循环中频繁调用
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def budget_bytes() -> int:
+    return int(settings.MEMORY_BUDGET_MB * 1024 * 1024)
+
+
+def check_budget(stage: str):
+    """
+    进程 RSS 超过 MEMORY_BUDGET_MB (0 表示不限制) 时抛出 MemoryBudgetExceeded
+    """
+    budget = budget_bytes()
+    if budget <= 0:
+        return
+    rss = current_rss()
+    if rss > budget:
+        raise MemoryBudgetExceeded(f"RSS {format_bytes(rss)} exceeds MEMORY_BUDGET_MB "
+                                   f"({format_bytes(budget)}) during {stage}")
+
+
+def object_bytes(obj: Any) -> int:
+    """
+    单个对象及其直接属性 (字符串、元数据字典) 的浅层大小
+    """
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, "__dict__", None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+        for value in attrs.values():
+            size += sys.getsizeof(value)
+            if isinstance(value, dict):
+                size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+def sampled_bytes(items: Sequence[Any], size_fn: Callable[[Any], int] = object_bytes) -> int:
+    """
+    容器本身加元素大小：元素超过 SAMPLE_SIZE 个时等距抽样后按均值外推
+    """
+    n = len(items)
+    if n == 0:
+        return sys.getsizeof(items)
+    step = max(1, n // SAMPLE_SIZE)
+    sample = [size_fn(items[i]) for i in range(0, n, step)]
+    return sys.getsizeof(items) + int(sum(sample) / len(sample) * n)
+
+
+def documents_bytes(documents: Any) -> int:
+    """
+    chunk 存储：只读 ChunkStore 按 mmap 文件中的文本字节数，list 按抽样估算
+    """
+    text_bytes = getattr(documents, "text_bytes", None)
+    if text_bytes is not None:
+        return int(text_bytes())
+    return sampled_bytes(documents)
+
+
+def mapping_bytes(mapping: Dict[Any, Any], value_bytes: Callable[[Any], int] = sys.getsizeof) -> int:
+    """
+    字典 (如 BM25 词表、jieba 词频表)：哈希表本身加抽样估算的键值大小
+    """
+    n = len(mapping)
+    if n == 0:
+        return sys.getsizeof(mapping)
+    keys = list(itertools.islice(mapping, SAMPLE_SIZE))
+    per_item = sum(sys.getsizeof(k) + value_bytes(mapping[k]) for k in keys) / len(keys)
+    return sys.getsizeof(mapping) + int(per_item * n)
+
+
+def tensor_bytes(model: Any) -> Optional[int]:
+    """
+    torch 模型的权重与缓冲区大小 (含 int8 动态量化的打包权重)，按存储去重；非 torch 模型返回 None
+    """
+    state_dict = getattr(model, "state_dict", None)
+    if state_dict is None:
+        return None
+    seen, total = set(), 0
+
+    def add(value):
+        nonlocal total
+        if isinstance(value, (tuple, list)):
+            for v in value:
+                add(v)
+            return
+        if not hasattr(value, "element_size"):
+            return
+        try:
+            key = value.untyped_storage().data_ptr()
+        except Exception:
+            key = id(value)
+        if key not in seen:
+            seen.add(key)
+            total += value.numel() * value.element_size()
+
+    for value in state_dict().values():
+        add(value)
+    return total
+
+
+def track_buffer(buffer: Any):
+    """
+    登记进行中的导入缓冲 (需实现 nbytes())，在组件报告中以 ingest_buffer 列出
+    """
+    _active_buffers.add(buffer)
+
+
+def component_memory() -> Dict[str, Any]:
+    """
+    各已加载组件的内存估算 (不会触发组件加载)：
+        {"rss", "components": {name: {"bytes", "breakdown"}}, "accounted", "unaccounted", "budget"}
+    """
+    from app.core.registry import components
+
+    report: Dict[str, Any] = {}
+    for name in components.names():
+        if not components.is_loaded(name):
+            continue
+        usage = getattr(components.get(name), "memory_usage", None)
+        if usage is None:
+            continue
+        try:
+            breakdown = {k: int(v) for k, v in usage().items() if v is not None}
+        except Exception as e:
+            logger.warning("Memory accounting failed for component %s: %s", name, e)
+            continue
+        report[name] = {"bytes": sum(breakdown.values()), "breakdown": breakdown}
+
+    buffers = list(_active_buffers)
+    if buffers:
+        sizes = [b.nbytes() for b in buffers]
+        report["ingest_buffer"] = {"bytes": sum(sizes), "breakdown": {"chunks": sum(sizes), "active": len(sizes)}}
+
+    rss = current_rss()
+    accounted = sum(c["bytes"] for c in report.values())
+    return {
+        "rss": rss,
+        "components": report,
+        "accounted": accounted,
+        "unaccounted": max(0, rss - accounted),
+        "budget": {"memory_budget": budget_bytes(), "ingest_buffer": int(settings.INGEST_BUFFER_MB * 1024 * 1024)},
+    }
+
+
+def log_component_memory(stage: str = "startup"):
+    report = component_memory()
+    summary = ", ".join(f"{name}={format_bytes(c['bytes'])}"
+                        for name, c in sorted(report["components"].items(), key=lambda kv: -kv[1]["bytes"]))
+    logger.info("Component memory at %s: RSS %s (%s; unaccounted %s)", stage, format_bytes(report["rss"]),
+                summary or "no components loaded", format_bytes(report["unaccounted"]),
+                extra={"event": "component_memory", "stage": stage, **report})
+    return report
+
+
+@contextmanager
+def traced_allocations(label: str, enabled: Optional[bool] = None, top: Optional[int] = None):
+    """
+    MEMORY_TRACEMALLOC 开启时在代码块前后各取一次 tracemalloc 快照，按分配位置对比增长最多的前 top 项。
+    产出的 dict 在退出时填充 (未开启时为空)：
+        with traced_allocations("ingest") as diff:
+            ...
+    """
+    enabled = settings.MEMORY_TRACEMALLOC if enabled is None else enabled
+    result: Dict[str, Any] = {}
+    if not enabled:
+        yield result
+        return
+    import tracemalloc
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(settings.MEMORY_TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+    before = tracemalloc.take_snapshot().filter_traces(ignore)
+    try:
+        yield result
+    finally:
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        diff = after.compare_to(before, "lineno")
+        _, peak = tracemalloc.get_traced_memory()
+        if started:
+            tracemalloc.stop()
+        result.update({
+            "label": label,
+            "size_diff": sum(s.size_diff for s in diff),
+            "peak": peak,
+            "top": [{"location": f"{s.traceback[0].filename}:{s.traceback[0].lineno}",
+                     "size_diff": s.size_diff, "count_diff": s.count_diff}
+                    for s in diff[:top or settings.MEMORY_TRACEMALLOC_TOP]],
+        })
+        logger.info("tracemalloc %s: net %s, peak %s", label, format_bytes(result["size_diff"]), format_bytes(peak),
+                    extra={"event": "tracemalloc", **result})
@@ -0,0 +1,287 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Tuple, Sequence, Optional
+from app.core import tracing
+
+# 轻量指标层：Counter / Gauge / Histogram + Prometheus 文本格式导出。
+# 热路径上每次观测只有一次加锁与一次二分查找，开销可忽略。
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DEFAULT_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # 无标签指标直接在自身上观测
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+
+class _CounterChild:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labelnames, key) -> List[str]:
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = value
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name, labelnames, key) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{labels} {_format_value(self.sum)}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        导出 Prometheus 文本格式 (exposition format 0.0.4)
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_LATENCY = registry.histogram(
+    "slope_rag_stage_latency_seconds", "Latency of each pipeline stage", ["stage"])
+STAGE_CANDIDATES = registry.histogram(
+    "slope_rag_stage_candidates", "Candidates produced by each retrieval stage", ["stage"],
+    buckets=DEFAULT_COUNT_BUCKETS)
+CACHE_REQUESTS = registry.counter(
+    "slope_rag_cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"])
+LLM_TOKENS = registry.counter(
+    "slope_rag_llm_tokens_total", "LLM tokens by direction (in/out)", ["direction"])
+LLM_RESPONSES = registry.counter(
+    "slope_rag_llm_responses_total", "LLM responses by parse result (json/fallback)", ["result"])
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "slope_rag_llm_tokens_per_second", "Local generation throughput by decoding mode", ["mode"],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+LLM_DRAFT_ACCEPTANCE = registry.histogram(
+    "slope_rag_llm_draft_acceptance_ratio", "Share of output tokens taken from accepted drafts", ["mode"],
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+QUEUE_DEPTH = registry.gauge(
+    "slope_rag_queue_depth", "Requests currently queued or in flight", ["queue"])
+INGEST_CHUNKS = registry.counter(
+    "slope_rag_ingest_chunks_total", "Ingested chunks by near-duplicate result (kept/duplicate)", ["result"])
+HTTP_REQUESTS = registry.counter(
+    "slope_rag_http_requests_total", "HTTP requests by path and status", ["path", "status"])
+HTTP_LATENCY = registry.histogram(
+    "slope_rag_http_request_seconds", "HTTP request latency by path", ["path"])
+TOKENIZER_CHARS = registry.counter(
+    "slope_rag_tokenizer_chars_total", "Characters tokenized by mode (query/ingest)", ["mode"])
+TOKENIZER_SECONDS = registry.counter(
+    "slope_rag_tokenizer_seconds_total", "Time spent tokenizing by mode (query/ingest)", ["mode"])
+ADMISSION_REJECTED = registry.counter(
+    "slope_rag_admission_rejected_total", "Requests rejected by admission control by reason", ["reason"])
+DEGRADATIONS = registry.counter(
+    "slope_rag_degradations_total", "Degradations applied to requests under load or deadline pressure", ["degradation"])
+BATCH_QUESTIONS = registry.counter(
+    "slope_rag_batch_questions_total", "Questions answered by batch jobs by result (ok/error)", ["result"])
+EVAL_JUDGMENTS = registry.counter(
+    "slope_rag_eval_judgments_total", "Faithfulness judgments by result (judged/cached/failed)", ["result"])
+
+
+@contextmanager
+def stage_timer(stage: str, **attributes):
+    """
+    统计一个 Pipeline 阶段的耗时，并在当前 trace 中记录同名 span:
+        with stage_timer("rerank") as span:
+            ...
+            span.set(candidates=len(docs))
+    """
+    start = time.perf_counter()
+    with tracing.span(stage, **attributes) as s:
+        try:
+            yield s
+        finally:
+            STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+
+def timed(stage: str):
+    """
+    stage_timer 的装饰器形式
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_candidates(stage: str, count: int):
+    STAGE_CANDIDATES.labels(stage).observe(count)
+    tracing.annotate(**{f"{stage}_candidates": count})
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_tokens(tokens_in: int, tokens_out: int):
+    LLM_TOKENS.labels("in").inc(tokens_in)
+    LLM_TOKENS.labels("out").inc(tokens_out)
+    tracing.annotate(tokens_in=tokens_in, tokens_out=tokens_out)
+
+
+def record_generation(mode: str, tokens_out: int, steps: int, seconds: float):
+    """
+    本地生成的吞吐与草稿接受率：每个校验步产出 1 个模型自身的 token，其余来自被接受的草稿
+    """
+    tokens_per_sec = tokens_out / seconds if seconds > 0 else 0.0
+    acceptance = max(0, tokens_out - steps) / tokens_out if tokens_out else 0.0
+    LLM_TOKENS_PER_SECOND.labels(mode).observe(tokens_per_sec)
+    if mode != "off":
+        LLM_DRAFT_ACCEPTANCE.labels(mode).observe(acceptance)
+    tracing.annotate(decode_mode=mode, tokens_per_sec=round(tokens_per_sec, 1),
+                     decode_steps=steps, draft_acceptance=round(acceptance, 3))
@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+from app.core.logging import logger
+
+# 组件注册表：重量级组件 (模型、索引) 以工厂函数注册，首次使用时才导入依赖并加载。
+# 模块级单例通过 LazyProxy 暴露，调用方式与原先的全局对象一致。
+
+
+class ComponentRegistry:
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._errors: Dict[str, str] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+
+    def override(self, name: str, instance: Any):
+        """
+        直接指定组件实例 (用于测试替身或基准测试)
+        """
+        with self._lock:
+            self._locks.setdefault(name, threading.Lock())
+            self._instances[name] = instance
+            self._errors.pop(name, None)
+
+    def reset(self, name: str):
+        with self._lock:
+            self._instances.pop(name, None)
+            self._load_seconds.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        if name not in self._locks:
+            raise KeyError(f"Component not registered: {name}")
+        with self._locks[name]:
+            # 双重检查，避免并发请求重复加载
+            instance = self._instances.get(name)
+            if instance is None:
+                logger.info("Loading component: %s", name)
+                start = time.perf_counter()
+                try:
+                    instance = self._factories[name]()
+                except Exception as e:
+                    self._errors[name] = repr(e)
+                    raise
+                self._load_seconds[name] = time.perf_counter() - start
+                self._instances[name] = instance
+                self._errors.pop(name, None)
+                logger.info("Component %s loaded in %.2fs", name, self._load_seconds[name])
+        return instance
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._instances
+
+    def names(self) -> Iterable[str]:
+        return list(self._locks)
+
+    def warmup(self, names: Optional[Iterable[str]] = None):
+        """
+        预加载组件，加载失败记录错误但不中断其他组件
+        """
+        for name in names or self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error("Failed to warm up component %s: %s", name, e)
+
+    def ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        return all(self.is_loaded(n) for n in (names or self.names()))
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "loaded": self.is_loaded(name),
+                "load_seconds": self._load_seconds.get(name),
+                "error": self._errors.get(name),
+            }
+            for name in self.names()
+        }
+
+    def lazy(self, name: str, factory: Optional[Callable[[], Any]] = None) -> "LazyProxy":
+        if factory is not None:
+            self.register(name, factory)
+        return LazyProxy(self, name)
+
+
+class LazyProxy:
+    """
+    延迟解析的组件代理：首次访问属性时才触发加载
+    """
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry: ComponentRegistry, name: str):
+        object.__setattr__(self, "_registry", registry)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr: str):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __setattr__(self, attr: str, value: Any):
+        setattr(self._registry.get(self._name), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._registry.is_loaded(self._name) else "not loaded"
+        return f"<LazyProxy {self._name} ({state})>"
+
+
+components = ComponentRegistry()
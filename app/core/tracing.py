@@ -0,0 +1,298 @@
+import contextvars
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque, Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.core.logging import logger
+
+# 请求级 Trace：每个请求一个 trace_id，各阶段记录为 span。
+# 尾部采样：只保留最慢的 N% 请求的完整 trace，写入本地 JSONL；
+# 可选对部分请求开启 cProfile / 栈采样，若该请求最终被判定为慢请求则一并落盘，用于离线火焰图分析。
+
+# 外部传入的 trace_id (X-Trace-Id) 会出现在 profile 文件名中，只接受字母、数字与连字符
+_TRACE_ID = re.compile(r"^[A-Za-z0-9-]{1,64}$")
+
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("span_id", "name", "parent_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self, trace_start: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - trace_start) * 1000, 3),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+
+class _NullSpan:
+    """
+    没有活动 trace 时返回的空 span，保证调用方无需判断
+    """
+    def set(self, **attributes):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+def safe_trace_id(trace_id: Optional[str]) -> str:
+    """
+    合法的 trace_id 原样返回，否则 (缺省、过长或含路径字符) 生成新的 id
+    """
+    if isinstance(trace_id, str) and _TRACE_ID.match(trace_id):
+        return trace_id
+    return uuid.uuid4().hex
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: Optional[str] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = safe_trace_id(trace_id)
+        self.name = name
+        self.wall_start = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.spans: List[Span] = []
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def annotate(self, **attributes):
+        self.attributes.update(attributes)
+
+    def stage_timings(self) -> Dict[str, float]:
+        """
+        各阶段耗时 (毫秒)，同名 span 累加
+        """
+        timings: Dict[str, float] = {}
+        for s in self.spans:
+            if s.end is not None:
+                timings[s.name] = round(timings.get(s.name, 0.0) + (s.end - s.start) * 1000, 3)
+        return timings
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_time": self.wall_start.isoformat(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+            "spans": [s.to_dict(self.start) for s in self.spans],
+        }
+
+
+class TailSampler:
+    """
+    基于滑动窗口分位数的尾部采样：耗时 >= 最近窗口内 (1 - keep_ratio) 分位数的请求被保留
+    """
+    def __init__(self, keep_ratio: float = 0.05, window: int = 1000, min_samples: int = 20):
+        self.keep_ratio = keep_ratio
+        self.min_samples = min_samples
+        self._durations: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def should_keep(self, duration: float) -> bool:
+        with self._lock:
+            history = sorted(self._durations)
+            self._durations.append(duration)
+        if self.keep_ratio >= 1.0:
+            return True
+        if self.keep_ratio <= 0.0:
+            return False
+        if len(history) < self.min_samples:
+            # 预热阶段样本不足，全部保留
+            return True
+        idx = min(len(history) - 1, int(len(history) * (1.0 - self.keep_ratio)))
+        return duration >= history[idx]
+
+
+class StackSampler:
+    """
+    轻量栈采样器：后台线程周期性抓取目标线程的调用栈，输出 collapsed stack 格式，
+    可直接输入 flamegraph.pl / speedscope 生成火焰图
+    """
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Tracer:
+    def __init__(self, trace_file: str = None, keep_ratio: float = None, window: int = None,
+                 profile_rate: float = None, profiler: str = None, profile_dir: str = None,
+                 enabled: bool = None):
+        self.enabled = settings.TRACE_ENABLED if enabled is None else enabled
+        self.trace_file = trace_file or settings.TRACE_FILE
+        self.profile_rate = settings.TRACE_PROFILE_RATE if profile_rate is None else profile_rate
+        self.profiler = profiler or settings.TRACE_PROFILER
+        self.profile_dir = profile_dir or settings.TRACE_PROFILE_DIR
+        self.sampler = TailSampler(
+            keep_ratio=settings.TRACE_KEEP_RATIO if keep_ratio is None else keep_ratio,
+            window=window or settings.TRACE_WINDOW,
+        )
+        self._write_lock = threading.Lock()
+
+    def _start_profiler(self):
+        if self.profile_rate <= 0 or random.random() >= self.profile_rate:
+            return None
+        if self.profiler == "stack":
+            prof = StackSampler(threading.get_ident())
+            prof.start()
+            return prof
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:
+            # 同一线程已有其他 profiler 在运行
+            return None
+        return prof
+
+    def _stop_profiler(self, prof, trace: Trace, keep: bool) -> Optional[str]:
+        if prof is None:
+            return None
+        if isinstance(prof, StackSampler):
+            prof.stop()
+        else:
+            prof.disable()
+        if not keep:
+            return None
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = safe_trace_id(trace.trace_id)
+        if isinstance(prof, StackSampler):
+            path = os.path.join(self.profile_dir, f"{name}.collapsed")
+            prof.dump(path)
+        else:
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            prof.dump_stats(path)
+        return path
+
+    def _export(self, record: Dict[str, Any]):
+        directory = os.path.dirname(self.trace_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._write_lock:
+            with open(self.trace_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    @contextmanager
+    def trace(self, name: str, trace_id: Optional[str] = None, **attributes):
+        """
+        开启一个请求级 trace:
+            with tracer.trace("ask", question=q) as t:
+                ...
+        """
+        trace = Trace(name, trace_id, attributes)
+        if not self.enabled:
+            yield trace
+            return
+
+        token = _current_trace.set(trace)
+        prof = self._start_profiler()
+        try:
+            yield trace
+        except BaseException as e:
+            trace.error = repr(e)
+            raise
+        finally:
+            trace.end = time.perf_counter()
+            _current_trace.reset(token)
+            keep = trace.error is not None or self.sampler.should_keep(trace.duration)
+            try:
+                profile_path = self._stop_profiler(prof, trace, keep)
+                if keep:
+                    record = trace.to_dict()
+                    record["profile"] = profile_path
+                    self._export(record)
+            except Exception as e:
+                logger.warning("Failed to export trace %s: %s", trace.trace_id, e)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def annotate(**attributes):
+    """
+    为当前 trace 添加属性 (如候选数、Token 数)，无活动 trace 时为空操作
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**attributes)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    trace = _current_trace.get()
+    if trace is None:
+        yield NULL_SPAN
+        return
+    s = Span(name, _current_span.get(), attributes)
+    trace.spans.append(s)
+    token = _current_span.set(s.span_id)
+    try:
+        yield s
+    finally:
+        s.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+tracer = Tracer()
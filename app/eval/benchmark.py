@@ -0,0 +1,408 @@
+"""
+检索性能基准测试
+
+在不同规模的合成 (或抽样) 语料上测量:
+  - 分块吞吐 (ingest throughput)
+  - 索引构建耗时、内存与磁盘占用
+  - 各阶段 p50/p95/p99 延迟 (embed, faiss, bm25, fusion, rerank, prompt)
+  - 向量检索相对精确检索的 recall@k (可用 --codecs 对比 flat / fp16 / sq8 / pq 编码)
+  - 不同并发度下 FastAPI /ask 接口的 QPS
+
+用法:
+    python -m app.eval.benchmark --sizes 10000,100000,1000000 --stand-ins
+    python -m app.eval.benchmark --sizes 100000 --codecs flat,sq8,pq --concurrency "" --stand-ins
+结果以 JSON 输出，便于跨提交对比。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Callable
+
+import numpy as np
+
+SLOPE_TERMS = [
+    "边坡", "稳定性", "安全系数", "抗剪强度", "粘聚力", "内摩擦角", "孔隙水压力", "降雨入渗",
+    "滑坡", "抗滑桩", "锚杆", "挡土墙", "排水孔", "监测点", "位移", "预警", "砂岩", "泥岩",
+    "风化层", "坡脚", "坡顶", "裂缝", "地下水位", "有效应力", "极限平衡", "条分法", "支护",
+    "格构梁", "土钉", "喷射混凝土", "岩质边坡", "土质边坡", "设计规范", "荷载组合", "地震工况",
+]
+CONNECTORS = ["的", "在", "条件下", "导致", "需要", "应当", "显著", "进行", "采用", "对", "与"]
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    arr = np.asarray(samples) * 1000.0  # 毫秒
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(arr.mean())}
+
+
+def _timed(fn: Callable, samples: List[float]):
+    start = time.perf_counter()
+    result = fn()
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def _rss_bytes() -> int:
+    """
+    当前进程常驻内存 (Linux 读取 /proc，其他平台回退为峰值 RSS)
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def make_synthetic_pages(num_chunks: int, chunk_chars: int = 400, seed: int = 0):
+    """
+    生成合成语料：每页约 chunk_chars 个字符，分块后约对应一个 chunk
+    """
+    from app.ingest.parser import DocumentChunk
+
+    rng = random.Random(seed)
+    pages = []
+    for i in range(num_chunks):
+        parts = []
+        length = 0
+        while length < chunk_chars:
+            sentence = "".join(
+                rng.choice(SLOPE_TERMS) + rng.choice(CONNECTORS) for _ in range(rng.randint(3, 8))
+            ) + "。"
+            parts.append(sentence)
+            length += len(sentence)
+        pages.append(DocumentChunk(
+            doc_id=f"synthetic_{i // 100}.pdf",
+            page=i % 100 + 1,
+            section_path=f"Page {i % 100 + 1} Content",
+            text="".join(parts)[:chunk_chars],
+            is_table=False
+        ))
+    return pages
+
+
+def make_sampled_pages(num_chunks: int, data_dir: str, chunk_chars: int = 400, seed: int = 0):
+    """
+    从 data_dir 中的真实文档抽样句子拼装语料，保留真实文本分布
+    """
+    from app.ingest.parser import DocumentParser, DocumentChunk
+
+    parser = DocumentParser()
+    sentences = []
+    for name in sorted(os.listdir(data_dir)):
+        for doc in parser.parse(os.path.join(data_dir, name)):
+            sentences.extend(s + "。" for s in doc.text.replace("\n", "。").split("。") if s.strip())
+    if not sentences:
+        return make_synthetic_pages(num_chunks, chunk_chars, seed)
+
+    rng = random.Random(seed)
+    pages = []
+    for i in range(num_chunks):
+        parts = []
+        length = 0
+        while length < chunk_chars:
+            sentence = rng.choice(sentences)
+            parts.append(sentence)
+            length += len(sentence)
+        pages.append(DocumentChunk(
+            doc_id=f"sampled_{i // 100}.pdf",
+            page=i % 100 + 1,
+            section_path=f"Page {i % 100 + 1} Content",
+            text="".join(parts)[:chunk_chars],
+            is_table=False
+        ))
+    return pages
+
+
+def _exact_topk(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    scores = vectors @ query
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def bench_size(num_chunks: int, args, work_dir: str, codec: str = None) -> Dict[str, Any]:
+    from app.core.config import settings
+    from app.ingest.chunker import SemanticChunker
+    from app.llm.embedding import embedding_model
+    from app.search.rerank import reranker
+    from app.search.retrieve import HybridRetriever
+    from app.prompt.prompt_builder import prompt_builder
+
+    codec = codec or settings.VECTOR_CODEC
+    settings.VECTOR_CODEC = codec
+    result: Dict[str, Any] = {"num_chunks": num_chunks, "codec": codec}
+    index_dir = os.path.join(work_dir, f"index_{num_chunks}_{codec}")
+    os.makedirs(index_dir, exist_ok=True)
+    settings.INDEX_DIR = index_dir
+
+    # 1. 语料与分块吞吐
+    if args.source == "sampled":
+        pages = make_sampled_pages(num_chunks, settings.DATA_DIR, seed=args.seed)
+    else:
+        pages = make_synthetic_pages(num_chunks, seed=args.seed)
+    chunker = SemanticChunker(chunk_size=512, chunk_overlap=50)
+    start = time.perf_counter()
+    chunks = chunker.chunk_documents(pages)
+    chunk_secs = time.perf_counter() - start
+    del pages
+    result["ingest"] = {
+        "chunks": len(chunks),
+        "chunk_seconds": chunk_secs,
+        "chunks_per_sec": len(chunks) / chunk_secs if chunk_secs > 0 else None,
+    }
+
+    # 2. 索引构建
+    rss_before = _rss_bytes()
+    retriever = HybridRetriever()
+    start = time.perf_counter()
+    chunks = retriever.vector_index.add_documents(chunks)
+    faiss_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    retriever.bm25_index.add_documents(chunks)
+    bm25_secs = time.perf_counter() - start
+    retriever.vector_index.save(index_dir)
+    retriever.bm25_index.save(index_dir)
+    rss_after = _rss_bytes()
+    vector_index = retriever.vector_index
+    index = vector_index.index
+    result["build"] = {
+        "faiss_seconds": faiss_secs,
+        "embed_workers": settings.EMBED_WORKERS,
+        "embed_chunks_per_sec": len(chunks) / faiss_secs if faiss_secs > 0 else None,
+        "bm25_seconds": bm25_secs,
+        "chunks_per_sec": len(chunks) / (faiss_secs + bm25_secs) if faiss_secs + bm25_secs > 0 else None,
+        "rss_delta_bytes": rss_after - rss_before,
+        "vector_bytes": int(index.ntotal * index.d * 4),
+        "code_bytes": vector_index.code_bytes(),
+        "disk_bytes": _dir_size(index_dir),
+    }
+
+    # 3. 各阶段延迟与 recall
+    rng = random.Random(args.seed + 1)
+    queries = [chunks[rng.randrange(len(chunks))].text[:30] for _ in range(args.queries)]
+    # 精确检索基线：压缩编码时取旁路的原始向量，flat 时直接还原
+    if vector_index.full_vectors is not None:
+        vectors = np.asarray(vector_index.full_vectors)
+    else:
+        vectors = index.reconstruct_n(0, index.ntotal)
+    stages = {name: [] for name in ["embed", "faiss", "bm25", "fusion", "rerank", "prompt"]}
+    recalls, raw_recalls = [], []
+    for query in queries:
+        q_vec = _timed(lambda: embedding_model.embed_query(query), stages["embed"])
+        q_mat = q_vec.reshape(1, -1).astype(np.float32)
+        scores, ids = _timed(lambda: vector_index.search_vectors(q_mat, args.k), stages["faiss"])
+        vector_results = [
+            (retriever.vector_index.documents[i], float(s)) for s, i in zip(scores[0], ids[0]) if i != -1
+        ]
+        bm25_results = _timed(lambda: retriever.bm25_index.search(query, k=args.k), stages["bm25"])
+        fused = _timed(lambda: HybridRetriever.fuse(vector_results, bm25_results, k=args.k), stages["fusion"])
+        reranked = _timed(lambda: reranker.rerank(query, fused, top_n=settings.RERANK_TOPN), stages["rerank"])
+        _timed(lambda: prompt_builder.build_prompt(query, reranked), stages["prompt"])
+
+        exact = set(_exact_topk(vectors, q_mat[0], args.recall_k).tolist())
+        approx = set(int(i) for i in ids[0][:args.recall_k] if i != -1)
+        recalls.append(len(exact & approx) / len(exact) if exact else 0.0)
+        if vector_index.full_vectors is not None:
+            # 仅用压缩编码 (不重排) 的召回，衡量重排带来的提升
+            _, raw_ids = index.search(q_mat, args.recall_k)
+            raw = set(int(i) for i in raw_ids[0] if i != -1)
+            raw_recalls.append(len(exact & raw) / len(exact) if exact else 0.0)
+    del vectors
+
+    result["latency_ms"] = {name: _percentiles(samples) for name, samples in stages.items()}
+    result["recall"] = {f"recall@{args.recall_k}": float(np.mean(recalls)) if recalls else 0.0}
+    if raw_recalls:
+        result["recall"][f"recall@{args.recall_k}_without_rescore"] = float(np.mean(raw_recalls))
+
+    # 4. 批量检索 + 重排吞吐 (对比逐条调用)
+    if args.batch_size:
+        result["batch"] = bench_batch(retriever, queries, args)
+
+    # 5. API 并发吞吐
+    if args.concurrency:
+        result["api"] = bench_api(retriever, queries, args)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    return result
+
+
+def bench_batch(retriever, queries: List[str], args) -> Dict[str, Any]:
+    from app.core.config import settings
+    from app.search.rerank import reranker
+
+    start = time.perf_counter()
+    for query in queries:
+        reranker.rerank_with_scores(query, retriever.retrieve(query, k=args.k), top_n=settings.RERANK_TOPN)
+    single_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(queries), args.batch_size):
+        group = queries[i:i + args.batch_size]
+        reranker.rerank_batch(group, retriever.retrieve_batch(group, k=args.k), top_n=settings.RERANK_TOPN)
+    batch_secs = time.perf_counter() - start
+    return {
+        "batch_size": args.batch_size,
+        "single_questions_per_sec": len(queries) / single_secs if single_secs > 0 else None,
+        "batch_questions_per_sec": len(queries) / batch_secs if batch_secs > 0 else None,
+        "speedup": single_secs / batch_secs if batch_secs > 0 else None,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def bench_api(retriever, queries: List[str], args) -> List[Dict[str, Any]]:
+    """
+    在后台线程中启动 uvicorn，对 /ask 进行不同并发度的压测
+    """
+    import requests
+    import uvicorn
+    from app.api.server import app
+    from app.pipeline.rag_pipeline import rag_pipeline
+
+    rag_pipeline.retriever = retriever
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    url = f"http://127.0.0.1:{port}/ask"
+    local = threading.local()
+
+    def call(query: str) -> float:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        resp = local.session.post(url, json={"question": query}, timeout=60)
+        resp.raise_for_status()
+        return time.perf_counter() - start
+
+    levels = []
+    try:
+        for concurrency in args.concurrency:
+            batch = [queries[i % len(queries)] for i in range(args.requests_per_level)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = list(pool.map(call, batch))
+            elapsed = time.perf_counter() - start
+            levels.append({
+                "concurrency": concurrency,
+                "requests": len(batch),
+                "qps": len(batch) / elapsed if elapsed > 0 else None,
+                "latency_ms": _percentiles(latencies),
+            })
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+    return levels
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    if args.stand_ins:
+        # 替身模型必须在首次使用模型组件之前注入
+        from app.eval.stand_ins import install_stand_ins
+        install_stand_ins(dim=args.dim)
+
+    from app.core.config import settings
+    # 基准测试默认使用本地 Rank-BM25，避免外部 ES 干扰
+    if not args.es:
+        settings.ELASTICSEARCH_URL = None
+
+    work_dir = tempfile.mkdtemp(prefix="slope_bench_")
+    try:
+        results = [bench_size(n, args, work_dir, codec) for n in args.sizes for codec in args.codecs]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "stand_ins": args.stand_ins,
+            "source": args.source,
+            "queries": args.queries,
+            "k": args.k,
+            "rescore_factor": settings.RESCORE_FACTOR,
+        },
+        "results": results,
+    }
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Slope RAG retrieval benchmark")
+    parser.add_argument("--sizes", type=_int_list, default=[10000, 100000, 1000000],
+                        help="语料规模 (chunk 数)，逗号分隔")
+    parser.add_argument("--source", choices=["synthetic", "sampled"], default="synthetic")
+    parser.add_argument("--queries", type=int, default=200, help="每个规模的查询数")
+    parser.add_argument("--k", type=int, default=50, help="每路检索候选数")
+    parser.add_argument("--recall-k", type=int, default=10)
+    parser.add_argument("--codecs", type=lambda v: [c for c in v.split(",") if c.strip()], default=[],
+                        help="向量编码列表 (flat,fp16,sq8,pq)，默认读取 VECTOR_CODEC")
+    parser.add_argument("--embed-workers", type=int, default=None, help="向量化进程数，默认读取 EMBED_WORKERS")
+    parser.add_argument("--batch-size", type=int, default=32, help="批量检索/重排的问题数，0 表示跳过")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16],
+                        help="API 压测并发度，传空字符串跳过")
+    parser.add_argument("--requests-per-level", type=int, default=200)
+    parser.add_argument("--stand-ins", action="store_true", help="使用轻量替身模型 (无需 GPU/网络)")
+    parser.add_argument("--dim", type=int, default=256, help="替身嵌入维度")
+    parser.add_argument("--es", action="store_true", help="使用配置中的 Elasticsearch")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="outputs/benchmark_results.json")
+    args = parser.parse_args(argv)
+    from app.core.config import settings
+    if not args.codecs:
+        args.codecs = [settings.VECTOR_CODEC]
+    if args.embed_workers:
+        settings.EMBED_WORKERS = args.embed_workers
+
+    report = run_benchmark(args)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
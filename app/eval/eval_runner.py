@@ -2,15 +2,25 @@ import json
 import os
 from app.pipeline.rag_pipeline import rag_pipeline
 from app.eval.metrics import calculate_recall_at_k, calculate_mrr, calculate_ndcg
+from app.eval.judge import judge_engine
 from app.core.logging import logger
 
+def answer_text(response: dict) -> str:
+    """
+    用于评审的回答文本：rationale 与 recommendations
+    """
+    parts = [str(response.get("rationale") or "")]
+    parts += [str(r) for r in response.get("recommendations") or []]
+    return "\n".join(p for p in parts if p)
+
 def run_eval(questions_file: str = "eval/questions.jsonl", output_dir: str = "outputs"):
     os.makedirs(output_dir, exist_ok=True)
     
     results = []
+    judge_items = []
     metrics_summary = {
         "recall@1": [], "recall@3": [], "recall@5": [],
-        "mrr": [], "ndcg@5": []
+        "mrr": [], "ndcg@5": [], "faithfulness": [], "answer_relevancy": []
     }
     
     with open(questions_file, 'r', encoding='utf-8') as f:
@@ -55,9 +65,17 @@ def run_eval(questions_file: str = "eval/questions.jsonl", output_dir: str = "ou
                 "response": response,
                 "metrics": {"r@5": r5, "mrr": mrr, "ndcg": ndcg}
             })
+            # 忠实度 / 答案相关度在全部问题跑完后批量评审
+            judge_items.append((query, answer_text(response), "\n\n".join(d.text for d in reranked_docs)))
             
             print(f"Query: {query} | R@5: {r5:.2f} | MRR: {mrr:.2f}")
 
+    for result, scores in zip(results, judge_engine.evaluate(judge_items)):
+        result["metrics"].update(scores)
+        for name, value in scores.items():
+            if value is not None:  # 评审输出无法解析的问题不计入平均
+                metrics_summary[name].append(value)
+
     # 计算平均值
     avg_metrics = {k: sum(v)/len(v) if v else 0 for k, v in metrics_summary.items()}
     
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.memory import mapping_bytes
+from app.core.metrics import record_cache, EVAL_JUDGMENTS
+from app.core.registry import components
+from app.llm.structured import JSONObjectScanner
+
+# 离线评估的三元指标 (忠实度 / 答案相关度)：
+#   - 忠实度由 LLM 评审：待评审的 Prompt 按 EVAL_JUDGE_BATCH_SIZE 分组调用 generate_batch
+#     (本地模型一次左填充批量生成)，EVAL_JUDGE_WORKERS 个分组并发执行 (OpenAI 兼容接口并发请求)
+#   - 评审结果按 (评审 Prompt 版本, 评审模型, 问题, 回答, 上下文) 的 sha256 缓存，追加写入 EVAL_JUDGE_CACHE (JSONL)，
+#     重新评估时只评审输出有变化的问题；解析失败的结果不缓存
+#   - 答案相关度 = 问题与回答嵌入的余弦相似度：未缓存的文本去重后一次批量向量化 (按文本哈希缓存)，
+#     再对整批做一次向量化点积
+
+JUDGE_VERSION = "faithfulness-v1"
+
+JUDGE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "number", "minimum": 0, "maximum": 1},
+        "reason": {"type": "string"},
+    },
+    "required": ["score", "reason"],
+}
+
+JUDGE_PROMPT = """<|im_start|>system
+你是边坡工程问答系统的评审员。判断回答中的陈述是否都能由给定上下文支持 (忠实度)。
+score 为 0 到 1 之间的小数：1 表示全部陈述均有上下文依据，0 表示均无依据或与上下文矛盾。
+只输出 JSON：{{"score": 0.0, "reason": "..."}}<|im_end|>
+<|im_start|>user
+【问题】
+{question}
+
+【上下文】
+{context}
+
+【回答】
+{answer}<|im_end|>
+<|im_start|>assistant
+"""
+
+# 非 JSON 输出只接受显式的 "score: 0.8" 形式，正文中出现的数字 (如 "第1条") 不作为分数
+_score_re = re.compile(r"[\"']?score[\"']?\s*[:：=]\s*(\d+(?:\.\d+)?)", re.I)
+
+
+def judge_key(question: str, answer: str, context: str, model: str) -> str:
+    payload = json.dumps([JUDGE_VERSION, model, question, answer, context], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_judge_prompt(question: str, answer: str, context: str) -> str:
+    return JUDGE_PROMPT.format(question=question, answer=answer,
+                               context=context[:settings.EVAL_JUDGE_CONTEXT_CHARS])
+
+
+def parse_score(raw: str) -> Optional[float]:
+    """
+    从评审输出中取出 0~1 的分数：优先解析 JSON 对象的 score 字段，否则只接受显式的 score: <数字>；
+    都没有时返回 None (视为无法解析，不缓存、不计入平均)
+    """
+    scanner = JSONObjectScanner()
+    scanner.feed(raw or "")
+    if scanner.done:
+        try:
+            value = json.loads(scanner.text)
+            score = value.get("score") if isinstance(value, dict) else None
+            if isinstance(score, (int, float)) and not isinstance(score, bool):
+                return min(1.0, max(0.0, float(score)))
+        except json.JSONDecodeError:
+            pass
+    match = _score_re.search(raw or "")
+    if match is None:
+        return None
+    score = float(match.group(1))
+    return score if 0.0 <= score <= 1.0 else None
+
+
+def _model_id(generator, default: bool) -> str:
+    if settings.EVAL_JUDGE_MODEL:
+        return settings.EVAL_JUDGE_MODEL
+    if default and not components.is_loaded("llm_generator"):
+        # 默认生成模型尚未加载时按配置推断，全部命中缓存时无需加载模型
+        from app.llm.generator import configured_model_id
+        return configured_model_id()
+    return getattr(generator, "model_id", None) or type(generator).__name__
+
+
+class JudgeEngine:
+    def __init__(self, generator=None, embedder=None, cache_path: str = None, workers: int = None,
+                 batch_size: int = None):
+        # 默认使用注册表中的生成 / 嵌入模型 (可被替身替换)
+        default = generator is None
+        if default:
+            from app.llm.generator import llm_generator as generator
+        if embedder is None:
+            from app.llm.embedding import embedding_model as embedder
+        self.generator = generator
+        # 缓存键包含评审模型，更换模型后不会沿用旧模型的分数
+        self.model_id = _model_id(generator, default)
+        self.embedder = embedder
+        self.cache_path = cache_path if cache_path is not None else settings.EVAL_JUDGE_CACHE
+        self.workers = workers or settings.EVAL_JUDGE_WORKERS
+        self.batch_size = batch_size or settings.EVAL_JUDGE_BATCH_SIZE
+        self._judgments: Dict[str, dict] = {}
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        with open(self.cache_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    self._judgments[record["key"]] = record
+                except (json.JSONDecodeError, KeyError):
+                    continue  # 中断写入留下的不完整行
+        logger.info("Loaded %d cached judgments from %s", len(self._judgments), self.cache_path)
+
+    def _store(self, records: List[dict]):
+        with self._lock:
+            for record in records:
+                self._judgments[record["key"]] = record
+            if not self.cache_path or not records:
+                return
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            with open(self.cache_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _judge_batch(self, batch: List[Tuple[str, str]]) -> List[dict]:
+        """
+        batch 为 (key, prompt)；返回成功解析的评审记录
+        """
+        raws = self.generator.generate_batch([prompt for _, prompt in batch], schema=JUDGE_SCHEMA,
+                                             max_new_tokens=settings.EVAL_JUDGE_MAX_TOKENS)
+        records = []
+        for (key, _), raw in zip(batch, raws):
+            score = parse_score(raw)
+            if score is None:
+                EVAL_JUDGMENTS.labels("failed").inc()
+                logger.warning("Unparseable judge output (%d chars)", len(raw or ""))
+                continue
+            EVAL_JUDGMENTS.labels("judged").inc()
+            records.append({"key": key, "score": score, "raw": raw})
+        self._store(records)
+        return records
+
+    def faithfulness(self, items: Sequence[Tuple[str, str, str]]) -> List[Optional[float]]:
+        """
+        items 为 (question, answer, context)，返回对应的忠实度分数；评审输出无法解析时为 None
+        """
+        keys = [judge_key(q, a, c, self.model_id) for q, a, c in items]
+        pending: Dict[str, str] = {}
+        hits = 0
+        for key, (q, a, c) in zip(keys, items):
+            cached = key in self._judgments
+            record_cache("judge", cached)
+            if cached:
+                hits += 1
+                EVAL_JUDGMENTS.labels("cached").inc()
+            elif key not in pending:
+                pending[key] = build_judge_prompt(q, a, c)
+
+        if pending:
+            start = time.perf_counter()
+            todo = list(pending.items())
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+            if self.workers <= 1 or len(batches) == 1:
+                for batch in batches:
+                    self._judge_batch(batch)
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="judge") as pool:
+                    list(pool.map(self._judge_batch, batches))
+            logger.info("Judged %d answers in %d batches (%.2fs, %d cached)", len(pending), len(batches),
+                        time.perf_counter() - start, hits,
+                        extra={"event": "judge", "judged": len(pending), "cached": hits})
+
+        return [self._judgments[k]["score"] if k in self._judgments else None for k in keys]
+
+    def _embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        返回 texts 的 L2 归一化嵌入 (len(texts), dim)；未缓存的文本去重后一次批量向量化
+        """
+        keys = [hashlib.sha1(t.encode("utf-8")).hexdigest() for t in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            hit = key in self._embeddings
+            record_cache("judge_embeddings", hit)
+            if not hit:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = np.asarray(self.embedder.embed_documents(list(missing.values()),
+                                                               batch_size=settings.EMBED_BATCH_SIZE),
+                                 dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.where(norms > 0, norms, 1.0)
+            for key, vec in zip(missing, vectors):
+                self._embeddings[key] = vec
+        return np.stack([self._embeddings[k] for k in keys])
+
+    def answer_relevancy(self, questions: Sequence[str], answers: Sequence[str]) -> List[float]:
+        """
+        问题与回答嵌入的余弦相似度 (负值截断为 0)；空回答记为 0
+        """
+        if not questions:
+            return []
+        vectors = self._embed(list(questions) + list(answers))
+        sims = np.einsum("ij,ij->i", vectors[:len(questions)], vectors[len(questions):])
+        sims = np.clip(sims, 0.0, 1.0)
+        sims[[not a.strip() for a in answers]] = 0.0
+        return [float(s) for s in sims]
+
+    def memory_usage(self) -> Dict[str, int]:
+        return {"judgments": mapping_bytes(self._judgments),
+                "embedding_cache": sum(v.nbytes for v in self._embeddings.values())}
+
+    def evaluate(self, items: Sequence[Tuple[str, str, str]]) -> List[Dict[str, Optional[float]]]:
+        """
+        对一组 (question, answer, context) 同时计算忠实度与答案相关度
+        """
+        faithfulness = self.faithfulness(items)
+        relevancy = self.answer_relevancy([q for q, _, _ in items], [a for _, a, _ in items])
+        return [{"faithfulness": f, "answer_relevancy": r} for f, r in zip(faithfulness, relevancy)]
+
+
+judge_engine = components.lazy("judge_engine", JudgeEngine)
@@ -1,4 +1,4 @@
-from typing import List, Set
+from typing import List, Optional, Set
 
 def calculate_recall_at_k(retrieved_ids: List[str], relevant_ids: Set[str], k: int) -> float:
     if not relevant_ids:
@@ -29,16 +29,16 @@ def calculate_ndcg(retrieved_ids: List[str], relevant_ids: Set[str], k: int) ->
         return 0.0
     return dcg / idcg
 
-# 简化的三元评估 (Mock 实现，真实需要 LLM 判定)
-def evaluate_faithfulness(answer: str, context: str) -> float:
-    # 简单检查：答案中的关键词是否在上下文中出现
-    # 实际应使用 LLM: "Is the answer derived from the context?"
-    return 0.8 # Mock
+# 三元评估：忠实度由 LLM 评审，答案相关度为问题与回答的嵌入余弦相似度 (见 app/eval/judge.py)
+# 整批评估请直接使用 judge_engine.evaluate，以便批量评审与批量向量化
+def evaluate_faithfulness(answer: str, context: str, query: str = "") -> Optional[float]:
+    from app.eval.judge import judge_engine
+    return judge_engine.faithfulness([(query, answer, context)])[0]
 
 def evaluate_context_precision(relevant_chunks: int, total_chunks: int) -> float:
     if total_chunks == 0: return 0
     return relevant_chunks / total_chunks
 
 def evaluate_answer_relevancy(answer: str, query: str) -> float:
-    # 实际应计算 Embedding Cosine Similarity
-    return 0.85 # Mock
+    from app.eval.judge import judge_engine
+    return judge_engine.answer_relevancy([query], [answer])[0]
@@ -0,0 +1,210 @@
+"""
+推理后端一致性检查：对比 fp32 PyTorch 与优化后端 (int8 / onnx) 的嵌入与重排结果
+
+报告:
+  - 嵌入余弦相似度 (mean / min / p5)
+  - 向量检索 top-k 一致率
+  - 重排 Spearman 秩相关、top-1 一致率与 top-n 重合率
+  - 编码耗时与加速比
+  - (--speculative) 本地生成在贪心与投机解码下的输出一致率、tokens/s、草稿接受率与加速比
+
+用法:
+    python -m app.eval.parity --backend int8 --queries 50
+    python -m app.eval.parity --speculative prompt_lookup --prompts 10
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Dict, Any, List
+
+import numpy as np
+
+
+def _spearman(a: np.ndarray, b: np.ndarray) -> float:
+    if len(a) < 2:
+        return 1.0
+    ra = np.argsort(np.argsort(a)).astype(np.float64)
+    rb = np.argsort(np.argsort(b)).astype(np.float64)
+    ra -= ra.mean()
+    rb -= rb.mean()
+    denom = np.sqrt((ra ** 2).sum() * (rb ** 2).sum())
+    return float((ra * rb).sum() / denom) if denom > 0 else 1.0
+
+
+def _load_corpus(data_dir: str, limit: int) -> List[str]:
+    from app.ingest.parser import DocumentParser
+    from app.ingest.chunker import SemanticChunker
+
+    parser = DocumentParser()
+    chunker = SemanticChunker(chunk_size=512, chunk_overlap=50)
+    texts = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.*"))):
+        texts.extend(c.text for c in chunker.chunk_documents(parser.parse(path)))
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def check_embedding(texts: List[str], queries: List[str], backend: str, k: int) -> Dict[str, Any]:
+    from app.core.config import settings
+    from app.llm.optimized import load_sentence_encoder
+
+    instruction = "为这个句子生成表示以用于检索相关文章："
+    ref_model = load_sentence_encoder(settings.EMBEDDING_MODEL_ID, backend="torch")
+    opt_model = load_sentence_encoder(settings.EMBEDDING_MODEL_ID, backend=backend)
+
+    ref_docs, ref_secs = _timed(lambda: ref_model.encode(texts, normalize_embeddings=True))
+    opt_docs, opt_secs = _timed(lambda: opt_model.encode(texts, normalize_embeddings=True))
+    cosines = np.sum(ref_docs * opt_docs, axis=1)
+
+    q_texts = [instruction + q for q in queries]
+    ref_q = ref_model.encode(q_texts, normalize_embeddings=True)
+    opt_q = opt_model.encode(q_texts, normalize_embeddings=True)
+    k = min(k, len(texts))
+    overlaps = []
+    for rq, oq in zip(ref_q, opt_q):
+        ref_top = set(np.argsort(-(ref_docs @ rq))[:k].tolist())
+        opt_top = set(np.argsort(-(opt_docs @ oq))[:k].tolist())
+        overlaps.append(len(ref_top & opt_top) / k)
+
+    return {
+        "cosine": {
+            "mean": float(cosines.mean()),
+            "min": float(cosines.min()),
+            "p5": float(np.percentile(cosines, 5)),
+        },
+        f"top{k}_agreement": float(np.mean(overlaps)) if overlaps else None,
+        "fp32_seconds": ref_secs,
+        f"{backend}_seconds": opt_secs,
+        "speedup": ref_secs / opt_secs if opt_secs > 0 else None,
+    }
+
+
+def check_reranker(texts: List[str], queries: List[str], backend: str, candidates: int, top_n: int) -> Dict[str, Any]:
+    from app.core.config import settings
+    from app.llm.optimized import load_cross_encoder
+
+    ref_model = load_cross_encoder(settings.RERANKER_MODEL_ID, backend="torch")
+    opt_model = load_cross_encoder(settings.RERANKER_MODEL_ID, backend=backend)
+
+    spearman, top1, overlap = [], [], []
+    ref_secs = opt_secs = 0.0
+    for i, query in enumerate(queries):
+        # 每个查询轮换取一组候选文档
+        docs = [texts[(i + j) % len(texts)] for j in range(min(candidates, len(texts)))]
+        pairs = [[query, d] for d in docs]
+        ref_scores, secs = _timed(lambda: np.asarray(ref_model.predict(pairs)))
+        ref_secs += secs
+        opt_scores, secs = _timed(lambda: np.asarray(opt_model.predict(pairs)))
+        opt_secs += secs
+
+        spearman.append(_spearman(ref_scores, opt_scores))
+        top1.append(float(np.argmax(ref_scores) == np.argmax(opt_scores)))
+        n = min(top_n, len(docs))
+        overlap.append(len(set(np.argsort(-ref_scores)[:n]) & set(np.argsort(-opt_scores)[:n])) / n)
+
+    return {
+        "spearman": float(np.mean(spearman)) if spearman else None,
+        "top1_agreement": float(np.mean(top1)) if top1 else None,
+        f"top{top_n}_overlap": float(np.mean(overlap)) if overlap else None,
+        "fp32_seconds": ref_secs,
+        f"{backend}_seconds": opt_secs,
+        "speedup": ref_secs / opt_secs if opt_secs > 0 else None,
+    }
+
+
+def check_generation(texts: List[str], queries: List[str], mode: str) -> Dict[str, Any]:
+    from app.core.config import settings
+    from app.core.metrics import LLM_TOKENS_PER_SECOND, LLM_DRAFT_ACCEPTANCE
+    from app.ingest.parser import DocumentChunk
+    from app.llm.generator import LLMGenerator
+    from app.llm.structured import RESPONSE_SCHEMA
+    from app.prompt.prompt_builder import prompt_builder
+
+    if mode == "draft":
+        settings.SPECULATIVE_DECODING = "draft"
+    generator = LLMGenerator()
+    if generator.use_openai:
+        raise SystemExit("Speculative decoding applies to the local model only; unset OPENAI_BASE_URL.")
+
+    identical, results = [], {"off": [], mode: []}
+    for i, query in enumerate(queries):
+        docs = [DocumentChunk(doc_id=f"doc{j}", page=j + 1, section_path="", text=texts[(i + j) % len(texts)])
+                for j in range(settings.RERANK_TOPN)]
+        prompt = prompt_builder.build_prompt(query, docs)
+        outputs = {}
+        for m in ("off", mode):
+            outputs[m], secs = _timed(lambda: generator._generate_local(prompt, False, RESPONSE_SCHEMA, speculative=m))
+            results[m].append(secs)
+        identical.append(float(outputs["off"] == outputs[mode]))
+
+    def mean_of(hist, label):
+        child = hist.labels(label)
+        return child.sum / child.count if child.count else None
+
+    return {
+        "mode": mode,
+        "prompts": len(queries),
+        "identical_outputs": float(np.mean(identical)) if identical else None,
+        "greedy_seconds": float(np.sum(results["off"])),
+        f"{mode}_seconds": float(np.sum(results[mode])),
+        "speedup": float(np.sum(results["off"]) / np.sum(results[mode])) if np.sum(results[mode]) > 0 else None,
+        "greedy_tokens_per_sec": mean_of(LLM_TOKENS_PER_SECOND, "off"),
+        f"{mode}_tokens_per_sec": mean_of(LLM_TOKENS_PER_SECOND, mode),
+        "draft_acceptance": mean_of(LLM_DRAFT_ACCEPTANCE, mode),
+    }
+
+
+def main(argv: List[str] | None = None):
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Inference backend parity check")
+    parser.add_argument("--backend", choices=["int8", "onnx"], default="int8")
+    parser.add_argument("--data-dir", default=settings.DATA_DIR)
+    parser.add_argument("--docs", type=int, default=500, help="参与对比的 chunk 数")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=50, help="每个查询的重排候选数")
+    parser.add_argument("--speculative", choices=["draft", "prompt_lookup"], default=None,
+                        help="对比本地生成的贪心解码与投机解码 (跳过嵌入/重排检查)")
+    parser.add_argument("--prompts", type=int, default=10, help="生成对比的 Prompt 数")
+    parser.add_argument("--output", default="outputs/parity_results.json")
+    args = parser.parse_args(argv)
+
+    texts = _load_corpus(args.data_dir, args.docs)
+    if not texts:
+        raise SystemExit(f"No documents found in {args.data_dir}")
+    queries = [t[:40] for t in texts[::max(1, len(texts) // args.queries)]][:args.queries]
+
+    if args.speculative:
+        report = {"generation": check_generation(texts, queries[:args.prompts], args.speculative)}
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    report = {
+        "backend": args.backend,
+        "threads": settings.INFERENCE_THREADS,
+        "docs": len(texts),
+        "queries": len(queries),
+        "embedding": check_embedding(texts, queries, args.backend, args.k),
+        "reranker": check_reranker(texts, queries, args.backend, args.candidates, settings.RERANK_TOPN),
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
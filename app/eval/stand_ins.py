@@ -0,0 +1,110 @@
+import re
+import json
+import numpy as np
+from typing import List
+
+# 轻量替身模型：不依赖 torch / 网络下载，用于基准测试与离线调试。
+# 接口与 EmbeddingModel / Reranker / LLMGenerator 保持一致。
+
+class HashEmbeddingModel:
+    """
+    基于字符 bigram 特征哈希的嵌入替身，结果确定且已 L2 归一化
+    """
+    def __init__(self, dim: int = 256):
+        self.embedding_dim = dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        vec = np.zeros(self.embedding_dim, dtype=np.float32)
+        if len(codes) < 2:
+            codes = np.concatenate([codes, np.zeros(2 - len(codes), dtype=np.uint64)])
+        grams = codes[:-1] * np.uint64(1000003) + codes[1:]
+        buckets = (grams % np.uint64(self.embedding_dim)).astype(np.int64)
+        signs = np.where((grams >> np.uint64(7)) & np.uint64(1), 1.0, -1.0).astype(np.float32)
+        vec += np.bincount(buckets, weights=signs, minlength=self.embedding_dim).astype(np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def embed_documents(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.array([])
+        return np.vstack([self._embed(t) for t in texts])
+
+    def embed_query(self, query: str) -> np.ndarray:
+        return self._embed(query)
+
+    def embed_queries(self, queries: List[str], batch_size: int = 32) -> np.ndarray:
+        return np.vstack([self._embed(q) for q in queries])
+
+
+class OverlapReranker:
+    """
+    基于字符 bigram Jaccard 相似度的重排替身
+    """
+    @staticmethod
+    def _grams(text: str) -> set:
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def predict(self, pairs: List[List[str]]) -> np.ndarray:
+        scores = []
+        for query, text in pairs:
+            q, d = self._grams(query), self._grams(text)
+            scores.append(len(q & d) / len(q | d) if q and d else 0.0)
+        return np.array(scores, dtype=np.float32)
+
+    def rerank(self, query: str, documents: list, top_n: int = 5) -> list:
+        return [doc for doc, _ in self.rerank_with_scores(query, documents, top_n)]
+
+    def rerank_with_scores(self, query: str, documents: list, top_n: int = 5) -> list:
+        if not documents:
+            return []
+        scores = self.predict([[query, doc.text] for doc in documents])
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        return [(documents[i], float(scores[i])) for i in order]
+
+    def rerank_batch(self, queries: List[str], documents: List[list], top_n: int = 5) -> List[list]:
+        return [self.rerank_with_scores(q, docs, top_n) for q, docs in zip(queries, documents)]
+
+
+class TemplateGenerator:
+    """
+    生成替身：直接引用 Prompt 中的第一条证据，输出固定结构的 JSON；
+    评审 Prompt 按回答与上下文的字符 bigram 覆盖率给出忠实度分数
+    """
+    _evidence_re = re.compile(r"Doc ID: (.*)\nPage: (\d+)")
+    _judge_re = re.compile(r"【上下文】\n(.*)\n\n【回答】\n(.*)<\|im_end\|>", re.S)
+    model_id = "stand-in:template"
+
+    def generate(self, prompt: str, stream: bool = False, schema: dict = None, max_new_tokens: int = None) -> str:
+        judge = self._judge_re.search(prompt)
+        if judge:
+            context, answer = OverlapReranker._grams(judge.group(1)), OverlapReranker._grams(judge.group(2))
+            score = len(answer & context) / len(answer) if answer else 0.0
+            return json.dumps({"score": round(score, 4), "reason": "替身评审：回答 bigram 在上下文中的覆盖率"},
+                              ensure_ascii=False)
+        match = self._evidence_re.search(prompt)
+        citations = [{"doc_id": match.group(1), "page": int(match.group(2))}] if match else []
+        return json.dumps({
+            "risk_level": "medium",
+            "rationale": "替身模型输出，仅用于性能测试。",
+            "citations": citations,
+            "recommendations": ["加强监测"]
+        }, ensure_ascii=False)
+
+    def generate_batch(self, prompts: List[str], schema: dict = None, max_new_tokens: int = None) -> List[str]:
+        return [self.generate(p, schema=schema, max_new_tokens=max_new_tokens) for p in prompts]
+
+
+def install_stand_ins(dim: int = 256):
+    """
+    在组件注册表中用替身替换嵌入、重排与生成模型，需在首次使用这些组件之前调用
+    """
+    from functools import partial
+    from app.core.registry import components
+    from app.ingest.embedder import document_embedder
+
+    components.override("embedding_model", HashEmbeddingModel(dim))
+    # 多进程向量化时子进程按此工厂创建替身
+    document_embedder.model_factory = partial(HashEmbeddingModel, dim)
+    components.override("reranker", OverlapReranker())
+    components.override("llm_generator", TemplateGenerator())
@@ -8,7 +8,7 @@ class BaseIndex(ABC):
         pass
 
     @abstractmethod
-    def search(self, query: str, k: int = 5) -> List[Tuple[DocumentChunk, float]]:
+    def search(self, query: str, k: int = 5, filters=None) -> List[Tuple[DocumentChunk, float]]:
         pass
     
     @abstractmethod
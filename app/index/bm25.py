@@ -1,24 +1,29 @@
 import os
 import pickle
-import jieba
 import numpy as np
-from typing import List, Tuple
-from rank_bm25 import BM25Okapi
-from elasticsearch import Elasticsearch
+from typing import Dict, List, Optional, Tuple
 from app.index.base import BaseIndex
+from app.index.chunk_store import ChunkStore
+from app.index.filters import MetadataFilter
+from app.index.postings import BM25Postings
+from app.index.tokenizer import tokenizer
 from app.ingest.parser import DocumentChunk
 from app.core.config import settings
 from app.core.logging import logger
+from app.core.memory import documents_bytes, mapping_bytes
+from app.core.metrics import timed
 
 class BM25Index(BaseIndex):
     def __init__(self):
         self.use_es = False
         self.es_client = None
-        self.bm25_local = None
-        self.documents = [] # 本地模式下存储
+        self.postings = BM25Postings()
+        self.documents = [] # 本地模式下存储 (list 或只读 ChunkStore)
         
         if settings.ELASTICSEARCH_URL:
             try:
+                from elasticsearch import Elasticsearch
+
                 self.es_client = Elasticsearch(settings.ELASTICSEARCH_URL)
                 if self.es_client.ping():
                     self.use_es = True
@@ -27,7 +32,7 @@ class BM25Index(BaseIndex):
                 else:
                     logger.warning("Elasticsearch not reachable, falling back to local Rank-BM25.")
             except Exception as e:
-                logger.warning(f"Failed to connect to Elasticsearch: {e}, falling back to local Rank-BM25.")
+                logger.warning("Failed to connect to Elasticsearch: %s, falling back to local Rank-BM25.", e)
         else:
             logger.info("Elasticsearch URL not set, using local Rank-BM25.")
 
@@ -48,36 +53,46 @@ class BM25Index(BaseIndex):
                     "properties": {
                         "text": {"type": "text", "analyzer": "standard"}, # 假设 ES 有中文分词插件，否则 standard 效果一般
                         "doc_id": {"type": "keyword"},
-                        "page": {"type": "integer"}
+                        "page": {"type": "integer"},
+                        "section_path": {"type": "keyword"},
+                        "is_table": {"type": "boolean"},
+                        "table_path": {"type": "keyword"},
+                        "url": {"type": "keyword"},
+                        "timestamp": {"type": "keyword"}
                     }
                 }
             })
 
-    def _tokenize(self, text: str) -> List[str]:
-        return list(jieba.cut_for_search(text))
-
     def add_documents(self, documents: List[DocumentChunk]):
         if self.use_es:
             for doc in documents:
                 self.es_client.index(index="slope_docs", document=doc.to_dict())
             self.es_client.indices.refresh(index="slope_docs")
         else:
+            if isinstance(self.documents, ChunkStore):
+                # 只读共享存储，追加前转为私有列表
+                self.documents = self.documents.to_list()
             self.documents.extend(documents)
-            tokenized_corpus = [self._tokenize(doc.text) for doc in documents]
-            # 重新构建 BM25 对象 (Rank-BM25 不支持增量更新，需全量重构)
-            # 实际生产中应优化，这里简化
-            self.bm25_local = BM25Okapi(tokenized_corpus)
+            # 倒排表支持增量合并，只需对新文档分词
+            self.postings.add(tokenizer.tokenize_documents([doc.text for doc in documents]))
+            self.postings.meta["tokenizer"] = tokenizer.signature
         
-        logger.info(f"Added {len(documents)} documents to BM25 index (ES={self.use_es}).")
+        logger.info("Added %d documents to BM25 index (ES=%s).", len(documents), self.use_es)
 
-    def search(self, query: str, k: int = 5) -> List[Tuple[DocumentChunk, float]]:
+    @timed("bm25")
+    def search(self, query: str, k: int = 5, filters: Optional[MetadataFilter] = None,
+               allowed: Optional[np.ndarray] = None, tokens: Optional[List[str]] = None) -> List[Tuple[DocumentChunk, float]]:
+        """
+        tokens 为调用方已分好的查询词 (分片检索时由协调进程统一分词)，仅本地模式使用；
+        否则经分词服务分词 (带 LRU 缓存)
+        """
         if self.use_es:
+            es_query = {"match": {"text": query}}
+            if filters is not None:
+                # 过滤条件放在 filter 上下文中，不参与打分且可被 ES 缓存
+                es_query = {"bool": {"must": es_query, "filter": filters.to_es()}}
             resp = self.es_client.search(index="slope_docs", body={
-                "query": {
-                    "match": {
-                        "text": query
-                    }
-                },
+                "query": es_query,
                 "size": k
             })
             results = []
@@ -89,34 +104,88 @@ class BM25Index(BaseIndex):
                 results.append((doc, score))
             return results
         else:
-            if not self.bm25_local:
+            if not self.postings:
                 return []
-            tokenized_query = self._tokenize(query)
-            # get_top_n 只能返回文档，不能返回分数，我们需要分数进行融合
-            # 所以手动计算
-            scores = self.bm25_local.get_scores(tokenized_query)
-            top_n_indices = np.argsort(scores)[::-1][:k]
-            
-            results = []
-            for idx in top_n_indices:
-                if scores[idx] > 0: # 过滤掉 0 分
-                    results.append((self.documents[idx], float(scores[idx])))
-            return results
+            tokenized_query = tokens if tokens is not None else tokenizer.tokenize_query(query)
+            scores = self.postings.get_scores(tokenized_query)
+            if filters is not None and (allowed is None or len(allowed) != len(scores)):
+                allowed = filters.scan(self.documents)
+            if allowed is not None:
+                # 不满足过滤条件的文档置 0 分，下面会被剔除
+                scores = np.where(allowed, scores, 0.0)
+            return self._top_k(scores, k)
+
+    def _top_k(self, scores: np.ndarray, k: int) -> List[Tuple[DocumentChunk, float]]:
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top_n_indices = np.argpartition(-scores, k - 1)[:k]
+        top_n_indices = top_n_indices[np.argsort(-scores[top_n_indices], kind="stable")]
 
-    def save(self, path: str):
+        results = []
+        for idx in top_n_indices:
+            if scores[idx] > 0: # 过滤掉 0 分
+                results.append((self.documents[idx], float(scores[idx])))
+        return results
+
+    @timed("bm25")
+    def search_batch(self, queries: List[str], k: int = 5,
+                     filters: Optional[List[Optional[MetadataFilter]]] = None,
+                     allowed: Optional[List[Optional[np.ndarray]]] = None) -> List[List[Tuple[DocumentChunk, float]]]:
+        """
+        多查询检索：本地模式一次计算分数矩阵 (共有词项的倒排只算一次)；
+        filters / allowed 与 queries 一一对应，含义同 search
+        """
+        filters = filters or [None] * len(queries)
+        allowed = allowed or [None] * len(queries)
+        if self.use_es:
+            return [self.search(q, k, filters=f) for q, f in zip(queries, filters)]
+        if not self.postings:
+            return [[] for _ in queries]
+        scores = self.postings.get_scores_batch([tokenizer.tokenize_query(q) for q in queries])
+        results = []
+        for row, f, mask in zip(scores, filters, allowed):
+            if f is not None and (mask is None or len(mask) != len(row)):
+                mask = f.scan(self.documents)
+            results.append(self._top_k(row if mask is None else np.where(mask, row, 0.0), k))
+        return results
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        倒排表数组、词表与本地 chunk 文本 (ES 模式下均为空)
+        """
+        return {"postings": self.postings.nbytes(), "vocab": mapping_bytes(self.postings.vocab),
+                "chunk_text": documents_bytes(self.documents)}
+
+    def save(self, path: str, write_documents: bool = True):
+        """
+        保存倒排表；与 FAISS 共用同一目录时由 FAISS 写入 chunk 存储 (write_documents=False)
+        """
         if not self.use_es:
-            os.makedirs(path, exist_ok=True)
-            with open(os.path.join(path, "bm25_docs.pkl"), "wb") as f:
-                pickle.dump(self.documents, f)
-            # BM25 对象本身很难序列化，通常重新构建
-            logger.info(f"Saved local BM25 documents to {path}")
+            self.postings.save(path)
+            if write_documents:
+                ChunkStore.write(path, self.documents)
+            logger.info("Saved local BM25 index to %s", path)
 
     def load(self, path: str):
-        if not self.use_es:
-            docs_path = os.path.join(path, "bm25_docs.pkl")
-            if os.path.exists(docs_path):
-                with open(docs_path, "rb") as f:
-                    self.documents = pickle.load(f)
-                tokenized_corpus = [self._tokenize(doc.text) for doc in self.documents]
-                self.bm25_local = BM25Okapi(tokenized_corpus)
-                logger.info(f"Loaded local BM25 index from {path}")
+        if self.use_es:
+            return
+        if BM25Postings.exists(path) and ChunkStore.exists(path):
+            # 直接加载倒排表，无需重新分词；INDEX_MMAP 下以只读 mmap 共享
+            self.postings = BM25Postings.load(path, mmap=settings.INDEX_MMAP)
+            self.documents = ChunkStore(path)
+            logger.info("Loaded local BM25 index from %s", path)
+            if self.postings.meta.get("tokenizer") != tokenizer.signature:
+                # 查询与文档分词方式不一致会降低 BM25 精度
+                logger.warning("BM25 index in %s was built with a different tokenizer dictionary or mode; "
+                               "rebuild the index to match.", path)
+            return
+        docs_path = os.path.join(path, "bm25_docs.pkl")
+        if os.path.exists(docs_path):
+            # 兼容旧版本仅保存文档 pickle 的索引
+            with open(docs_path, "rb") as f:
+                self.documents = pickle.load(f)
+            self.postings = BM25Postings()
+            self.postings.add(tokenizer.tokenize_documents([doc.text for doc in self.documents]))
+            self.postings.meta["tokenizer"] = tokenizer.signature
+            logger.info("Loaded legacy BM25 documents from %s", path)
@@ -0,0 +1,98 @@
+"""
+离线索引构建：解析 → 分块 → 去重 → 向量化 → 写入新的版本化快照，校验后发布
+
+构建在 INDEX_DIR/snapshots/.<version>.tmp 中进行，完成并写入 manifest 后重命名为正式目录，
+再原子更新 INDEX_DIR/CURRENT。运行中的服务通过 SIGHUP、POST /admin/reload 或轮询 CURRENT 热加载。
+快照目录可整体复制到服务节点 (rsync 快照目录后再单独同步 CURRENT)。
+
+用法:
+    python -m app.index.build --data-dir data/sample_docs
+    python -m app.index.build --no-publish          # 只构建，稍后 --publish <version>
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from typing import List
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.memory import traced_allocations
+from app.index import snapshots
+
+
+def build_snapshot(data_dir: str, index_root: str = None, version: str = None) -> dict:
+    from app.ingest.buffer import IngestBuffer
+    from app.ingest.chunker import SemanticChunker
+    from app.ingest.parser import DocumentParser
+    from app.search.retrieve import create_retriever
+
+    index_root = index_root or settings.INDEX_DIR
+    version = version or snapshots.new_version()
+    final_path = snapshots.snapshot_path(version, index_root)
+    staging = os.path.join(snapshots.snapshots_root(index_root), f".{version}.tmp")
+    if os.path.exists(final_path):
+        raise ValueError(f"Snapshot {version} already exists")
+    os.makedirs(staging)
+
+    # 快照只包含本地索引：不写入共享的 Elasticsearch，分片在本机子进程中构建
+    settings.ELASTICSEARCH_URL = None
+    settings.SHARD_ADDRESSES = ""
+    start = time.perf_counter()
+    try:
+        files = sorted(glob.glob(os.path.join(data_dir, "*.*")))
+        parser = DocumentParser()
+        chunker = SemanticChunker(chunk_size=512, chunk_overlap=50)
+        retriever = create_retriever(index_dir=staging)
+        # 缓冲超过 INGEST_BUFFER_MB 时分批写入，超过 MEMORY_BUDGET_MB 时中止构建
+        buffer = IngestBuffer(retriever.index_documents, save=retriever.save)
+        with traced_allocations("snapshot_build"):
+            for file_path in files:
+                logger.info("Processing %s", file_path)
+                buffer.extend(chunker.chunk_documents(parser.iter_parse(file_path)))
+            stats = buffer.close()
+        if hasattr(retriever, "close"):
+            retriever.close()
+        manifest = snapshots.write_manifest(
+            staging, version, files_processed=len(files), chunks=stats.kept, shards=max(1, settings.SHARDS),
+            dedup=stats.to_dict(), ingest_spills=buffer.spills, build_seconds=round(time.perf_counter() - start, 1))
+        os.replace(staging, final_path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    logger.info("Built index snapshot %s: %d chunks from %d files in %.1fs", version, manifest["chunks"],
+                len(files), manifest["build_seconds"], extra={"event": "snapshot_build", "version": version})
+    return manifest
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description="Build a versioned index snapshot offline")
+    parser.add_argument("--data-dir", default=settings.DATA_DIR)
+    parser.add_argument("--index-root", default=settings.INDEX_DIR)
+    parser.add_argument("--version", default=None, help="快照版本名，默认按时间生成")
+    parser.add_argument("--no-publish", action="store_true", help="只构建，不更新 CURRENT")
+    parser.add_argument("--publish", metavar="VERSION", default=None, help="校验并发布已有快照 (不构建)")
+    parser.add_argument("--keep", type=int, default=settings.SNAPSHOT_KEEP, help="保留的快照数")
+    parser.add_argument("--stand-ins", action="store_true", help="使用轻量替身模型 (无需 GPU/网络)")
+    parser.add_argument("--dim", type=int, default=256, help="替身嵌入维度")
+    args = parser.parse_args(argv)
+    if args.stand_ins:
+        from app.eval.stand_ins import install_stand_ins
+        install_stand_ins(args.dim)
+
+    if args.publish:
+        manifest = snapshots.verify_snapshot(snapshots.snapshot_path(args.publish, args.index_root))
+    else:
+        manifest = build_snapshot(args.data_dir, args.index_root, args.version)
+        snapshots.verify_snapshot(snapshots.snapshot_path(manifest["version"], args.index_root))
+        if args.no_publish:
+            print(json.dumps({k: v for k, v in manifest.items() if k != "files"}, indent=2, ensure_ascii=False))
+            return
+    snapshots.publish(manifest["version"], args.index_root)
+    snapshots.prune(args.keep, args.index_root)
+    print(json.dumps({k: v for k, v in manifest.items() if k != "files"}, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
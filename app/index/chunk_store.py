@@ -0,0 +1,81 @@
+import json
+import mmap
+import os
+import numpy as np
+from typing import Iterator, List, Sequence
+from app.ingest.parser import DocumentChunk
+
+# 只读共享的文档块存储：
+#   chunks.bin  所有 chunk 的 UTF-8 JSON 依次拼接
+#   chunks.idx  int64 偏移数组 (长度 n+1)
+# 通过 mmap 打开，数据位于页缓存中，fork 出的多个 worker 共享同一份物理内存，
+# 且访问时不会像 pickle 出来的 Python 对象那样因引用计数写入而触发写时复制。
+
+DATA_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.idx"
+
+
+class ChunkStore(Sequence):
+    def __init__(self, path: str):
+        self.path = path
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        data_path = os.path.join(path, DATA_FILE)
+        self._file = open(data_path, "rb")
+        if os.path.getsize(data_path) > 0:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b""
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, OFFSETS_FILE)) and os.path.exists(os.path.join(path, DATA_FILE))
+
+    @staticmethod
+    def write(path: str, documents: Sequence[DocumentChunk]):
+        """
+        写入 chunk 存储 (先写临时文件再原子替换，避免读者看到半成品)
+        """
+        os.makedirs(path, exist_ok=True)
+        data_path = os.path.join(path, DATA_FILE)
+        offsets_path = os.path.join(path, OFFSETS_FILE)
+        offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        with open(data_path + ".tmp", "wb") as f:
+            for i, doc in enumerate(documents):
+                payload = json.dumps(doc.to_dict(), ensure_ascii=False).encode("utf-8")
+                f.write(payload)
+                offsets[i + 1] = offsets[i] + len(payload)
+        with open(offsets_path + ".tmp", "wb") as f:
+            np.save(f, offsets)
+        os.replace(data_path + ".tmp", data_path)
+        os.replace(offsets_path + ".tmp", offsets_path)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _decode(self, i: int) -> DocumentChunk:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return DocumentChunk(**json.loads(self._data[start:end].decode("utf-8")))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._decode(i) for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("chunk index out of range")
+        return self._decode(idx)
+
+    def __iter__(self) -> Iterator[DocumentChunk]:
+        for i in range(len(self)):
+            yield self._decode(i)
+
+    def text_bytes(self) -> int:
+        return int(self._offsets[-1])
+
+    def to_list(self) -> List[DocumentChunk]:
+        return list(self)
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
@@ -1,79 +1,320 @@
 import os
+import json
 import pickle
 import numpy as np
-import faiss
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 from app.index.base import BaseIndex
+from app.index.chunk_store import ChunkStore
+from app.index.filters import MetadataFilter
 from app.ingest.parser import DocumentChunk
+from app.ingest.embedder import document_embedder
 from app.llm.embedding import embedding_model
+from app.core.config import settings
 from app.core.logging import logger
+from app.core.memory import documents_bytes
+from app.core.metrics import stage_timer
+
+# 向量编码 (VECTOR_CODEC):
+#   flat  float32 原始向量 (IndexFlatIP)，精确检索
+#   fp16  半精度标量量化，内存减半
+#   sq8   8-bit 标量量化，内存为 1/4
+#   pq    乘积量化 (PQ_M 个子空间 x 8 bit)，内存最小
+# 非 flat 编码先用压缩码召回 k * RESCORE_FACTOR 个候选，再从 mmap 的 float32 旁路文件
+# (vectors.f32) 读取候选的原始向量做精确内积重排。
+# 量化器在首次写入时训练，训练数据为该批导入中随机抽取的 VECTOR_TRAIN_SAMPLE 条 (先于其余 chunk 向量化)。
+CODECS = ("flat", "fp16", "sq8", "pq")
+VECTORS_FILE = "vectors.f32"
+META_FILE = "faiss_meta.json"
+
 
 class FAISSIndex(BaseIndex):
-    def __init__(self):
+    def __init__(self, codec: str = None):
         self.index = None
-        self.documents = [] # 存储原始文档数据，FAISS 只存向量
-        self.dimension = embedding_model.embedding_dim
-
-    def _init_index(self, num_vectors: int):
-        # 使用 IVF+PQ 以支持大规模数据，或者简单使用 FlatL2/IP
-        # 这里为了演示简单且数据量不大，使用 IndexFlatIP (内积，归一化后等同于余弦相似度)
-        # 如果数据量大，可以切换为:
-        # quantizer = faiss.IndexFlatIP(self.dimension)
-        # self.index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist=100, faiss.METRIC_INNER_PRODUCT)
-        self.index = faiss.IndexFlatIP(self.dimension)
-
-    def add_documents(self, documents: List[DocumentChunk]):
+        self.documents = [] # 存储原始文档数据，FAISS 只存向量 (list 或只读 ChunkStore)
+        self.mmapped = False
+        self.codec = codec or settings.VECTOR_CODEC
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown VECTOR_CODEC: {self.codec}, expected one of {CODECS}")
+        # 非 flat 编码时保存的原始向量 (构建期为内存数组，加载后为只读 memmap)
+        self.full_vectors = None
+        self._vector_buffer = None
+
+    @property
+    def dimension(self) -> int:
+        # 维度取自嵌入模型，访问时才触发模型加载
+        return embedding_model.embedding_dim
+
+    def _init_index(self, embeddings: np.ndarray):
+        import faiss
+
+        d = embeddings.shape[1]
+        codec = self.codec
+        if codec == "pq" and len(embeddings) < 256:
+            # PQ 每个子空间需训练 256 个质心，样本不足时退回 sq8
+            logger.warning("Only %d vectors to train PQ, falling back to sq8.", len(embeddings))
+            codec = self.codec = "sq8"
+
+        if codec == "flat":
+            self.index = faiss.IndexFlatIP(d)
+        elif codec == "fp16":
+            self.index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT)
+        elif codec == "sq8":
+            self.index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # 子空间数需整除维度
+            m = max(x for x in range(1, min(settings.PQ_M, d) + 1) if d % x == 0)
+            self.index = faiss.IndexPQ(d, m, 8, faiss.METRIC_INNER_PRODUCT)
+
+        if not self.index.is_trained:
+            self.index.train(embeddings)
+
+    def add_documents(self, documents: List[DocumentChunk]) -> List[DocumentChunk]:
+        """
+        流式向量化并分批写入；批次按文本长度分组，写入顺序与输入顺序不同，
+        返回按索引行号排列的文档 (其他索引需按此顺序写入以保持行号一致)。
+        索引尚未训练时第一批为随机样本，量化器不会只见到按长度排序后最长的 chunk
+        """
+        if not documents:
+            return []
+        ordered: List[DocumentChunk] = []
+
+        def sink(rows: np.ndarray, embeddings: np.ndarray):
+            batch = [documents[i] for i in rows]
+            self.add_embeddings(embeddings, batch)
+            ordered.extend(batch)
+
+        train_sample = settings.VECTOR_TRAIN_SAMPLE if self.index is None and self.codec != "flat" else 0
+        document_embedder.embed_to(sink, [doc.text for doc in documents], train_sample=train_sample)
+        return ordered
+
+    def add_embeddings(self, embeddings: np.ndarray, documents: List[DocumentChunk]):
+        """
+        写入已计算好的向量 (与 documents 一一对应)
+        """
         if not documents:
             return
-            
-        texts = [doc.text for doc in documents]
-        embeddings = embedding_model.embed_documents(texts)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
         
         if self.index is None:
-            self._init_index(len(documents))
-            
-        # 如果是 IVF 索引，需要 train
-        # if not self.index.is_trained:
-        #     self.index.train(embeddings)
+            self._init_index(embeddings)
+        elif self.mmapped:
+            # mmap 加载的索引不可写 (faiss 会直接 abort)，追加前复制为私有内存
+            import faiss
+
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self.mmapped = False
+        if isinstance(self.documents, ChunkStore):
+            self.documents = self.documents.to_list()
             
         self.index.add(embeddings)
+        if self.codec != "flat":
+            self._append_full_vectors(embeddings)
         self.documents.extend(documents)
-        logger.info(f"Added {len(documents)} documents to FAISS index.")
+        logger.info("Added %d documents to FAISS index (codec=%s).", len(documents), self.codec)
+
+    def _append_full_vectors(self, embeddings: np.ndarray):
+        # 容量按倍增预留，分批写入时避免每批整体复制
+        n = 0 if self.full_vectors is None else len(self.full_vectors)
+        total = n + len(embeddings)
+        if self._vector_buffer is None or len(self._vector_buffer) < total:
+            buffer = np.empty((max(2 * n, total), embeddings.shape[1]), dtype=np.float32)
+            if n:
+                buffer[:n] = self.full_vectors
+            self._vector_buffer = buffer
+        self._vector_buffer[n:total] = embeddings
+        self.full_vectors = self._vector_buffer[:total]
 
-    def search(self, query: str, k: int = 5) -> List[Tuple[DocumentChunk, float]]:
+    def _filtered_search(self, queries: np.ndarray, k: int, allowed: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        只在 allowed 位图内检索：flat / sq 使用 faiss 位图 id selector，
+        IndexPQ 不支持 selector，改为对允许的行用 PQ 查表 (ADC) 计算近似内积
+        """
+        import faiss
+
+        if not isinstance(self.index, faiss.IndexPQ):
+            bits = np.packbits(allowed, bitorder="little")
+            selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(bits))
+            return self.index.search(queries, k, params=faiss.SearchParameters(sel=selector))
+
+        rows = np.flatnonzero(allowed)
+        pq = self.index.pq
+        codes = faiss.rev_swig_ptr(self.index.codes.data(), self.index.ntotal * self.index.code_size)
+        codes = np.asarray(codes).reshape(self.index.ntotal, pq.M)[rows]
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        table = np.empty((pq.M, pq.ksub), dtype=np.float32)
+        for i, query in enumerate(queries):
+            pq.compute_inner_prod_table(faiss.swig_ptr(query), faiss.swig_ptr(table))
+            approx = table[np.arange(pq.M), codes].sum(axis=1)
+            top = np.argsort(-approx)[:k]
+            scores[i, :len(top)] = approx[top]
+            ids[i, :len(top)] = rows[top]
+        return scores, ids
+
+    def _raw_search(self, queries: np.ndarray, k: int, allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        if allowed is None:
+            return self.index.search(queries, k)
+        return self._filtered_search(queries, k, allowed)
+
+    def search_vectors(self, queries: np.ndarray, k: int = 5,
+                       allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        多查询向量检索，返回 (scores, ids)，形状均为 (nq, k)，不足处 id 为 -1。
+        allowed 为与行号对齐的布尔位图，仅返回位图内的向量
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, self.index.d)
+        if self.full_vectors is None:
+            return self._raw_search(queries, k, allowed)
+
+        shortlist = min(self.index.ntotal, k * settings.RESCORE_FACTOR)
+        _, candidates = self._raw_search(queries, shortlist, allowed)
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        with stage_timer("rescore"):
+            for i, cand in enumerate(candidates):
+                # 排序后按顺序读取 memmap，减少随机 IO
+                cand = np.sort(cand[cand >= 0])
+                exact = np.asarray(self.full_vectors[cand]) @ queries[i]
+                top = np.argsort(-exact)[:k]
+                out_scores[i, :len(top)] = exact[top]
+                out_ids[i, :len(top)] = cand[top]
+        return out_scores, out_ids
+
+    def search(self, query: str, k: int = 5, filters: Optional[MetadataFilter] = None,
+               allowed: Optional[np.ndarray] = None,
+               query_embedding: Optional[np.ndarray] = None) -> List[Tuple[DocumentChunk, float]]:
+        """
+        allowed 为调用方由 MetadataIndex 预先算好的位图；只给 filters 时逐条匹配得到位图。
+        query_embedding 为已计算好的查询向量 (分片检索时由协调进程统一编码)
+        """
         if self.index is None or self.index.ntotal == 0:
             return []
+        if filters is not None and (allowed is None or len(allowed) != self.index.ntotal):
+            allowed = filters.scan(self.documents)
+        if allowed is not None and not allowed.any():
+            return []
             
-        query_embedding = embedding_model.embed_query(query)
+        if query_embedding is None:
+            with stage_timer("embed"):
+                query_embedding = embedding_model.embed_query(query)
         query_embedding = query_embedding.reshape(1, -1)
         
-        scores, indices = self.index.search(query_embedding, k)
+        with stage_timer("faiss"):
+            scores, indices = self.search_vectors(query_embedding, k, allowed=allowed)
         
+        return self._to_results(scores[0], indices[0])
+
+    def _to_results(self, scores: np.ndarray, indices: np.ndarray) -> List[Tuple[DocumentChunk, float]]:
         results = []
-        for score, idx in zip(scores[0], indices[0]):
+        for score, idx in zip(scores, indices):
             if idx != -1 and idx < len(self.documents):
                 results.append((self.documents[idx], float(score)))
-                
         return results
 
-    def save(self, path: str):
+    def search_batch(self, queries: List[str], k: int = 5,
+                     filters: Optional[List[Optional[MetadataFilter]]] = None,
+                     allowed: Optional[List[Optional[np.ndarray]]] = None,
+                     query_embeddings: Optional[np.ndarray] = None) -> List[List[Tuple[DocumentChunk, float]]]:
+        """
+        多查询检索：查询向量批量编码，无过滤条件的查询合并为一次 search_vectors；
+        filters / allowed 与 queries 一一对应，有过滤条件的查询按各自位图单独检索
+        """
+        if self.index is None or self.index.ntotal == 0 or not queries:
+            return [[] for _ in queries]
+        filters = filters or [None] * len(queries)
+        allowed = list(allowed or [None] * len(queries))
+        for i, f in enumerate(filters):
+            if f is not None and (allowed[i] is None or len(allowed[i]) != self.index.ntotal):
+                allowed[i] = f.scan(self.documents)
+
+        if query_embeddings is None:
+            with stage_timer("embed"):
+                query_embeddings = embedding_model.embed_queries(queries, batch_size=settings.EMBED_BATCH_SIZE)
+        query_embeddings = np.asarray(query_embeddings, dtype=np.float32).reshape(len(queries), -1)
+
+        results: List[List[Tuple[DocumentChunk, float]]] = [[] for _ in queries]
+        with stage_timer("faiss"):
+            plain = [i for i, mask in enumerate(allowed) if mask is None]
+            if plain:
+                scores, indices = self.search_vectors(query_embeddings[plain], k)
+                for row, i in enumerate(plain):
+                    results[i] = self._to_results(scores[row], indices[row])
+            for i, mask in enumerate(allowed):
+                if mask is not None and mask.any():
+                    scores, indices = self.search_vectors(query_embeddings[i:i + 1], k, allowed=mask)
+                    results[i] = self._to_results(scores[0], indices[0])
+        return results
+
+    def code_bytes(self) -> int:
+        """
+        检索阶段常驻内存的向量编码大小
+        """
+        if self.index is None:
+            return 0
+        if self.codec == "flat":
+            return int(self.index.ntotal * self.index.d * 4)
+        return int(self.index.sa_code_size() * self.index.ntotal)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        向量编码、重排用的 float32 旁路向量 (含追加缓冲区的预留容量) 与 chunk 文本
+        """
+        usage = {"index_vectors": self.code_bytes(), "chunk_text": documents_bytes(self.documents)}
+        vectors = self._vector_buffer if self._vector_buffer is not None else self.full_vectors
+        if vectors is not None:
+            usage["full_vectors"] = int(vectors.nbytes)
+        return usage
+
+    def save(self, path: str, write_documents: bool = True):
         if self.index is None:
             return
+        import faiss
         
         os.makedirs(path, exist_ok=True)
         faiss.write_index(self.index, os.path.join(path, "faiss.index"))
-        with open(os.path.join(path, "docs.pkl"), "wb") as f:
-            pickle.dump(self.documents, f)
-        logger.info(f"Saved FAISS index to {path}")
+        if self.full_vectors is not None:
+            tmp_path = os.path.join(path, VECTORS_FILE + ".tmp")
+            np.asarray(self.full_vectors, dtype=np.float32).tofile(tmp_path)
+            os.replace(tmp_path, os.path.join(path, VECTORS_FILE))
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"codec": self.codec, "dim": int(self.index.d), "count": int(self.index.ntotal)}, f)
+        if write_documents:
+            ChunkStore.write(path, self.documents)
+        logger.info("Saved FAISS index to %s", path)
 
     def load(self, path: str):
         index_path = os.path.join(path, "faiss.index")
         docs_path = os.path.join(path, "docs.pkl")
         
-        if os.path.exists(index_path) and os.path.exists(docs_path):
-            self.index = faiss.read_index(index_path)
-            with open(docs_path, "rb") as f:
-                self.documents = pickle.load(f)
-            logger.info(f"Loaded FAISS index from {path}")
+        if os.path.exists(index_path) and (ChunkStore.exists(path) or os.path.exists(docs_path)):
+            import faiss
+
+            if settings.INDEX_MMAP:
+                # 只读 mmap：向量留在页缓存中，多个 worker 共享
+                flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+                self.index = faiss.read_index(index_path, flags)
+                self.mmapped = True
+            else:
+                self.index = faiss.read_index(index_path)
+
+            self.codec, self.full_vectors, self._vector_buffer = "flat", None, None
+            meta_path = os.path.join(path, META_FILE)
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                self.codec = meta["codec"]
+                vectors_path = os.path.join(path, VECTORS_FILE)
+                if self.codec != "flat" and os.path.exists(vectors_path):
+                    # 原始向量只在重排时按需读取，不占常驻内存
+                    self.full_vectors = np.memmap(vectors_path, dtype=np.float32, mode="r",
+                                                  shape=(meta["count"], meta["dim"]))
+
+            if ChunkStore.exists(path):
+                self.documents = ChunkStore(path)
+            else:
+                # 兼容旧版本的文档 pickle
+                with open(docs_path, "rb") as f:
+                    self.documents = pickle.load(f)
+            logger.info("Loaded FAISS index from %s (codec=%s, mmap=%s)", path, self.codec, self.mmapped)
         else:
-            logger.warning(f"Index files not found in {path}")
+            logger.warning("Index files not found in %s", path)
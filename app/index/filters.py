@@ -0,0 +1,227 @@
+import sys
+import threading
+from array import array
+from collections import defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+import numpy as np
+from app.ingest.parser import DocumentChunk
+
+# 元数据过滤表达式 (JSON)，多个字段之间为 AND:
+#   {"is_table": true}                          等值
+#   {"doc_id": ["GB50330.pdf", "JGJ120.pdf"]}   任一取值 (IN)
+#   {"page": {"gte": 10, "lt": 20}}             范围 (gt / gte / lt / lte)
+#   {"metadata.source": "design_code"}          metadata 中的字段
+# 布尔值与数值分开匹配 ({"is_table": 1} 不匹配 True)；is_table 只接受布尔值，page 只接受数值
+FILTER_FIELDS = ("doc_id", "page", "section_path", "is_table", "table_path", "url", "timestamp")
+RANGE_OPS = ("gt", "gte", "lt", "lte")
+# dynamic mapping 下 metadata 中的字符串为 text 字段，精确匹配使用其 .keyword 子字段
+ES_KEYWORD_SUFFIX = ".keyword"
+
+
+def _field_value(doc: DocumentChunk, field: str) -> Any:
+    if field.startswith("metadata."):
+        return (doc.metadata or {}).get(field[len("metadata."):])
+    return getattr(doc, field)
+
+
+def _hashable_values(value: Any) -> List[Hashable]:
+    # metadata 中的列表字段按多值处理，不可哈希的值不参与索引
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [v for v in values if v is not None and isinstance(v, Hashable)]
+
+
+def _term_key(value: Hashable) -> Hashable:
+    """
+    集合 / 倒排表中的键：True == 1 且哈希相同，布尔值单独加上类型标记
+    """
+    return (bool, value) if isinstance(value, bool) else value
+
+
+def _in_range(value: Any, ops: Dict[str, Any]) -> bool:
+    if isinstance(value, bool):
+        return False
+    try:
+        return not (("gt" in ops and not value > ops["gt"]) or ("gte" in ops and not value >= ops["gte"])
+                    or ("lt" in ops and not value < ops["lt"]) or ("lte" in ops and not value <= ops["lte"]))
+    except TypeError:
+        return False
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_type(field: str, value: Any):
+    if field == "is_table" and not isinstance(value, bool):
+        raise ValueError(f"Filter values for {field} must be true or false")
+    if field == "page" and not _is_number(value):
+        raise ValueError(f"Filter values for {field} must be numbers")
+
+
+class MetadataFilter:
+    def __init__(self, conditions: Dict[str, Any]):
+        # terms 中为 _term_key 后的键，values 保留原始取值 (序列化 / ES 查询)
+        self.terms: Dict[str, frozenset] = {}
+        self.values: Dict[str, List[Hashable]] = {}
+        self.ranges: Dict[str, Dict[str, Any]] = {}
+        for field, cond in conditions.items():
+            if field not in FILTER_FIELDS and not (field.startswith("metadata.") and len(field) > len("metadata.")):
+                raise ValueError(f"Unknown filter field: {field}")
+            if isinstance(cond, dict):
+                unknown = set(cond) - set(RANGE_OPS)
+                if unknown or not cond:
+                    raise ValueError(f"Invalid range operators for {field}: {sorted(unknown) or '{}'}")
+                if any(isinstance(v, bool) or not isinstance(v, (int, float, str)) for v in cond.values()):
+                    raise ValueError(f"Range bounds for {field} must be numbers or strings")
+                for v in cond.values():
+                    _check_type(field, v)
+                self.ranges[field] = dict(cond)
+            else:
+                values = cond if isinstance(cond, (list, tuple, set)) else [cond]
+                if not values or not all(isinstance(v, Hashable) for v in values):
+                    raise ValueError(f"Filter values for {field} must be a scalar or a non-empty list of scalars")
+                for v in values:
+                    _check_type(field, v)
+                self.terms[field] = frozenset(_term_key(v) for v in values)
+                self.values[field] = list(dict.fromkeys(values))
+
+    @classmethod
+    def parse(cls, expr: Optional[Dict[str, Any]]) -> Optional["MetadataFilter"]:
+        """
+        空表达式返回 None (不过滤)；非法表达式抛出 ValueError
+        """
+        if not expr:
+            return None
+        if not isinstance(expr, dict):
+            raise ValueError("Filter expression must be a JSON object")
+        return cls(expr)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        还原为过滤表达式 (可 JSON 序列化，MetadataFilter.parse 的逆操作)
+        """
+        expr: Dict[str, Any] = {field: sorted(values, key=str) for field, values in self.values.items()}
+        expr.update((field, dict(ops)) for field, ops in self.ranges.items())
+        return expr
+
+    def matches(self, doc: DocumentChunk) -> bool:
+        for field, allowed in self.terms.items():
+            if not any(_term_key(v) in allowed for v in _hashable_values(_field_value(doc, field))):
+                return False
+        for field, ops in self.ranges.items():
+            if not any(_in_range(v, ops) for v in _hashable_values(_field_value(doc, field))):
+                return False
+        return True
+
+    def scan(self, documents: Sequence[DocumentChunk]) -> np.ndarray:
+        """
+        逐条匹配得到位图，仅用于没有 MetadataIndex 可用时的兜底
+        """
+        return np.fromiter((self.matches(doc) for doc in documents), dtype=bool, count=len(documents))
+
+    def to_es(self) -> List[Dict[str, Any]]:
+        """
+        转为 Elasticsearch bool.filter 子句。metadata.* 的字符串取值查询 .keyword 子字段
+        (dynamic mapping 将字符串映射为 text + keyword，已有索引无需重建)，数值与布尔值查询字段本身
+        """
+        clauses = []
+        for field, values in self.values.items():
+            if not field.startswith("metadata."):
+                clauses.append({"terms": {field: sorted(values, key=str)}})
+                continue
+            strings = sorted(v for v in values if isinstance(v, str))
+            others = sorted((v for v in values if not isinstance(v, str)), key=str)
+            should = ([{"terms": {field + ES_KEYWORD_SUFFIX: strings}}] if strings else []) + \
+                     ([{"terms": {field: others}}] if others else [])
+            clauses.append(should[0] if len(should) == 1 else {"bool": {"should": should, "minimum_should_match": 1}})
+        for field, ops in self.ranges.items():
+            if field.startswith("metadata.") and any(isinstance(v, str) for v in ops.values()):
+                field += ES_KEYWORD_SUFFIX
+            clauses.append({"range": {field: ops}})
+        return clauses
+
+    def __repr__(self):
+        return f"MetadataFilter(terms={self.values}, ranges={self.ranges})"
+
+
+class MetadataIndex:
+    """
+    按字段建立 取值 -> 行号 的 id 集合 (int32 数组)，过滤时合成为与索引行号对齐的位图。
+    行号与 FAISS / 本地 BM25 的文档顺序一致，文档追加后增量同步。
+    """
+    def __init__(self):
+        self.size = 0
+        self.postings: Dict[str, Dict[Hashable, array]] = defaultdict(lambda: defaultdict(lambda: array("i")))
+        self._columns: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def sync(self, documents: Sequence[DocumentChunk]):
+        with self._lock:
+            if len(documents) < self.size:
+                # 索引被重建，整体重新统计
+                self.postings.clear()
+                self.size = 0
+            if len(documents) == self.size:
+                return
+            for row in range(self.size, len(documents)):
+                doc = documents[row]
+                for field in FILTER_FIELDS:
+                    for value in _hashable_values(getattr(doc, field)):
+                        self.postings[field][_term_key(value)].append(row)
+                for key, value in (doc.metadata or {}).items():
+                    for v in _hashable_values(value):
+                        self.postings[f"metadata.{key}"][_term_key(v)].append(row)
+            self.size = len(documents)
+            self._columns.clear()
+
+    def nbytes(self) -> int:
+        with self._lock:
+            total = sum(sys.getsizeof(ids) + sys.getsizeof(value)
+                        for values in self.postings.values() for value, ids in values.items())
+            return total + sum(c.nbytes for c in self._columns.values())
+
+    def _ids(self, field: str, value: Hashable) -> np.ndarray:
+        ids = self.postings.get(field, {}).get(value)
+        return np.frombuffer(ids, dtype=np.int32) if ids else np.empty(0, dtype=np.int32)
+
+    def _column(self, field: str) -> np.ndarray:
+        """
+        数值字段的列存储 (缺失为 NaN)，用于向量化的范围比较
+        """
+        column = self._columns.get(field)
+        if column is None:
+            column = np.full(self.size, np.nan)
+            for value, ids in self.postings.get(field, {}).items():
+                if _is_number(value):
+                    column[np.frombuffer(ids, dtype=np.int32)] = value
+            self._columns[field] = column
+        return column
+
+    def mask(self, flt: MetadataFilter, documents: Sequence[DocumentChunk]) -> np.ndarray:
+        self.sync(documents)
+        result = np.ones(self.size, dtype=bool)
+        for field, values in flt.terms.items():
+            field_mask = np.zeros(self.size, dtype=bool)
+            for key in values:
+                field_mask[self._ids(field, key)] = True
+            result &= field_mask
+        for field, ops in flt.ranges.items():
+            if not all(_is_number(v) for v in ops.values()):
+                # 非数值范围 (如 ISO 时间字符串) 按不同取值逐个比较
+                field_mask = np.zeros(self.size, dtype=bool)
+                for value, ids in self.postings.get(field, {}).items():
+                    if _in_range(value, ops):
+                        field_mask[np.frombuffer(ids, dtype=np.int32)] = True
+                result &= field_mask
+                continue
+            column = self._column(field)
+            with np.errstate(invalid="ignore"):
+                if "gt" in ops:
+                    result &= column > ops["gt"]
+                if "gte" in ops:
+                    result &= column >= ops["gte"]
+                if "lt" in ops:
+                    result &= column < ops["lt"]
+                if "lte" in ops:
+                    result &= column <= ops["lte"]
+        return result
@@ -0,0 +1,143 @@
+import json
+import os
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Sequence, Hashable
+
+# 基于 CSR 倒排表的 Okapi BM25，打分公式与 rank_bm25.BM25Okapi 一致。
+# 所有结构均为 numpy 数组，可保存为 .npy 并以 mmap 方式加载，
+# 多个 worker 共享同一份物理内存，也避免了重新分词重建索引。
+
+ARRAY_FILES = ("indptr", "doc_ids", "tfs", "doc_len")
+
+
+class BM25Postings:
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab: Dict[Hashable, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.tfs = np.zeros(0, dtype=np.float32)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.idf = np.zeros(0, dtype=np.float64)
+        self._norm = np.zeros(0, dtype=np.float64)
+        # 随倒排表保存的附加信息 (如分词器签名)
+        self.meta: Dict[str, str] = {}
+
+    @property
+    def corpus_size(self) -> int:
+        return len(self.doc_len)
+
+    def __bool__(self) -> bool:
+        return self.corpus_size > 0
+
+    def add(self, tokenized_docs: Sequence[Sequence[Hashable]]):
+        """
+        追加文档 (增量合并到现有倒排表，无需重新分词已有文档)
+        """
+        if not tokenized_docs:
+            return
+        base = self.corpus_size
+        terms, docs, tfs = [], [], []
+        doc_len = np.empty(len(tokenized_docs), dtype=np.int32)
+        for i, tokens in enumerate(tokenized_docs):
+            doc_len[i] = len(tokens)
+            for token, tf in Counter(tokens).items():
+                term_id = self.vocab.get(token)
+                if term_id is None:
+                    term_id = self.vocab[token] = len(self.vocab)
+                terms.append(term_id)
+                docs.append(base + i)
+                tfs.append(tf)
+
+        # 旧倒排表展开为 (term, doc, tf) 三元组后与新文档合并，按 term 稳定排序
+        old_terms = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64), np.diff(self.indptr))
+        all_terms = np.concatenate([old_terms, np.asarray(terms, dtype=np.int64)])
+        all_docs = np.concatenate([np.asarray(self.doc_ids), np.asarray(docs, dtype=np.int32)])
+        all_tfs = np.concatenate([np.asarray(self.tfs), np.asarray(tfs, dtype=np.float32)])
+        order = np.argsort(all_terms, kind="stable")
+
+        self.doc_ids = all_docs[order]
+        self.tfs = all_tfs[order]
+        counts = np.bincount(all_terms, minlength=len(self.vocab))
+        self.indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.doc_len = np.concatenate([np.asarray(self.doc_len), doc_len])
+        self._finalize()
+
+    def _finalize(self):
+        n = self.corpus_size
+        if n == 0:
+            return
+        df = np.diff(self.indptr).astype(np.float64)
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+        # 与 BM25Okapi 一致：负 idf 替换为 epsilon * 平均 idf
+        average_idf = idf.mean() if len(idf) else 0.0
+        idf[idf < 0] = self.epsilon * average_idf
+        self.idf = idf
+        avgdl = float(np.mean(self.doc_len)) if n else 1.0
+        self._norm = self.k1 * (1 - self.b + self.b * np.asarray(self.doc_len, dtype=np.float64) / avgdl)
+
+    def term_ids(self, tokens: Sequence[Hashable]) -> List[int]:
+        return [self.vocab[t] for t in tokens if t in self.vocab]
+
+    def get_scores(self, tokens: Sequence[Hashable]) -> np.ndarray:
+        scores = np.zeros(self.corpus_size, dtype=np.float64)
+        for term_id in self.term_ids(tokens):
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            scores[docs] += self.idf[term_id] * (tf * (self.k1 + 1) / (tf + self._norm[docs]))
+        return scores
+
+    def get_scores_batch(self, token_lists: Sequence[Sequence[Hashable]]) -> np.ndarray:
+        """
+        多个查询的分数矩阵 (nq, corpus_size)；各查询共有的词项只读取并计算一次倒排 (与逐条 get_scores 结果一致)
+        """
+        scores = np.zeros((len(token_lists), self.corpus_size), dtype=np.float64)
+        rows_by_term: Dict[int, List[int]] = {}
+        for row, tokens in enumerate(token_lists):
+            for term_id in self.term_ids(tokens):
+                rows_by_term.setdefault(term_id, []).append(row)
+        for term_id, rows in rows_by_term.items():
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            contribution = self.idf[term_id] * (tf * (self.k1 + 1) / (tf + self._norm[docs]))
+            if len(rows) == 1:
+                scores[rows[0], docs] += contribution
+                continue
+            # 多个查询共有的词项展开为稠密行后整行相加，比逐行散射写入快得多
+            dense = np.zeros(self.corpus_size, dtype=np.float64)
+            dense[docs] = contribution
+            for row in rows:
+                scores[row] += dense
+        return scores
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_FILES:
+            np.save(os.path.join(path, f"bm25_{name}.npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(path, "bm25_vocab.json"), "w", encoding="utf-8") as f:
+            json.dump({"params": {"k1": self.k1, "b": self.b, "epsilon": self.epsilon}, "meta": self.meta,
+                       "vocab": list(self.vocab)}, f, ensure_ascii=False)
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(path, "bm25_vocab.json"))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "BM25Postings":
+        with open(os.path.join(path, "bm25_vocab.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        postings = cls(**meta["params"])
+        postings.meta = meta.get("meta", {})
+        postings.vocab = {term: i for i, term in enumerate(meta["vocab"])}
+        for name in ARRAY_FILES:
+            setattr(postings, name, np.load(os.path.join(path, f"bm25_{name}.npy"), mmap_mode="r" if mmap else None))
+        postings._finalize()
+        return postings
+
+    def nbytes(self) -> int:
+        return int(sum(np.asarray(getattr(self, name)).nbytes for name in ARRAY_FILES) + self.idf.nbytes + self._norm.nbytes)
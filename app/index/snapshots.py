@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from app.core.config import settings
+from app.core.logging import logger
+
+# 版本化索引快照:
+#   INDEX_DIR/snapshots/<version>/   一次完整构建的全部文件 (FAISS、BM25、chunk 存储、去重签名、分片子目录)
+#   INDEX_DIR/snapshots/<version>/manifest.json   文件大小与 sha256、构建参数、chunk 数
+#   INDEX_DIR/CURRENT                当前生效的版本名 (写临时文件后 os.replace，原子切换)
+# 快照发布后不再修改；没有 CURRENT 时沿用旧布局，直接从 INDEX_DIR 加载。
+
+SNAPSHOTS_DIR = "snapshots"
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+# 版本名来自请求、命令行与 CURRENT 文件，只允许单层目录名 (不含路径分隔符，不以 "." 开头)
+_VERSION = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,127}$")
+
+
+def snapshots_root(index_root: str = None) -> str:
+    return os.path.join(index_root or settings.INDEX_DIR, SNAPSHOTS_DIR)
+
+
+def new_version() -> str:
+    return time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _files(path: str) -> List[str]:
+    files = []
+    for root, _, names in os.walk(path):
+        for name in names:
+            rel = os.path.relpath(os.path.join(root, name), path)
+            if rel != MANIFEST_FILE:
+                files.append(rel.replace(os.sep, "/"))
+    return sorted(files)
+
+
+def write_manifest(path: str, version: str, **info) -> Dict[str, Any]:
+    manifest = {
+        "version": version,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "embedding_model": settings.EMBEDDING_MODEL_ID,
+        "vector_codec": settings.VECTOR_CODEC,
+        **info,
+        "files": {rel: {"bytes": os.path.getsize(os.path.join(path, rel)), "sha256": _sha256(os.path.join(path, rel))}
+                  for rel in _files(path)},
+    }
+    with open(os.path.join(path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def verify_snapshot(path: str, checksums: bool = True) -> Dict[str, Any]:
+    """
+    校验快照文件齐全且与 manifest 一致 (checksums=False 时只比较大小)，不一致抛出 ValueError
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise ValueError(f"Snapshot {path} has no {MANIFEST_FILE}")
+    for rel, meta in manifest["files"].items():
+        file_path = os.path.join(path, rel)
+        if not os.path.exists(file_path):
+            raise ValueError(f"Snapshot {manifest['version']} is missing {rel}")
+        if os.path.getsize(file_path) != meta["bytes"]:
+            raise ValueError(f"Snapshot {manifest['version']}: size mismatch for {rel}")
+        if checksums and _sha256(file_path) != meta["sha256"]:
+            raise ValueError(f"Snapshot {manifest['version']}: checksum mismatch for {rel}")
+    return manifest
+
+
+def current_version(index_root: str = None) -> Optional[str]:
+    current_path = os.path.join(index_root or settings.INDEX_DIR, CURRENT_FILE)
+    if not os.path.exists(current_path):
+        return None
+    with open(current_path, "r", encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def check_version(version: str) -> str:
+    """
+    版本名格式不合法 (如 "../x") 时抛出 ValueError，在访问文件系统之前调用
+    """
+    if not isinstance(version, str) or not _VERSION.match(version):
+        raise ValueError(f"Invalid snapshot version: {version!r}")
+    return version
+
+
+def snapshot_path(version: str, index_root: str = None) -> str:
+    return os.path.join(snapshots_root(index_root), check_version(version))
+
+
+def resolve_index_dir(index_root: str = None) -> str:
+    """
+    当前生效快照的目录；未发布过快照时为 INDEX_DIR 本身
+    """
+    version = current_version(index_root)
+    return snapshot_path(version, index_root) if version else (index_root or settings.INDEX_DIR)
+
+
+def publish(version: str, index_root: str = None):
+    """
+    原子更新 CURRENT 指向 version
+    """
+    index_root = index_root or settings.INDEX_DIR
+    if not os.path.isdir(snapshot_path(version, index_root)):
+        raise ValueError(f"Unknown snapshot version: {version}")
+    tmp_path = os.path.join(index_root, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(index_root, CURRENT_FILE))
+    logger.info("Published index snapshot %s", version, extra={"event": "snapshot_publish", "version": version})
+
+
+def list_versions(index_root: str = None) -> List[str]:
+    root = snapshots_root(index_root)
+    if not os.path.isdir(root):
+        return []
+    return sorted(v for v in os.listdir(root) if not v.startswith(".") and os.path.isdir(os.path.join(root, v)))
+
+
+def prune(keep: int, index_root: str = None) -> List[str]:
+    """
+    删除较旧的快照，保留最新的 keep 个与当前生效的版本
+    """
+    current = current_version(index_root)
+    versions = list_versions(index_root)
+    removed = [v for v in versions[:max(0, len(versions) - keep)] if v != current]
+    for version in removed:
+        shutil.rmtree(snapshot_path(version, index_root), ignore_errors=True)
+    if removed:
+        logger.info("Pruned index snapshots: %s", removed)
+    return removed
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.memory import mapping_bytes
+from app.core.metrics import record_cache, TOKENIZER_CHARS, TOKENIZER_SECONDS
+from app.core.registry import components
+
+# BM25 中文分词服务 (jieba)：
+#   - 使用独立的 jieba.Tokenizer 实例，加载时即初始化默认词典并载入边坡工程用户词典
+#     (内置 slope_userdict.txt + TOKENIZER_USER_DICT)，安全系数、抗剪强度等术语不被切碎；
+#     作为组件在启动 warm-up 时加载，首个查询不再承担词典加载
+#   - 标点与空白不作为词项写入倒排表
+#   - 查询分词结果按文本 LRU 缓存 (TOKENIZER_CACHE_SIZE)，命中率见 cache="query_tokens"
+#   - 导入时文本量达到 TOKENIZER_PARALLEL_MIN 且 TOKENIZER_WORKERS > 1 时由 spawn 进程池并行分词
+#   - 词典与模式的签名随 BM25 倒排表保存，加载时与当前分词器不一致会给出警告 (需重建索引)
+
+BUILTIN_USER_DICT = os.path.join(os.path.dirname(__file__), "slope_userdict.txt")
+MODES = ("search", "precise")
+
+
+def _user_dicts(extra: Optional[str]) -> List[str]:
+    return [BUILTIN_USER_DICT] + ([extra] if extra else [])
+
+
+class JiebaTokenizer:
+    def __init__(self, user_dict: Optional[str] = None, mode: str = None, cache_size: int = None):
+        import jieba
+
+        self.mode = mode or settings.TOKENIZER_MODE
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown TOKENIZER_MODE: {self.mode}, expected one of {MODES}")
+        self.user_dicts = _user_dicts(user_dict if user_dict is not None else settings.TOKENIZER_USER_DICT)
+        self.cache_size = cache_size if cache_size is not None else settings.TOKENIZER_CACHE_SIZE
+        self._cache: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        start = time.perf_counter()
+        self._jieba = jieba.Tokenizer()
+        self._jieba.initialize()
+        digest = hashlib.sha1(self.mode.encode())
+        for path in self.user_dicts:
+            self._jieba.load_userdict(path)
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        self.signature = digest.hexdigest()[:16]
+        logger.info("Loaded jieba tokenizer (mode=%s, user dicts=%s) in %.2fs", self.mode, self.user_dicts,
+                    time.perf_counter() - start)
+
+    def tokenize(self, text: str) -> List[str]:
+        words = self._jieba.cut_for_search(text) if self.mode == "search" else self._jieba.cut(text)
+        # 跳过标点与空白 (不含任何字母/数字/汉字的片段)
+        return [w for w in words if any(ch.isalnum() for ch in w)]
+
+    def tokenize_query(self, text: str) -> Tuple[str, ...]:
+        """
+        查询分词 (带 LRU 缓存)，返回不可变元组，可直接发送给分片进程
+        """
+        with self._lock:
+            tokens = self._cache.get(text)
+            if tokens is not None:
+                self._cache.move_to_end(text)
+        record_cache("query_tokens", tokens is not None)
+        if tokens is not None:
+            return tokens
+
+        start = time.perf_counter()
+        tokens = tuple(self.tokenize(text))
+        TOKENIZER_CHARS.labels("query").inc(len(text))
+        TOKENIZER_SECONDS.labels("query").inc(time.perf_counter() - start)
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[text] = tokens
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return tokens
+
+    def tokenize_documents(self, texts: Sequence[str], workers: int = None) -> List[List[str]]:
+        """
+        导入时批量分词，返回与 texts 一一对应的词项列表
+        """
+        workers = workers or settings.TOKENIZER_WORKERS
+        chars = sum(len(t) for t in texts)
+        start = time.perf_counter()
+        if workers <= 1 or len(texts) < settings.TOKENIZER_PARALLEL_MIN:
+            tokenized = [self.tokenize(t) for t in texts]
+        else:
+            tokenized = self._tokenize_parallel(texts, workers)
+        elapsed = time.perf_counter() - start
+        TOKENIZER_CHARS.labels("ingest").inc(chars)
+        TOKENIZER_SECONDS.labels("ingest").inc(elapsed)
+        logger.info("Tokenized %d chunks (%d chars) in %.2fs (%.0f chars/s, workers=%d)", len(texts), chars, elapsed,
+                    chars / elapsed if elapsed > 0 else 0.0, workers,
+                    extra={"event": "tokenize", "chunks": len(texts), "chars": chars, "seconds": elapsed})
+        return tokenized
+
+    def _tokenize_parallel(self, texts: Sequence[str], workers: int) -> List[List[str]]:
+        import multiprocessing
+
+        size = max(1, -(-len(texts) // (workers * 4)))
+        tasks = [list(texts[i:i + size]) for i in range(0, len(texts), size)]
+        ctx = multiprocessing.get_context("spawn")
+        extra = self.user_dicts[1] if len(self.user_dicts) > 1 else ""
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(extra, self.mode)) as pool:
+            return [tokens for batch in pool.imap(_tokenize_batch, tasks) for tokens in batch]
+
+    def memory_usage(self) -> Dict[str, int]:
+        with self._lock:
+            cache = mapping_bytes(self._cache, lambda tokens: sys.getsizeof(tokens) + sum(map(sys.getsizeof, tokens)))
+        return {"dictionary": mapping_bytes(self._jieba.FREQ), "query_cache": cache}
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {"size": len(self._cache), "max_size": self.cache_size}
+
+
+_worker_tokenizer: Optional[JiebaTokenizer] = None
+
+
+def _init_worker(user_dict: str, mode: str):
+    global _worker_tokenizer
+    _worker_tokenizer = JiebaTokenizer(user_dict=user_dict, mode=mode, cache_size=0)
+
+
+def _tokenize_batch(texts: List[str]) -> List[List[str]]:
+    return [_worker_tokenizer.tokenize(t) for t in texts]
+
+
+tokenizer = components.lazy("tokenizer", JiebaTokenizer)
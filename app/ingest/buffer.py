@@ -0,0 +1,85 @@
+from typing import Callable, Iterable, List, Optional
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.memory import MemoryBudgetExceeded, check_budget, format_bytes, object_bytes, track_buffer
+from app.ingest.dedup import DedupStats
+from app.ingest.parser import DocumentChunk
+
+# 导入时的 chunk 缓冲 (/ingest 与离线快照构建)：
+#   - 缓冲的 chunk 估算大小达到 INGEST_BUFFER_MB 时先写入索引并清空 (spill)，不在内存中积累整个语料
+#   - 给出 save 时 spill 只写入内存中的索引 (sink(chunks, save=False))，close() 时整体落盘一次，
+#     避免每次 spill 都重写整个索引文件
+#   - 每次追加后检查进程 RSS：超过 MEMORY_BUDGET_MB 时先 spill，释放后仍超出则抛出 MemoryBudgetExceeded
+#     (已写入的 chunk 先落盘，保留在索引中)
+#   - 跨 spill 的近重复由已入库签名检出 (计为 index_duplicates 直接丢弃)，去重统计在多次写入间累加
+
+
+class IngestBuffer:
+    def __init__(self, sink: Callable[..., DedupStats], limit_bytes: Optional[int] = None,
+                 save: Optional[Callable[[], None]] = None):
+        self.sink = sink
+        self.save = save
+        self._unsaved = False
+        self.limit = limit_bytes if limit_bytes is not None else int(settings.INGEST_BUFFER_MB * 1024 * 1024)
+        self.chunks: List[DocumentChunk] = []
+        self.spills = 0
+        self.stats = DedupStats()
+        self._bytes = 0
+        track_buffer(self)
+
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def extend(self, chunks: Iterable[DocumentChunk]):
+        chunks = list(chunks)
+        self.chunks.extend(chunks)
+        self._bytes += sum(object_bytes(c) for c in chunks)
+        if 0 < self.limit <= self._bytes:
+            self.flush(spill=True)
+        try:
+            check_budget("ingest")
+        except MemoryBudgetExceeded:
+            try:
+                if not self.chunks:
+                    raise
+                self.flush(spill=True)
+                check_budget("ingest")
+            except MemoryBudgetExceeded:
+                self.persist()
+                raise
+
+    def flush(self, spill: bool = False):
+        if not self.chunks:
+            return
+        if spill:
+            self.spills += 1
+            logger.info("Ingest buffer spill #%d: %d chunks (%s)", self.spills, len(self.chunks),
+                        format_bytes(self._bytes), extra={"event": "ingest_spill", "chunks": len(self.chunks),
+                                                          "bytes": self._bytes})
+        if self.save is None:
+            stats = self.sink(self.chunks)
+        else:
+            stats = self.sink(self.chunks, save=False)
+            self._unsaved = True
+        self.chunks, self._bytes = [], 0
+        self.stats.total += stats.total
+        self.stats.kept += stats.kept
+        self.stats.batch_duplicates += stats.batch_duplicates
+        self.stats.index_duplicates += stats.index_duplicates
+        self.stats.examples.extend(stats.examples[:max(0, 5 - len(self.stats.examples))])
+
+    def persist(self):
+        """
+        将已写入内存索引的 chunk 落盘 (没有未保存的写入时不做任何事)
+        """
+        if self._unsaved:
+            self.save()
+            self._unsaved = False
+
+    def close(self) -> DedupStats:
+        """
+        写入剩余的 chunk 并落盘，返回整次导入的去重统计
+        """
+        self.flush()
+        self.persist()
+        return self.stats
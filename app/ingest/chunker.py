@@ -1,4 +1,4 @@
-from typing import List
+from typing import Iterable, List
 from app.ingest.parser import DocumentChunk
 from app.core.config import settings
 import re
@@ -8,7 +8,7 @@ class SemanticChunker:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
 
-    def chunk_documents(self, docs: List[DocumentChunk]) -> List[DocumentChunk]:
+    def chunk_documents(self, docs: Iterable[DocumentChunk]) -> List[DocumentChunk]:
         """
         对文档片段进行进一步的语义分块。
         """
@@ -0,0 +1,204 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+import numpy as np
+from app.ingest.parser import DocumentChunk
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import INGEST_CHUNKS
+
+# 近重复检测：字符 n-gram shingle -> MinHash 签名 -> LSH 分桶找候选 -> 签名一致率估计 Jaccard 相似度。
+# 签名与分桶键随索引保存 (dedup_signatures.npy / dedup_bands.npy)，后续导入的 chunk 会与已入库的 chunk 比对。
+# deduplicate 只返回保留 chunk 的待提交签名，调用方在向量 / BM25 索引写入成功后再 commit，
+# 写入中途失败时重试不会把未入库的 chunk 误判为 index_duplicates。
+
+_HASH_SEED = 20240601
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass
+class PendingSignatures:
+    signatures: np.ndarray
+    band_keys: np.ndarray
+
+
+@dataclass
+class DedupStats:
+    total: int = 0
+    kept: int = 0
+    # 与本批次其他 chunk 重复 (合并到保留的 chunk，记录在其 metadata["duplicates"])
+    batch_duplicates: int = 0
+    # 与已入库 chunk 重复 (直接丢弃)
+    index_duplicates: int = 0
+    examples: List[Dict[str, str]] = field(default_factory=list)
+
+    @property
+    def duplicates(self) -> int:
+        return self.batch_duplicates + self.index_duplicates
+
+    @property
+    def ratio(self) -> float:
+        return self.duplicates / self.total if self.total else 0.0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "total": self.total,
+            "kept": self.kept,
+            "batch_duplicates": self.batch_duplicates,
+            "index_duplicates": self.index_duplicates,
+            "dedup_ratio": self.ratio,
+        }
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = _HASH_SEED):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # multiply-shift 哈希族：(a * x + b) 的高 32 位，a 取奇数
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        # 去空白后按 unicode 码点做多项式滚动哈希，向量化计算所有 n-gram
+        codes = np.frombuffer(_WHITESPACE.sub("", text).lower().encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        n = min(self.shingle_size, len(codes))
+        if n == 0:
+            return np.zeros(1, dtype=np.uint64)
+        hashes = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for j in range(n):
+                hashes = hashes * np.uint64(1000003) + codes[j:len(codes) - n + 1 + j]
+        return np.unique(hashes)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingle_hashes(text)
+        with np.errstate(over="ignore"):
+            permuted = (hashes[:, None] * self._a[None, :] + self._b[None, :]) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    def __init__(self, num_perm: int = None, bands: int = None, threshold: float = None, shingle_size: int = None):
+        self.num_perm = num_perm or settings.DEDUP_NUM_PERM
+        self.bands = bands or settings.DEDUP_BANDS
+        if self.num_perm % self.bands:
+            raise ValueError(f"DEDUP_NUM_PERM ({self.num_perm}) must be divisible by DEDUP_BANDS ({self.bands})")
+        self.threshold = threshold if threshold is not None else settings.DEDUP_THRESHOLD
+        self.hasher = MinHasher(self.num_perm, shingle_size or settings.DEDUP_SHINGLE)
+        self.signatures = np.empty((0, self.num_perm), dtype=np.uint32)
+        self.band_keys = np.empty((0, self.bands), dtype=np.uint64)
+        self._sorted = None
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _bands_of(self, signatures: np.ndarray) -> np.ndarray:
+        rows = self.num_perm // self.bands
+        chunks = signatures.reshape(len(signatures), self.bands, rows).astype(np.uint64)
+        keys = np.zeros((len(signatures), self.bands), dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for r in range(rows):
+                keys = keys * np.uint64(0x100000001B3) ^ chunks[:, :, r]
+        return keys
+
+    def _existing_candidates(self, keys: np.ndarray) -> List[int]:
+        if not len(self.band_keys):
+            return []
+        if self._sorted is None:
+            order = np.argsort(self.band_keys, axis=0, kind="stable")
+            self._sorted = (order, np.take_along_axis(self.band_keys, order, axis=0))
+        order, sorted_keys = self._sorted
+        found = set()
+        for band, key in enumerate(keys):
+            lo = np.searchsorted(sorted_keys[:, band], key, side="left")
+            hi = np.searchsorted(sorted_keys[:, band], key, side="right")
+            found.update(order[lo:hi, band].tolist())
+        return sorted(found)
+
+    def _similar(self, signature: np.ndarray, other: np.ndarray) -> bool:
+        return float(np.mean(signature == other)) >= self.threshold
+
+    def deduplicate(self, documents: List[DocumentChunk]) -> Tuple[List[DocumentChunk], DedupStats, PendingSignatures]:
+        """
+        返回去重后的 chunk、统计与保留 chunk 的签名；签名在 commit 之后才参与后续比对
+        """
+        stats = DedupStats(total=len(documents))
+        if not documents:
+            return [], stats, PendingSignatures(self.signatures[:0], self.band_keys[:0])
+
+        signatures = np.stack([self.hasher.signature(doc.text) for doc in documents])
+        keys = self._bands_of(signatures)
+        kept: List[int] = []
+        batch_buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+
+        for i, doc in enumerate(documents):
+            duplicate_of = None
+            for row in self._existing_candidates(keys[i]):
+                if self._similar(signatures[i], self.signatures[row]):
+                    duplicate_of = row
+                    break
+            if duplicate_of is not None:
+                stats.index_duplicates += 1
+                continue
+
+            candidates = sorted({j for band in range(self.bands) for j in batch_buckets[band].get(int(keys[i, band]), ())})
+            for j in candidates:
+                if self._similar(signatures[i], signatures[j]):
+                    duplicate_of = j
+                    break
+            if duplicate_of is not None:
+                stats.batch_duplicates += 1
+                keeper = documents[duplicate_of]
+                keeper.metadata = dict(keeper.metadata or {})
+                keeper.metadata.setdefault("duplicates", []).append(
+                    {"doc_id": doc.doc_id, "page": doc.page, "section_path": doc.section_path})
+                if len(stats.examples) < 5:
+                    stats.examples.append({"kept": f"{keeper.doc_id}#{keeper.page}", "dropped": f"{doc.doc_id}#{doc.page}"})
+                continue
+
+            kept.append(i)
+            for band in range(self.bands):
+                batch_buckets[band].setdefault(int(keys[i, band]), []).append(i)
+
+        stats.kept = len(kept)
+        INGEST_CHUNKS.labels("kept").inc(stats.kept)
+        INGEST_CHUNKS.labels("duplicate").inc(stats.duplicates)
+        logger.info("Near-duplicate detection: %d/%d chunks dropped (%.1f%%)",
+                    stats.duplicates, stats.total, stats.ratio * 100, extra={"event": "dedup", **stats.to_dict()})
+        return [documents[i] for i in kept], stats, PendingSignatures(signatures[kept], keys[kept])
+
+    def commit(self, pending: PendingSignatures):
+        """
+        chunk 写入索引后登记其签名 (行号接在已有 chunk 之后)
+        """
+        if not len(pending.signatures):
+            return
+        self.signatures = np.vstack([self.signatures, pending.signatures])
+        self.band_keys = np.vstack([self.band_keys, pending.band_keys])
+        self._sorted = None
+
+    def nbytes(self) -> int:
+        total = self.signatures.nbytes + self.band_keys.nbytes
+        if self._sorted is not None:
+            total += sum(a.nbytes for a in self._sorted)
+        return int(total)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "dedup_signatures.npy"), self.signatures)
+        np.save(os.path.join(path, "dedup_bands.npy"), self.band_keys)
+
+    def load(self, path: str):
+        sig_path = os.path.join(path, "dedup_signatures.npy")
+        if not os.path.exists(sig_path):
+            return
+        signatures = np.load(sig_path)
+        band_keys = np.load(os.path.join(path, "dedup_bands.npy"))
+        if signatures.shape[1] != self.num_perm or band_keys.shape[1] != self.bands:
+            logger.warning("Dedup index in %s was built with different DEDUP_NUM_PERM/DEDUP_BANDS; ignoring.", path)
+            return
+        self.signatures = signatures
+        self.band_keys = band_keys
+        self._sorted = None
@@ -0,0 +1,144 @@
+import os
+import time
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from app.core.config import settings
+from app.core.logging import logger
+
+# 导入阶段的文档向量化：
+#   - 按文本长度排序后切成 EMBED_BATCH_SIZE 大小的批次，同一批内长度相近，padding 最少
+#   - EMBED_WORKERS > 1 时由 spawn 启动的进程池并行编码，每个进程绑定一段 CPU 核，推理线程数与核数一致
+#   - 批次完成即产出 (顺序不定)，由调用方分批写入索引，不在内存中保留全部向量
+#   - 需要训练量化器时 (sq8 / fp16 / pq)，先向量化随机抽取的 train_sample 条并作为第一批交给调用方，
+#     避免按长度排序后第一批只含最长的 chunk
+
+
+def length_batches(texts: Sequence[str], batch_size: int) -> List[np.ndarray]:
+    """
+    按长度排序后切分，返回每批文本在 texts 中的下标；长批次在前，便于尽早暴露内存问题
+    """
+    lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    order = np.argsort(-lengths, kind="stable")
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def cpu_slices(workers: int) -> List[List[int]]:
+    """
+    将当前进程可用的 CPU 核切成 workers 段连续区间
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    workers = max(1, min(workers, len(cores)))
+    return [part.tolist() for part in np.array_split(np.array(cores), workers)]
+
+
+def _default_model_factory():
+    from app.llm.embedding import EmbeddingModel
+
+    return EmbeddingModel()
+
+
+_worker_model = None
+
+
+def _init_worker(model_factory: Callable, slices):
+    global _worker_model
+    cores = slices.get()
+    # 须在导入 torch 之前设置，线程数与绑定的核数一致，避免各进程线程相互争抢
+    os.environ["OMP_NUM_THREADS"] = str(len(cores))
+    settings.INFERENCE_THREADS = len(cores)
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    _worker_model = model_factory()
+
+
+def _encode_batch(task: Tuple[int, List[str]]) -> Tuple[int, np.ndarray]:
+    batch_id, texts = task
+    return batch_id, np.asarray(_worker_model.embed_documents(texts, batch_size=len(texts)), dtype=np.float32)
+
+
+class DocumentEmbedder:
+    def __init__(self, workers: int = None, batch_size: int = None, model_factory: Optional[Callable] = None):
+        self.workers = workers
+        self.batch_size = batch_size
+        # 子进程中创建嵌入模型的工厂 (需可 pickle)；单进程时直接使用组件注册表中的 embedding_model
+        self.model_factory = model_factory or _default_model_factory
+
+    def iter_embeddings(self, texts: Sequence[str],
+                        first: Optional[np.ndarray] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        逐批产出 (下标, 向量)，下标对应 texts 中的位置；first 中的下标单独分批并先于其余文本提交
+        """
+        workers = self.workers or settings.EMBED_WORKERS
+        batch_size = self.batch_size or settings.EMBED_BATCH_SIZE
+        if first is None:
+            batches = length_batches(texts, batch_size)
+        else:
+            rest = np.setdiff1d(np.arange(len(texts)), first)
+            batches = [group[b] for group in (first, rest) if len(group)
+                       for b in length_batches([texts[i] for i in group], batch_size)]
+        if workers <= 1 or len(batches) <= 1:
+            from app.llm.embedding import embedding_model
+
+            for rows in batches:
+                batch = [texts[i] for i in rows]
+                yield rows, np.asarray(embedding_model.embed_documents(batch, batch_size=len(batch)), dtype=np.float32)
+            return
+
+        import multiprocessing
+
+        ctx = multiprocessing.get_context("spawn")
+        slices = cpu_slices(workers)
+        queue = ctx.Queue()
+        for cores in slices:
+            queue.put(cores)
+        with ctx.Pool(len(slices), initializer=_init_worker, initargs=(self.model_factory, queue)) as pool:
+            tasks = ((i, [texts[j] for j in rows]) for i, rows in enumerate(batches))
+            for batch_id, embeddings in pool.imap_unordered(_encode_batch, tasks):
+                yield batches[batch_id], embeddings
+
+    def embed_to(self, sink: Callable[[np.ndarray, np.ndarray], None], texts: Sequence[str],
+                 write_batch: int = None, train_sample: int = 0) -> float:
+        """
+        向量化并按 write_batch 条一组交给 sink(下标, 向量)，返回吞吐 (chunks/s)。
+        train_sample > 0 时第一次调用 sink 给出的是随机抽取的 train_sample 条 (不足时为全部) 文本，
+        供调用方训练量化器
+        """
+        write_batch = write_batch or settings.EMBED_WRITE_BATCH
+        start = time.perf_counter()
+        first, sample_left = None, 0
+        if train_sample > 0 and len(texts):
+            first = np.sort(np.random.default_rng(0).choice(len(texts), min(train_sample, len(texts)), replace=False))
+            in_sample = np.zeros(len(texts), dtype=bool)
+            in_sample[first] = True
+            sample_rows, sample, sample_left = [], [], len(first)
+        pending_rows, pending, count, done = [], [], 0, 0
+        for rows, embeddings in self.iter_embeddings(texts, first):
+            if sample_left and in_sample[rows[0]]:
+                # 样本批次凑齐后作为第一批写入；其间完成的其余批次先暂存
+                sample_rows.append(rows)
+                sample.append(embeddings)
+                sample_left -= len(rows)
+                if not sample_left:
+                    sink(np.concatenate(sample_rows), np.vstack(sample))
+                    done += len(first)
+                    sample_rows, sample = [], []
+                continue
+            pending_rows.append(rows)
+            pending.append(embeddings)
+            count += len(rows)
+            if count >= write_batch and not sample_left:
+                sink(np.concatenate(pending_rows), np.vstack(pending))
+                done += count
+                pending_rows, pending, count = [], [], 0
+                logger.info("Embedded %d/%d chunks (%.1f chunks/s)", done, len(texts),
+                            done / (time.perf_counter() - start))
+        if pending:
+            sink(np.concatenate(pending_rows), np.vstack(pending))
+        elapsed = time.perf_counter() - start
+        rate = len(texts) / elapsed if elapsed > 0 else 0.0
+        logger.info("Embedded %d chunks in %.1fs (%.1f chunks/s)", len(texts), elapsed, rate,
+                    extra={"event": "embed", "chunks": len(texts), "seconds": elapsed, "chunks_per_sec": rate})
+        return rate
+
+
+document_embedder = DocumentEmbedder()
@@ -1,7 +1,7 @@
 import os
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator, Sequence, Tuple
 from dataclasses import dataclass, asdict
-import pdfplumber
+from app.core.config import settings
 from app.core.logging import logger
 
 @dataclass
@@ -19,6 +19,14 @@ class DocumentChunk:
     def to_dict(self):
         return asdict(self)
 
+def _within_any(obj: Dict[str, Any], bboxes: Sequence[Tuple[float, float, float, float]]) -> bool:
+    # 以对象中心点判断是否位于表格区域内 (bbox 为 x0, top, x1, bottom)
+    if "x0" not in obj or "top" not in obj:
+        return False
+    cx = (obj["x0"] + obj["x1"]) / 2
+    cy = (obj["top"] + obj["bottom"]) / 2
+    return any(x0 <= cx <= x1 and top <= cy <= bottom for x0, top, x1, bottom in bboxes)
+
 class DocumentParser:
     def __init__(self):
         pass
@@ -27,55 +35,75 @@ class DocumentParser:
         """
         解析文件，支持 PDF。
         """
+        return list(self.iter_parse(file_path))
+
+    def iter_parse(self, file_path: str) -> Iterator[DocumentChunk]:
+        """
+        逐页产出 DocumentChunk，大文件无需整体驻留内存
+        """
         ext = os.path.splitext(file_path)[1].lower()
         if ext == '.pdf':
             return self._parse_pdf(file_path)
         elif ext in ['.md', '.txt']:
-            return self._parse_text(file_path)
+            return iter(self._parse_text(file_path))
         else:
-            logger.warning(f"Unsupported file type: {ext}")
-            return []
+            logger.warning("Unsupported file type: %s", ext)
+            return iter([])
+
+    def _parse_pdf(self, file_path: str) -> Iterator[DocumentChunk]:
+        import pdfplumber
 
-    def _parse_pdf(self, file_path: str) -> List[DocumentChunk]:
-        chunks = []
         doc_id = os.path.basename(file_path)
+        window = max(1, settings.PDF_PAGE_WINDOW)
+        first_page = 1
         
         try:
-            with pdfplumber.open(file_path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    page_num = i + 1
-                    
-                    # 提取表格
-                    tables = page.extract_tables()
-                    for table_idx, table in enumerate(tables):
-                        # 将表格转换为 Markdown 格式文本
-                        table_text = self._table_to_markdown(table)
-                        chunks.append(DocumentChunk(
-                            doc_id=doc_id,
-                            page=page_num,
-                            section_path=f"Page {page_num} Table {table_idx+1}",
-                            text=table_text,
-                            is_table=True,
-                            table_path=f"table_{page_num}_{table_idx}"
-                        ))
-
-                    # 提取正文文本 (简单过滤掉表格区域可能比较复杂，这里简化处理，直接提取全文)
-                    # 实际生产中应剔除表格区域
-                    text = page.extract_text()
-                    if text:
-                        # 简单的按段落分割，后续由 Chunker 进一步处理
-                        # 这里先作为一个大块返回，或者按换行符粗分
-                        chunks.append(DocumentChunk(
-                            doc_id=doc_id,
-                            page=page_num,
-                            section_path=f"Page {page_num} Content",
-                            text=text,
-                            is_table=False
-                        ))
+            while True:
+                # 每 PDF_PAGE_WINDOW 页重新打开一次文件，释放 pdfminer 累积的字体/资源缓存，限制单文件内存
+                with pdfplumber.open(file_path, pages=list(range(first_page, first_page + window))) as pdf:
+                    pages = pdf.pages
+                    for page in pages:
+                        yield from self._parse_pdf_page(doc_id, page)
+                        # 释放本页缓存的版面对象 (chars / rects / 表格查找结果)
+                        page.close()
+                if len(pages) < window:
+                    break
+                first_page += window
         except Exception as e:
-            logger.error(f"Error parsing PDF {file_path}: {e}")
-            
-        return chunks
+            logger.error("Error parsing PDF %s: %s", file_path, e)
+
+    def _parse_pdf_page(self, doc_id: str, page) -> Iterator[DocumentChunk]:
+        page_num = page.page_number
+        
+        # 提取表格
+        tables = page.find_tables()
+        for table_idx, table in enumerate(tables):
+            # 将表格转换为 Markdown 格式文本
+            table_text = self._table_to_markdown(table.extract())
+            if table_text:
+                yield DocumentChunk(
+                    doc_id=doc_id,
+                    page=page_num,
+                    section_path=f"Page {page_num} Table {table_idx+1}",
+                    text=table_text,
+                    is_table=True,
+                    table_path=f"table_{page_num}_{table_idx}"
+                )
+
+        # 提取正文文本，剔除落在表格区域内的字符，避免表格内容重复入库
+        if tables:
+            bboxes = [table.bbox for table in tables]
+            page = page.filter(lambda obj: not _within_any(obj, bboxes))
+        text = page.extract_text()
+        if text:
+            # 整页正文作为一个大块返回，后续由 Chunker 进一步切分
+            yield DocumentChunk(
+                doc_id=doc_id,
+                page=page_num,
+                section_path=f"Page {page_num} Content",
+                text=text,
+                is_table=False
+            )
 
     def _parse_text(self, file_path: str) -> List[DocumentChunk]:
         doc_id = os.path.basename(file_path)
@@ -91,7 +119,7 @@ class DocumentParser:
                     is_table=False
                 ))
         except Exception as e:
-            logger.error(f"Error parsing text file {file_path}: {e}")
+            logger.error("Error parsing text file %s: %s", file_path, e)
         return chunks
 
     def _table_to_markdown(self, table: List[List[str]]) -> str:
@@ -100,8 +128,6 @@ class DocumentParser:
         # 简单处理 None
         table = [['' if cell is None else str(cell).replace('\n', ' ') for cell in row] for row in table]
         
-        markdown = "|" + "|".join(table[0]) + "|\n"
-        markdown += "|" + "|".join(["---"] * len(table[0])) + "|\n"
-        for row in table[1:]:
-            markdown += "|" + "|".join(row) + "|\n"
-        return markdown
+        lines = ["|" + "|".join(table[0]) + "|", "|" + "|".join(["---"] * len(table[0])) + "|"]
+        lines.extend("|" + "|".join(row) + "|" for row in table[1:])
+        return "\n".join(lines) + "\n"
@@ -1,8 +1,9 @@
-from typing import List
+from typing import Dict, List
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from app.core.config import settings
 from app.core.logging import logger
+from app.core.memory import tensor_bytes
+from app.core.registry import components
 
 class EmbeddingModel:
     _instance = None
@@ -14,20 +15,19 @@ class EmbeddingModel:
         return cls._instance
 
     def _initialize(self):
-        logger.info(f"Loading embedding model: {settings.EMBEDDING_MODEL_ID}")
-        self.model = SentenceTransformer(
-            settings.EMBEDDING_MODEL_ID, 
-            device=settings.DEVICE
-        )
+        from app.llm.optimized import load_sentence_encoder
+
+        logger.info("Loading embedding model: %s (backend=%s)", settings.EMBEDDING_MODEL_ID, settings.INFERENCE_BACKEND)
+        self.model = load_sentence_encoder(settings.EMBEDDING_MODEL_ID)
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
 
-    def embed_documents(self, texts: List[str]) -> np.ndarray:
+    def embed_documents(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
         """
         生成文档嵌入
         """
         if not texts:
             return np.array([])
-        embeddings = self.model.encode(texts, normalize_embeddings=True)
+        embeddings = self.model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
         return embeddings
 
     def embed_query(self, query: str) -> np.ndarray:
@@ -40,4 +40,15 @@ class EmbeddingModel:
         instruction = "为这个句子生成表示以用于检索相关文章："
         return self.model.encode([instruction + query], normalize_embeddings=True)[0]
 
-embedding_model = EmbeddingModel()
+    def embed_queries(self, queries: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        批量生成查询嵌入 (与 embed_query 使用相同的指令前缀)，返回 (nq, dim)
+        """
+        instruction = "为这个句子生成表示以用于检索相关文章："
+        return self.model.encode([instruction + q for q in queries], batch_size=batch_size, normalize_embeddings=True)
+
+    def memory_usage(self) -> Dict[str, int]:
+        # ONNX 后端的权重由 onnxruntime 分配，无法统计 (计入 unaccounted)
+        return {"model_weights": tensor_bytes(self.model)}
+
+embedding_model = components.lazy("embedding_model", EmbeddingModel)
@@ -1,28 +1,74 @@
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
-from typing import List, Dict, Any, Generator
-import openai
+import time
+from typing import List, Dict, Any, Generator, Optional
+from app.core.admission import remaining_time
 from app.core.config import settings
 from app.core.logging import logger
+from app.core.memory import tensor_bytes
+from app.core.metrics import record_tokens, record_generation
+from app.core.registry import components
+from app.llm import structured
+
+# 本地模型投机解码 (SPECULATIVE_DECODING):
+#   off            逐 token 贪心解码
+#   draft          小模型 (DRAFT_MODEL_ID，需与 SFT 模型共用词表) 起草，SFT 模型一次前向校验
+#   prompt_lookup  从 Prompt (证据原文) 中查找与当前结尾 n-gram 相同的片段作为草稿，无需额外模型
+# 贪心校验只接受与 SFT 模型自身 argmax 一致的草稿 token，输出与 off 模式相同。
+SPECULATIVE_MODES = ("off", "draft", "prompt_lookup")
+
+
+def configured_model_id() -> str:
+    """
+    当前配置下生成模型的标识：OpenAI 兼容接口为其地址，否则为本地 SFT 模型路径
+    """
+    if settings.OPENAI_BASE_URL and settings.OPENAI_API_KEY:
+        return f"openai:{settings.OPENAI_BASE_URL}"
+    return settings.SFT_MODEL_ID
+
+
+class DecodeCounter:
+    """
+    以停止条件的形式统计校验步数：每次目标模型前向 (接受若干草稿 token + 1 个自身 token) 调用一次
+    """
+    def __init__(self):
+        self.steps = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        self.steps += 1
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
 
 class LLMGenerator:
     def __init__(self):
         self.use_openai = False
         self.model = None
         self.tokenizer = None
+        self.draft_model = None
+        self.model_id = configured_model_id()
+        if settings.SPECULATIVE_DECODING not in SPECULATIVE_MODES:
+            raise ValueError(f"Unknown SPECULATIVE_DECODING: {settings.SPECULATIVE_DECODING}, "
+                             f"expected one of {SPECULATIVE_MODES}")
+        if settings.STRUCTURED_OUTPUT not in structured.MODES:
+            raise ValueError(f"Unknown STRUCTURED_OUTPUT: {settings.STRUCTURED_OUTPUT}, expected one of {structured.MODES}")
         
         if settings.OPENAI_BASE_URL and settings.OPENAI_API_KEY:
+            import openai
+
             self.use_openai = True
             self.client = openai.OpenAI(
                 base_url=settings.OPENAI_BASE_URL,
                 api_key=settings.OPENAI_API_KEY
             )
-            logger.info(f"Using OpenAI compatible API at {settings.OPENAI_BASE_URL}")
+            logger.info("Using OpenAI compatible API at %s", settings.OPENAI_BASE_URL)
         else:
             self._load_local_model()
 
     def _load_local_model(self):
-        logger.info(f"Loading local SFT model: {settings.SFT_MODEL_ID}")
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+
+        logger.info("Loading local SFT model: %s", settings.SFT_MODEL_ID)
         try:
             quantization_config = None
             try:
@@ -35,7 +81,7 @@ class LLMGenerator:
             except ImportError:
                 logger.warning("bitsandbytes not installed or compatible, falling back to standard loading.")
             except Exception as e:
-                logger.warning(f"bitsandbytes config failed: {e}, falling back to standard loading.")
+                logger.warning("bitsandbytes config failed: %s, falling back to standard loading.", e)
                 quantization_config = None
 
             self.tokenizer = AutoTokenizer.from_pretrained(
@@ -61,53 +107,217 @@ class LLMGenerator:
             )
             self.model.eval()
         except Exception as e:
-            logger.error(f"Failed to load local model: {e}")
+            logger.error("Failed to load local model: %s", e)
             raise e
 
-    def generate(self, prompt: str, stream: bool = False) -> str | Generator[str, None, None]:
+        if settings.SPECULATIVE_DECODING == "draft":
+            self._load_draft_model()
+
+    def _load_draft_model(self):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        if not settings.DRAFT_MODEL_ID:
+            logger.warning("SPECULATIVE_DECODING=draft but DRAFT_MODEL_ID is not set, using plain decoding.")
+            return
+        logger.info("Loading draft model: %s", settings.DRAFT_MODEL_ID)
+        # 草稿模型很小，不做量化；与主模型放在同一设备上
+        self.draft_model = AutoModelForCausalLM.from_pretrained(
+            settings.DRAFT_MODEL_ID,
+            trust_remote_code=True,
+            torch_dtype=torch.float16 if settings.DEVICE != "cpu" else torch.float32
+        ).to(self.model.device)
+        self.draft_model.eval()
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        本地模型 (及草稿模型) 的权重；OpenAI 兼容接口模式下为空
+        """
+        usage = {}
+        if self.model is not None:
+            usage["model_weights"] = tensor_bytes(self.model)
+        if self.draft_model is not None:
+            usage["draft_model_weights"] = tensor_bytes(self.draft_model)
+        return usage
+
+    def _speculative_kwargs(self, mode: str) -> Dict[str, Any]:
+        if mode == "draft" and self.draft_model is not None:
+            return {"assistant_model": self.draft_model}
+        if mode == "prompt_lookup":
+            return {"prompt_lookup_num_tokens": settings.PROMPT_LOOKUP_TOKENS,
+                    "max_matching_ngram_size": settings.PROMPT_LOOKUP_NGRAM}
+        return {}
+
+    def generate(self, prompt: str, stream: bool = False, schema: Optional[Dict[str, Any]] = None,
+                 max_new_tokens: Optional[int] = None) -> str | Generator[str, None, None]:
+        """
+        schema 不为 None 时按 STRUCTURED_OUTPUT 约束输出为单个 JSON 对象，对象闭合即停止生成。
+        max_new_tokens 默认为 MAX_OUTPUT_TOKENS (降级时调低)；生成时间不超过当前请求的剩余时间
+        """
         if self.use_openai:
-            return self._generate_openai(prompt, stream)
+            return self._generate_openai(prompt, stream, schema, max_new_tokens)
         else:
-            return self._generate_local(prompt, stream)
+            return self._generate_local(prompt, stream, schema, max_new_tokens=max_new_tokens)
+
+    def generate_batch(self, prompts: List[str], schema: Optional[Dict[str, Any]] = None,
+                       max_new_tokens: Optional[int] = None) -> List[str]:
+        """
+        批量生成 (不流式，用于离线评审等)：本地模型左填充后一次 generate，各行的 JSON 对象闭合后分别停止；
+        OpenAI 兼容接口逐条请求，并发由调用方的线程池控制
+        """
+        if not prompts:
+            return []
+        if self.use_openai:
+            return [self._generate_openai(p, False, schema, max_new_tokens) for p in prompts]
+        return self._generate_local_batch(prompts, schema, max_new_tokens)
 
-    def _generate_openai(self, prompt: str, stream: bool):
+    def _generate_openai(self, prompt: str, stream: bool, schema: Optional[Dict[str, Any]] = None,
+                         max_new_tokens: Optional[int] = None):
         try:
+            kwargs = {}
+            response_format = structured.openai_response_format(schema)
+            if response_format:
+                kwargs["response_format"] = response_format
+            remaining = remaining_time()
+            if remaining is not None:
+                kwargs["timeout"] = max(remaining, 0.1)
             response = self.client.chat.completions.create(
                 model="default", # 模型名通常不重要，取决于后端
                 messages=[{"role": "user", "content": prompt}],
-                max_tokens=settings.MAX_OUTPUT_TOKENS,
+                max_tokens=max_new_tokens or settings.MAX_OUTPUT_TOKENS,
                 temperature=0.1,
-                stream=stream
+                stream=stream,
+                **kwargs
             )
             if stream:
                 def streamer():
                     for chunk in response:
                         if chunk.choices[0].delta.content:
                             yield chunk.choices[0].delta.content
-                return streamer()
+
+                if schema is None:
+                    return streamer()
+
+                def json_streamer():
+                    # 对象闭合后关闭连接，服务端随之停止生成
+                    try:
+                        yield from structured.iter_json_object(streamer())
+                    finally:
+                        response.close()
+                return json_streamer()
             else:
+                if response.usage:
+                    record_tokens(response.usage.prompt_tokens, response.usage.completion_tokens)
                 return response.choices[0].message.content
         except Exception as e:
-            logger.error(f"OpenAI API error: {e}")
+            logger.error("OpenAI API error: %s", e)
             return "Error generating response."
 
-    def _generate_local(self, prompt: str, stream: bool):
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+    def _generate_local(self, prompt: str, stream: bool, schema: Optional[Dict[str, Any]] = None,
+                        speculative: Optional[str] = None, max_new_tokens: Optional[int] = None):
+        """
+        speculative 覆盖 SPECULATIVE_DECODING (用于一致性对比)
+        """
+        import torch
+        from transformers import StoppingCriteriaList
+
+        generate_kwargs = self._speculative_kwargs(speculative or settings.SPECULATIVE_DECODING)
+        mode = (speculative or settings.SPECULATIVE_DECODING) if generate_kwargs else "off"
+        counter = DecodeCounter()
+        stopping = StoppingCriteriaList([counter])
+        remaining = remaining_time()
+        if remaining is not None:
+            # 到达请求截止时间即停止生成 (输出可能不完整，由解析阶段回退)
+            generate_kwargs["max_time"] = max(remaining, 0.1)
+
+        # 结构化输出：优先按 schema 约束解码，否则以 "{" 预填充回答，跳过 JSON 之前的说明文字
+        prefix = ""
+        if schema is not None and settings.STRUCTURED_OUTPUT != "off":
+            allowed_tokens = structured.schema_prefix_fn(self.tokenizer, schema) \
+                if settings.STRUCTURED_OUTPUT == "schema" else None
+            if allowed_tokens is not None:
+                generate_kwargs["prefix_allowed_tokens_fn"] = allowed_tokens
+            else:
+                prefix = "{"
+
+        inputs = self.tokenizer(prompt + prefix, return_tensors="pt").to(self.model.device)
+        input_len = inputs.input_ids.shape[1]
+        if schema is not None and settings.STRUCTURED_OUTPUT != "off":
+            stopping.append(structured.JSONStoppingCriteria(self.tokenizer, input_len, prefix))
         
         # 简单的非流式实现，流式需要 TextIteratorStreamer
         if stream:
             # 暂未实现本地流式，回退到非流式
             logger.warning("Local streaming not implemented yet, falling back to non-streaming.")
         
+        start = time.perf_counter()
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
-                max_new_tokens=settings.MAX_OUTPUT_TOKENS,
+                max_new_tokens=max_new_tokens or settings.MAX_OUTPUT_TOKENS,
                 do_sample=False, # 确定性输出
-                temperature=0.1
+                stopping_criteria=stopping,
+                **generate_kwargs
             )
         
-        response = self.tokenizer.decode(outputs[0][inputs.input_ids.shape[1]:], skip_special_tokens=True)
-        return response
+        record_tokens(input_len, outputs.shape[1] - input_len)
+        record_generation(mode, outputs.shape[1] - input_len, counter.steps, time.perf_counter() - start)
+        response = self.tokenizer.decode(outputs[0][input_len:], skip_special_tokens=True)
+        return prefix + response
+
+    def _generate_local_batch(self, prompts: List[str], schema: Optional[Dict[str, Any]] = None,
+                              max_new_tokens: Optional[int] = None) -> List[str]:
+        """
+        投机解码只支持单条输入，批量生成总是逐 token 贪心解码
+        """
+        import torch
+        from transformers import StoppingCriteriaList
+
+        generate_kwargs = {}
+        counter = DecodeCounter()
+        stopping = StoppingCriteriaList([counter])
+        remaining = remaining_time()
+        if remaining is not None:
+            generate_kwargs["max_time"] = max(remaining, 0.1)
+
+        prefix = ""
+        if schema is not None and settings.STRUCTURED_OUTPUT != "off":
+            allowed_tokens = structured.schema_prefix_fn(self.tokenizer, schema) \
+                if settings.STRUCTURED_OUTPUT == "schema" else None
+            if allowed_tokens is not None:
+                generate_kwargs["prefix_allowed_tokens_fn"] = allowed_tokens
+            else:
+                prefix = "{"
+
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # 解码器模型需左填充，使各行的生成位置对齐
+        padding_side, self.tokenizer.padding_side = self.tokenizer.padding_side, "left"
+        try:
+            inputs = self.tokenizer([p + prefix for p in prompts], return_tensors="pt",
+                                    padding=True).to(self.model.device)
+        finally:
+            self.tokenizer.padding_side = padding_side
+        input_len = inputs.input_ids.shape[1]
+        if schema is not None and settings.STRUCTURED_OUTPUT != "off":
+            stopping.append(structured.JSONStoppingCriteria(self.tokenizer, input_len, prefix))
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens or settings.MAX_OUTPUT_TOKENS,
+                do_sample=False,
+                stopping_criteria=stopping,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **generate_kwargs
+            )
+
+        generated = outputs[:, input_len:]
+        tokens_out = int((generated != self.tokenizer.pad_token_id).sum())
+        record_tokens(int(inputs.attention_mask.sum()), tokens_out)
+        # 每步前向为整批各产出 1 个 token
+        record_generation("off", tokens_out, counter.steps * len(prompts), time.perf_counter() - start)
+        return [prefix + self.tokenizer.decode(row, skip_special_tokens=True) for row in generated]
 
-llm_generator = LLMGenerator()
+llm_generator = components.lazy("llm_generator", LLMGenerator)
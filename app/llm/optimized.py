@@ -0,0 +1,147 @@
+import os
+import re
+from typing import List
+import numpy as np
+from app.core.config import settings
+from app.core.logging import logger
+
+# CPU 推理加速后端 (INFERENCE_BACKEND):
+#   torch  原始 fp32 PyTorch 模型
+#   int8   PyTorch 动态量化，nn.Linear 权重转为 int8，无需额外依赖
+#   onnx   导出为 ONNX 图并用 onnxruntime 推理 (需安装 optimum[onnxruntime])
+# 各后端对外暴露与 sentence-transformers 相同的 encode / predict 接口。
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def apply_thread_settings():
+    """
+    按 INFERENCE_THREADS 设置 torch 的计算线程数 (0 表示使用默认值)
+    """
+    if settings.INFERENCE_THREADS <= 0:
+        return
+    import torch
+
+    torch.set_num_threads(settings.INFERENCE_THREADS)
+
+
+def quantize_int8(module):
+    """
+    对 nn.Linear 做动态 int8 量化 (原地替换，避免同时持有两份权重)
+    """
+    import torch
+
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _session_options():
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    if settings.INFERENCE_THREADS > 0:
+        options.intra_op_num_threads = settings.INFERENCE_THREADS
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+def _load_ort_model(model_cls, model_id: str):
+    """
+    首次使用时导出 ONNX 并缓存到 ONNX_EXPORT_DIR，之后直接加载
+    """
+    export_dir = os.path.join(settings.ONNX_EXPORT_DIR, re.sub(r"[^\w.-]", "_", model_id))
+    if os.path.exists(os.path.join(export_dir, "model.onnx")):
+        return model_cls.from_pretrained(export_dir, session_options=_session_options())
+    logger.info("Exporting %s to ONNX at %s", model_id, export_dir)
+    model = model_cls.from_pretrained(model_id, export=True, session_options=_session_options())
+    model.save_pretrained(export_dir)
+    return model
+
+
+class OnnxSentenceEncoder:
+    """
+    onnxruntime 版句向量编码器，使用 CLS pooling (与 BGE 系列一致)
+    """
+    def __init__(self, model_id: str, max_length: int = 512):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = _load_ort_model(ORTModelForFeatureExtraction, model_id)
+        self.max_length = max_length
+        self._dim = self.model.config.hidden_size
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dim
+
+    def encode(self, texts: List[str], batch_size: int = 32, normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=self.max_length, return_tensors="np")
+            hidden = self.model(**inputs).last_hidden_state
+            outputs.append(np.asarray(hidden)[:, 0])
+        embeddings = np.vstack(outputs).astype(np.float32)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True).clip(min=1e-12)
+        return embeddings
+
+
+class OnnxCrossEncoder:
+    """
+    onnxruntime 版 Cross-Encoder，单标签输出经 sigmoid (与 CrossEncoder.predict 默认行为一致)
+    """
+    def __init__(self, model_id: str, max_length: int = 512):
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = _load_ort_model(ORTModelForSequenceClassification, model_id)
+        self.max_length = max_length
+
+    def predict(self, pairs: List[List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            inputs = self.tokenizer([p[0] for p in batch], [p[1] for p in batch], padding=True,
+                                    truncation=True, max_length=self.max_length, return_tensors="np")
+            logits = np.asarray(self.model(**inputs).logits)
+            scores.append(1.0 / (1.0 + np.exp(-logits[:, 0])))
+        return np.concatenate(scores) if scores else np.array([])
+
+
+def load_sentence_encoder(model_id: str, backend: str = None):
+    backend = backend or settings.INFERENCE_BACKEND
+    apply_thread_settings()
+    if backend == "onnx":
+        try:
+            return OnnxSentenceEncoder(model_id)
+        except ImportError as e:
+            logger.warning("ONNX backend unavailable (%s), falling back to torch.", e)
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_id, device=settings.DEVICE)
+    if backend == "int8":
+        if settings.DEVICE != "cpu":
+            logger.warning("int8 dynamic quantization only applies on CPU, keeping fp32 on %s.", settings.DEVICE)
+        else:
+            quantize_int8(model)
+    return model
+
+
+def load_cross_encoder(model_id: str, backend: str = None, max_length: int = 512):
+    backend = backend or settings.INFERENCE_BACKEND
+    apply_thread_settings()
+    if backend == "onnx":
+        try:
+            return OnnxCrossEncoder(model_id, max_length=max_length)
+        except ImportError as e:
+            logger.warning("ONNX backend unavailable (%s), falling back to torch.", e)
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_id, device=settings.DEVICE, max_length=max_length)
+    if backend == "int8":
+        if settings.DEVICE != "cpu":
+            logger.warning("int8 dynamic quantization only applies on CPU, keeping fp32 on %s.", settings.DEVICE)
+        else:
+            quantize_int8(model.model)
+    return model
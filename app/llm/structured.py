@@ -0,0 +1,196 @@
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import LLM_RESPONSES
+
+# 结构化输出 (STRUCTURED_OUTPUT):
+#   schema  OpenAI 兼容接口使用 response_format=json_schema；本地模型在安装 lm-format-enforcer 时按 schema 约束解码
+#   json    OpenAI 兼容接口使用 response_format=json_object；本地模型以 "{" 预填充回答
+#   off     不约束，仅在解析时提取 JSON
+# 三种模式下都用增量扫描器检测顶层对象闭合：本地模型与流式输出在对象闭合时立即停止生成。
+
+MODES = ("schema", "json", "off")
+
+RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "risk_level": {"type": "string", "enum": ["low", "medium", "high"]},
+        "rationale": {"type": "string"},
+        "citations": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "doc_id": {"type": "string"},
+                    "page": {"type": "integer"},
+                    "quote": {"type": "string"},
+                },
+                "required": ["doc_id", "page"],
+            },
+        },
+        "recommendations": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["risk_level", "rationale", "citations", "recommendations"],
+}
+
+
+class JSONObjectScanner:
+    """
+    增量扫描第一个顶层 JSON 对象：跳过对象之前的文字，跟踪括号深度与字符串/转义状态。
+    只做结构扫描不做完整解析，每个字符 O(1)
+    """
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.done = False
+        self._in_string = False
+        self._escape = False
+        self._parts = []
+        self.last = ""
+
+    def feed(self, text: str) -> int:
+        """
+        输入一段文本，返回对象在这段文本中结束的位置 (闭合括号之后)；尚未结束返回 -1
+        """
+        self.last = ""
+        if self.done:
+            return 0
+        start = 0
+        if not self.started:
+            start = text.find("{")
+            if start < 0:
+                return -1
+            self.started = True
+        for i in range(start, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{" or ch == "[":
+                self.depth += 1
+            elif ch == "}" or ch == "]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.last = text[start:i + 1]
+                    self._parts.append(self.last)
+                    self.done = True
+                    return i + 1
+        self.last = text[start:]
+        self._parts.append(self.last)
+        return -1
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+
+def iter_json_object(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    流式输出中截取第一个 JSON 对象：对象之前的文字丢弃，对象闭合后停止消费上游
+    """
+    scanner = JSONObjectScanner()
+    for chunk in chunks:
+        end = scanner.feed(chunk)
+        if scanner.last:
+            yield scanner.last
+        if end >= 0:
+            return
+
+
+def fallback_response(raw_response: str) -> Dict[str, Any]:
+    return {
+        "risk_level": "unknown",
+        "rationale": raw_response,
+        "citations": [],
+        "recommendations": []
+    }
+
+
+def parse_json_object(raw_response: str) -> Dict[str, Any]:
+    """
+    解析生成结果中的第一个 JSON 对象；找不到或不合法时返回 risk_level=unknown 的兜底结果
+    """
+    scanner = JSONObjectScanner()
+    scanner.feed(raw_response or "")
+    if scanner.done:
+        try:
+            value = json.loads(scanner.text)
+            if isinstance(value, dict):
+                LLM_RESPONSES.labels("json").inc()
+                return value
+        except json.JSONDecodeError:
+            pass
+    LLM_RESPONSES.labels("fallback").inc()
+    logger.warning("LLM response is not a complete JSON object (%d chars)", len(raw_response or ""))
+    return fallback_response(raw_response)
+
+
+def openai_response_format(schema: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if schema is None or settings.STRUCTURED_OUTPUT == "off":
+        return None
+    if settings.STRUCTURED_OUTPUT == "schema":
+        return {"type": "json_schema", "json_schema": {"name": "slope_risk_answer", "schema": schema}}
+    return {"type": "json_object"}
+
+
+class JSONStoppingCriteria:
+    """
+    transformers 生成的停止条件：解码上次调用之后新生成的 token 并送入扫描器，顶层对象闭合即停止
+    (投机解码时每步可能新增多个 token)。prefix 为已写入 Prompt 的回答前缀 (如预填充的 "{")。
+    批量生成时每行一个扫描器，各行的对象闭合后分别停止
+    """
+    def __init__(self, tokenizer, prompt_length: int, prefix: str = ""):
+        self.tokenizer = tokenizer
+        self.prefix = prefix
+        self.scanners: List[JSONObjectScanner] = []
+        self._seen = prompt_length
+
+    @property
+    def scanner(self) -> JSONObjectScanner:
+        return self.scanners[0]
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+
+        while len(self.scanners) < input_ids.shape[0]:
+            scanner = JSONObjectScanner()
+            scanner.feed(self.prefix)
+            self.scanners.append(scanner)
+        for row, scanner in enumerate(self.scanners):
+            if not scanner.done:
+                scanner.feed(self.tokenizer.decode(input_ids[row, self._seen:], skip_special_tokens=True))
+        self._seen = input_ids.shape[1]
+        return torch.tensor([s.done for s in self.scanners], dtype=torch.bool, device=input_ids.device)
+
+
+_enforcer_data = {}
+_enforcer_missing = False
+
+
+def schema_prefix_fn(tokenizer, schema: Dict[str, Any]):
+    """
+    基于 lm-format-enforcer 的 prefix_allowed_tokens_fn，逐步屏蔽不符合 schema 的 token；
+    未安装时返回 None。词表前缀树的构建较慢，按 tokenizer 缓存
+    """
+    global _enforcer_missing
+    if _enforcer_missing:
+        return None
+    try:
+        from lmformatenforcer import JsonSchemaParser
+        from lmformatenforcer.integrations.transformers import (
+            build_token_enforcer_tokenizer_data, build_transformers_prefix_allowed_tokens_fn)
+    except ImportError:
+        logger.warning("lm-format-enforcer not installed, falling back to prefilled JSON decoding.")
+        _enforcer_missing = True
+        return None
+    data = _enforcer_data.get(id(tokenizer))
+    if data is None:
+        data = _enforcer_data[id(tokenizer)] = build_token_enforcer_tokenizer_data(tokenizer)
+    return build_transformers_prefix_allowed_tokens_fn(data, JsonSchemaParser(schema))
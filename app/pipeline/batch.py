@@ -0,0 +1,161 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from app.index.filters import MetadataFilter
+from app.core.config import settings
+from app.core.logging import logger
+
+# 批量问答任务：
+#   - 问题按 BATCH_QUESTION_SIZE 分组，组内查询编码、FAISS、BM25 与重排合并执行 (RAGPipeline.run_batch)
+#   - 每个问题完成即追加一行到 BATCH_DIR/<job_id>.jsonl，任务进行中也可下载已完成的部分
+#   - 任务状态同时写入 BATCH_DIR/<job_id>.json，多 worker 部署时任一 worker 都能查询
+#   - 同一进程内的任务逐个执行，避免多个任务争抢模型
+#   - 内存中只保留排队 / 执行中的任务，结束后移出 _jobs，之后的查询读取状态文件
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BatchJob:
+    def __init__(self, job_id: str, total: int, output_dir: str):
+        self.id = job_id
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.status = "queued"  # queued | running | done | failed
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.results_path = os.path.join(output_dir, f"{job_id}.jsonl")
+        self.status_path = os.path.join(output_dir, f"{job_id}.json")
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        return {
+            "job_id": self.id, "status": self.status, "total": self.total, "done": self.done,
+            "failed": self.failed, "error": self.error, "created_at": self.created_at,
+            "finished_at": self.finished_at, "questions_per_sec": round(self.done / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    def save(self):
+        tmp_path = self.status_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.status_path)
+
+
+class BatchRunner:
+    def __init__(self, output_dir: str = None):
+        self.output_dir = output_dir
+        self._jobs: Dict[str, BatchJob] = {}
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _dir(self) -> str:
+        path = self.output_dir or settings.BATCH_DIR
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # 线程不随 fork 复制，每个 worker 进程单独创建
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch")
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    @staticmethod
+    def parse_items(items: List[Any], filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        规范化问题列表：元素为问题字符串或 {"id", "question", "filters"}，
+        filters 缺省时使用整批的 filters。格式错误抛出 ValueError
+        """
+        if not items:
+            raise ValueError("No questions given")
+        if len(items) > settings.BATCH_MAX_QUESTIONS:
+            raise ValueError(f"At most {settings.BATCH_MAX_QUESTIONS} questions per batch")
+        parsed = []
+        for i, item in enumerate(items):
+            if isinstance(item, str):
+                item = {"question": item}
+            if not isinstance(item, dict) or not isinstance(item.get("question"), str) or not item["question"].strip():
+                raise ValueError(f"Item {i} has no question")
+            item_filters = item.get("filters", filters)
+            parsed.append({
+                "id": item.get("id", i),
+                "question": item["question"],
+                "filters": MetadataFilter.parse(item_filters) if item_filters else None,
+            })
+        return parsed
+
+    def submit(self, items: List[Dict[str, Any]]) -> BatchJob:
+        """
+        items 为 parse_items 的结果；任务在后台线程中执行
+        """
+        job = BatchJob(uuid.uuid4().hex, len(items), self._dir())
+        with self._lock:
+            self._jobs[job.id] = job
+        job.save()
+        self._executor().submit(self._run, job, items)
+        logger.info("Queued batch job %s with %d questions", job.id, job.total,
+                    extra={"event": "batch_queued", "job_id": job.id, "questions": job.total})
+        return job
+
+    def _run(self, job: BatchJob, items: List[Dict[str, Any]]):
+        from app.pipeline.rag_pipeline import rag_pipeline
+
+        job.status = "running"
+        job.save()
+        try:
+            with open(job.results_path, "w", encoding="utf-8") as out:
+                for start in range(0, len(items), settings.BATCH_QUESTION_SIZE):
+                    group = items[start:start + settings.BATCH_QUESTION_SIZE]
+                    results = rag_pipeline.run_batch([it["question"] for it in group], [it["filters"] for it in group])
+                    for i, result in results:
+                        item = group[i]
+                        record = {"index": start + i, "id": item["id"], "question": item["question"], **result}
+                        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        out.flush()
+                        job.done += 1
+                        job.failed += "error" in result
+                    job.save()
+            job.status = "done"
+        except Exception as e:
+            logger.exception("Batch job %s failed: %s", job.id, e)
+            job.status, job.error = "failed", str(e)
+        job.finished_at = time.time()
+        try:
+            job.save()
+        finally:
+            # 最终状态已落盘，任务移出内存，长期运行的进程不会随任务数增长
+            with self._lock:
+                self._jobs.pop(job.id, None)
+        logger.info("Batch job %s %s: %d/%d questions (%d failed)", job.id, job.status, job.done, job.total,
+                    job.failed, extra={"event": "batch_finished", "job_id": job.id, **job.to_dict()})
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        任务状态；已结束或不在本进程中的任务从状态文件读取 (多 worker)
+        """
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        path = self.status_path(job_id)
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def status_path(self, job_id: str) -> Optional[str]:
+        return os.path.join(self._dir(), f"{job_id}.json") if _JOB_ID.match(job_id) else None
+
+    def results_path(self, job_id: str) -> Optional[str]:
+        return os.path.join(self._dir(), f"{job_id}.jsonl") if _JOB_ID.match(job_id) else None
+
+
+batch_runner = BatchRunner()
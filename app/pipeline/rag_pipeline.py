@@ -1,74 +1,159 @@
 import json
-import re
-from typing import Dict, Any, List
-from app.search.retrieve import HybridRetriever
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from app.search.retrieve import create_retriever
 from app.search.rerank import reranker
+from app.index.filters import MetadataFilter
+from app.ingest.parser import DocumentChunk
 from app.llm.generator import llm_generator
+from app.llm.structured import RESPONSE_SCHEMA, parse_json_object
 from app.prompt.prompt_builder import prompt_builder
 from app.utils.citations import validate_citations
+from app.core.admission import Degradation, current_deadline, record_degradation, remaining_time
 from app.core.config import settings
-from app.core.logging import logger
-from app.tools.weather import weather_tool
-from app.tools.engineering import engineering_tool
+from app.core.logging import logger, retrieval_logger, log_retrieval_metrics
+from app.core.metrics import stage_timer, observe_candidates, BATCH_QUESTIONS
+from app.core.tracing import current_trace
+from app.core.registry import components
+from app.tools.executor import tool_executor
+from app.tools import weather, engineering  # noqa: F401  注册工具
 
 class RAGPipeline:
     def __init__(self):
-        self.retriever = HybridRetriever()
+        # 检索器构建时会加载索引，延迟到首次使用或 warm-up
+        self.retriever = components.lazy("retriever", create_retriever)
 
-    def run(self, query: str) -> Dict[str, Any]:
-        logger.info(f"Starting RAG pipeline for query: {query}")
+    def run(self, query: str, filters: Optional[MetadataFilter] = None,
+            plan: Optional[Degradation] = None) -> Dict[str, Any]:
+        """
+        plan 为准入控制选择的降级方案 (默认不降级)；截止时间取自当前请求的 deadline_scope，
+        剩余时间不足时跳过重排，已超时则在检索 / 生成前抛出 DeadlineExceeded。
+        实际应用的降级记录在结果的 degraded 字段中
+        """
+        retrieval_logger.debug("Starting RAG pipeline for query: %.100s", query)
+        plan = plan or Degradation(retrieve_k=settings.RETRIEVE_K, max_output_tokens=settings.MAX_OUTPUT_TOKENS)
+        request_deadline = current_deadline()
         
-        # 0. 工具调用检查 (简单关键词触发，实际应由 LLM 决定)
+        # 0. 工具调用检查，与检索并发执行 (等待时间不超过请求剩余时间)
+        deadline = time.monotonic() + remaining_time(settings.TOOL_TIMEOUT)
+        tool_calls = self._submit_tools(query)
+
+        # 1. 检索 (使用原始问题，不等待工具结果)
+        if request_deadline:
+            request_deadline.check("retrieve")
+        with stage_timer("retrieve"):
+            retrieved_docs = self.retriever.retrieve(query, k=plan.retrieve_k, filters=filters)
+
+        query = self._with_tool_results(query, tool_calls, deadline)
+        
+        # 2. 重排序 (剩余时间不足以完成重排与生成时跳过，直接取融合排序的前 N 个)
+        if request_deadline and request_deadline.remaining() < settings.DEGRADE_MIN_GENERATE_SECONDS:
+            plan.skip_rerank("rerank_skipped")
+        with stage_timer("rerank"):
+            if plan.rerank_candidates == 0:
+                reranked = [(doc, 0.0) for doc in retrieved_docs[:settings.RERANK_TOPN]]
+            else:
+                candidates = retrieved_docs[:plan.rerank_candidates] if plan.rerank_candidates else retrieved_docs
+                reranked = reranker.rerank_with_scores(query, candidates, top_n=settings.RERANK_TOPN)
+        observe_candidates("rerank", len(reranked))
+
+        record_degradation(plan)
+        if request_deadline:
+            request_deadline.check("generate")
+        result = self._answer(query, retrieved_docs, reranked, filters, max_output_tokens=plan.max_output_tokens)
+        result["degraded"] = list(plan.applied)
+        return result
+
+    def run_batch(self, queries: List[str],
+                  filters: Optional[List[Optional[MetadataFilter]]] = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        批量问答：检索 (查询编码 / FAISS / BM25) 与重排在整批问题上合并执行，生成阶段按
+        BATCH_GENERATE_CONCURRENCY 并发 (仅 OpenAI 兼容接口；本地模型逐条生成)。
+        按完成顺序产出 (下标, 结果)，单个问题失败时结果为 {"error": ...}
+        """
+        filters = filters or [None] * len(queries)
+        deadline = time.monotonic() + settings.TOOL_TIMEOUT
+        tool_calls = [self._submit_tools(q) for q in queries]
+
+        with stage_timer("batch_retrieve", queries=len(queries)):
+            retrieved = self.retriever.retrieve_batch(queries, k=settings.RETRIEVE_K, filters=filters)
+
+        queries = [self._with_tool_results(q, calls, deadline) for q, calls in zip(queries, tool_calls)]
+
+        with stage_timer("batch_rerank", queries=len(queries)):
+            reranked = reranker.rerank_batch(queries, retrieved, top_n=settings.RERANK_TOPN)
+        for r in reranked:
+            observe_candidates("rerank", len(r))
+
+        def answer(i: int) -> Dict[str, Any]:
+            try:
+                result = self._answer(queries[i], retrieved[i], reranked[i], filters[i])
+                BATCH_QUESTIONS.labels("ok").inc()
+                return result
+            except Exception as e:
+                logger.exception("Batch question %d failed: %s", i, e)
+                BATCH_QUESTIONS.labels("error").inc()
+                return {"error": str(e)}
+
+        concurrency = settings.BATCH_GENERATE_CONCURRENCY if getattr(llm_generator, "use_openai", False) else 1
+        if concurrency <= 1:
+            for i in range(len(queries)):
+                yield i, answer(i)
+            return
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-generate") as pool:
+            futures = {pool.submit(answer, i): i for i in range(len(queries))}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    @staticmethod
+    def _submit_tools(query: str) -> List[Tuple[str, str, Any]]:
+        # 简单关键词触发，实际应由 LLM 决定
+        tool_calls = []
         if "天气" in query or "降雨" in query:
             # 简单提取城市，默认 A区
-            weather_info = weather_tool.query("Area A")
-            logger.info(f"Tool used: Weather - {weather_info}")
-            # 将工具结果拼接到 Query 中
-            query += f" (当前天气状况: {json.dumps(weather_info, ensure_ascii=False)})"
-
+            tool_calls.append(("weather", "当前天气状况", tool_executor.submit("weather", city="Area A")))
         if "计算" in query and "安全系数" in query:
             # 模拟参数提取
-            calc_res = engineering_tool.stability_factor(c=20, phi=30, gamma=18, h=10, beta=45)
-            logger.info(f"Tool used: Engineering - {calc_res}")
-            query += f" (计算参考: {json.dumps(calc_res, ensure_ascii=False)})"
+            tool_calls.append(("engineering", "计算参考", tool_executor.submit(
+                "engineering", c=20, phi=30, gamma=18, h=10, beta=45)))
+        if "敏感性" in query and "安全系数" in query:
+            # 围绕默认参数扫描内摩擦角、坡角与孔隙水压力
+            grid = {"c": 20, "gamma": 18, "h": 10, "phi": {"start": 20, "stop": 40, "num": 21},
+                    "beta": {"start": 30, "stop": 60, "num": 31}, "u": {"start": 0, "stop": 50, "num": 11}}
+            tool_calls.append(("engineering_sweep", "敏感性分析", tool_executor.submit("engineering_sweep", grid=grid)))
+        return tool_calls
+
+    @staticmethod
+    def _with_tool_results(query: str, tool_calls: List[Tuple[str, str, Any]], deadline: float) -> str:
+        # 将工具结果拼接到 Query 中，供重排与 Prompt 使用；超时的工具直接跳过
+        for name, label, future in tool_calls:
+            result = tool_executor.result(future, name, deadline)
+            logger.debug("Tool used: %s - %s", name, result)
+            if result.get("error") == "timeout":
+                continue
+            query += f" ({label}: {json.dumps(result, ensure_ascii=False)})"
+        return query
+
+    def _answer(self, query: str, retrieved_docs: List[DocumentChunk], reranked: List[Tuple[DocumentChunk, float]],
+                filters: Optional[MetadataFilter], max_output_tokens: Optional[int] = None) -> Dict[str, Any]:
+        reranked_docs = [doc for doc, _ in reranked]
 
-        # 1. 检索
-        retrieved_docs = self.retriever.retrieve(query, k=settings.RETRIEVE_K)
-        
-        # 2. 重排序
-        reranked_docs = reranker.rerank(query, retrieved_docs, top_n=settings.RERANK_TOPN)
-        
         # 3. 构建 Prompt
-        prompt = prompt_builder.build_prompt(query, reranked_docs)
+        with stage_timer("prompt"):
+            prompt = prompt_builder.build_prompt(query, reranked_docs)
         
         # 4. LLM 生成
-        raw_response = llm_generator.generate(prompt)
+        with stage_timer("generate"):
+            raw_response = llm_generator.generate(prompt, schema=RESPONSE_SCHEMA, max_new_tokens=max_output_tokens)
         
-        # 5. 解析 JSON
-        try:
-            # 尝试提取 JSON 部分
-            json_match = re.search(r'\{.*\}', raw_response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                response_json = json.loads(json_str)
-            else:
-                # Fallback if no JSON found
-                response_json = {
-                    "risk_level": "unknown", 
-                    "rationale": raw_response, 
-                    "citations": [], 
-                    "recommendations": []
-                }
-        except json.JSONDecodeError:
-             response_json = {
-                "risk_level": "unknown", 
-                "rationale": raw_response, 
-                "citations": [], 
-                "recommendations": []
-            }
+        # 5. 解析 JSON (生成时已约束为单个对象，这里只做增量扫描 + json.loads)
+        with stage_timer("parse"):
+            response_json = parse_json_object(raw_response)
 
         # 6. 引用校验
-        final_response = validate_citations(response_json, reranked_docs)
+        with stage_timer("citations"):
+            final_response = validate_citations(response_json, reranked_docs)
         
         # 添加证据摘要用于前端展示
         final_response["evidence"] = [
@@ -76,6 +161,12 @@ class RAGPipeline:
             for d in reranked_docs
         ]
         
+        # 每个请求一条结构化记录 (含各阶段耗时)，由检索日志采样/限流
+        trace = current_trace()
+        log_retrieval_metrics(
+            query, len(retrieved_docs), len(reranked_docs), [float(s) for _, s in reranked],
+            stage_timings=trace.stage_timings() if trace else None, filtered=filters is not None
+        )
         return final_response
 
 rag_pipeline = RAGPipeline()
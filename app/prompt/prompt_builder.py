@@ -9,7 +9,7 @@ class PromptBuilder:
 1. 仅根据提供的上下文回答，不要编造信息。
 2. 如果上下文不足以回答问题，请明确说明。
 3. 输出必须是合法的 JSON 格式，包含 risk_level, rationale, citations, recommendations 字段。
-4. citations 中的 doc_id 和 page 必须严格来自上下文。
+4. citations 中的 doc_id 和 page 必须严格来自上下文，quote 为可选的原文摘录，必须逐字取自对应证据。
 """
 
     def build_prompt(self, query: str, context_docs: List[DocumentChunk]) -> str:
@@ -30,7 +30,7 @@ Question: {query}
 {{
     "risk_level": "low|medium|high",
     "rationale": "分析理由...",
-    "citations": [{{"doc_id": "...", "page": 1}}],
+    "citations": [{{"doc_id": "...", "page": 1, "quote": "..."}}],
     "recommendations": ["建议1", "建议2"]
 }}
 """
@@ -0,0 +1,112 @@
+import os
+import signal
+import threading
+import time
+from typing import Any, Dict, Optional
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.registry import components
+from app.index import snapshots
+
+# 索引热加载：新快照在后台线程中加载并完成预热，然后在组件注册表中原子替换 retriever。
+# 已经取得旧 retriever 的请求继续在旧索引上完成，旧实例在 SNAPSHOT_GRACE_SECONDS 后关闭。
+# 触发方式：SIGHUP、POST /admin/reload、每 SNAPSHOT_WATCH_INTERVAL 秒检查 INDEX_DIR/CURRENT。
+
+
+class IndexReloader:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._failed_version: Optional[str] = None
+
+    @staticmethod
+    def loaded_version() -> Optional[str]:
+        """
+        当前 retriever 所加载快照的版本 (未加载或旧布局时为 None)
+        """
+        if not components.is_loaded("retriever"):
+            return None
+        index_dir = os.path.normpath(components.get("retriever").index_dir)
+        if os.path.dirname(index_dir) != os.path.normpath(snapshots.snapshots_root()):
+            return None
+        return os.path.basename(index_dir)
+
+    def reload(self, version: str = None, force: bool = False) -> Dict[str, Any]:
+        """
+        加载 version (默认为 CURRENT 指向的版本) 并切换；校验失败抛出 ValueError，旧索引继续服务
+        """
+        from app.search.retrieve import create_retriever
+
+        with self._lock:
+            target = version or snapshots.current_version()
+            if target is None:
+                return {"reloaded": False, "version": None, "reason": "no snapshot published"}
+            # 只加载已构建的快照：先校验版本名，再确认它在 snapshots/ 中
+            snapshots.check_version(target)
+            if target not in snapshots.list_versions():
+                raise ValueError(f"Unknown snapshot version: {target!r}")
+            previous = self.loaded_version()
+            if target == previous and not force:
+                return {"reloaded": False, "version": target, "reason": "already loaded"}
+
+            start = time.perf_counter()
+            path = snapshots.snapshot_path(target)
+            manifest = snapshots.verify_snapshot(path, checksums=settings.SNAPSHOT_VERIFY_CHECKSUMS)
+            retriever = create_retriever(index_dir=path)
+            retriever.prepare_filters()
+            old = components.get("retriever") if components.is_loaded("retriever") else None
+            components.override("retriever", retriever)
+            if old is not None and hasattr(old, "close"):
+                timer = threading.Timer(settings.SNAPSHOT_GRACE_SECONDS, old.close)
+                timer.daemon = True
+                timer.start()
+
+            seconds = time.perf_counter() - start
+            logger.info("Swapped index snapshot %s -> %s in %.1fs", previous, target, seconds,
+                        extra={"event": "snapshot_reload", "previous": previous, "version": target,
+                               "chunks": manifest.get("chunks"), "seconds": seconds})
+            return {"reloaded": True, "version": target, "previous": previous,
+                    "chunks": manifest.get("chunks"), "seconds": seconds}
+
+    def _reload_quietly(self):
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error("Index reload failed: %s", e)
+
+    def handle_signal(self, signum, frame):
+        # 信号处理函数中不做 IO，交给后台线程
+        threading.Thread(target=self._reload_quietly, name="index-reload", daemon=True).start()
+
+    def install_signal_handler(self):
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, self.handle_signal)
+
+    def _watch(self, interval: float):
+        while True:
+            time.sleep(interval)
+            # 读取 CURRENT 本身失败 (如瞬时 OSError) 时 target 为 None，下一轮重试，不标记失败版本
+            target = None
+            try:
+                target = snapshots.current_version()
+                # 首次加载由 warmup 完成；同一个失败的版本不重复尝试，直到 CURRENT 再次变化
+                if target is None or not components.is_loaded("retriever"):
+                    continue
+                if target in (self.loaded_version(), self._failed_version):
+                    continue
+                self.reload(target)
+                self._failed_version = None
+            except Exception as e:
+                if target is not None:
+                    self._failed_version = target
+                logger.error("Index reload of %s failed: %s", target, e)
+
+    def start_watcher(self, interval: float = None):
+        interval = settings.SNAPSHOT_WATCH_INTERVAL if interval is None else interval
+        if interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+            return
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="index-watch", daemon=True)
+        self._watcher.start()
+
+
+index_reloader = IndexReloader()
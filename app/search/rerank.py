@@ -1,8 +1,9 @@
-from typing import List
-from sentence_transformers import CrossEncoder
+from typing import Dict, List, Tuple
 from app.ingest.parser import DocumentChunk
 from app.core.config import settings
-from app.core.logging import logger
+from app.core.logging import logger, retrieval_logger
+from app.core.memory import tensor_bytes
+from app.core.registry import components
 
 class Reranker:
     _instance = None
@@ -14,14 +15,19 @@ class Reranker:
         return cls._instance
 
     def _initialize(self):
-        logger.info(f"Loading reranker model: {settings.RERANKER_MODEL_ID}")
-        self.model = CrossEncoder(
-            settings.RERANKER_MODEL_ID, 
-            device=settings.DEVICE,
-            max_length=512
-        )
+        from app.llm.optimized import load_cross_encoder
+
+        logger.info("Loading reranker model: %s (backend=%s)", settings.RERANKER_MODEL_ID, settings.INFERENCE_BACKEND)
+        self.model = load_cross_encoder(settings.RERANKER_MODEL_ID, max_length=512)
+
+    def memory_usage(self) -> Dict[str, int]:
+        # sentence-transformers 的 CrossEncoder 将 torch 模型放在 .model 上
+        return {"model_weights": tensor_bytes(getattr(self.model, "model", self.model))}
 
     def rerank(self, query: str, documents: List[DocumentChunk], top_n: int = 5) -> List[DocumentChunk]:
+        return [doc for doc, score in self.rerank_with_scores(query, documents, top_n)]
+
+    def rerank_with_scores(self, query: str, documents: List[DocumentChunk], top_n: int = 5) -> List[Tuple[DocumentChunk, float]]:
         if not documents:
             return []
             
@@ -35,9 +41,26 @@ class Reranker:
         doc_scores.sort(key=lambda x: x[1], reverse=True)
         
         # 取 Top N
-        top_docs = [doc for doc, score in doc_scores[:top_n]]
+        top_docs = [(doc, float(score)) for doc, score in doc_scores[:top_n]]
         
-        logger.info(f"Reranked {len(documents)} docs, returning top {top_n}. Top score: {doc_scores[0][1] if doc_scores else 0}")
+        retrieval_logger.debug("Reranked %d docs, returning top %d. Top score: %s", len(documents), top_n, doc_scores[0][1] if doc_scores else 0)
         return top_docs
 
-reranker = Reranker()
+    def rerank_batch(self, queries: List[str], documents: List[List[DocumentChunk]],
+                     top_n: int = 5) -> List[List[Tuple[DocumentChunk, float]]]:
+        """
+        多个问题的 (问题, 候选) 对合并为一次 predict，按批次填满交叉编码器，再按问题拆分取 Top N
+        """
+        pairs = [[query, doc.text] for query, docs in zip(queries, documents) for doc in docs]
+        if not pairs:
+            return [[] for _ in queries]
+        scores = self.model.predict(pairs, batch_size=settings.BATCH_RERANK_SIZE)
+        results, offset = [], 0
+        for docs in documents:
+            doc_scores = sorted(zip(docs, scores[offset:offset + len(docs)]), key=lambda x: x[1], reverse=True)
+            results.append([(doc, float(score)) for doc, score in doc_scores[:top_n]])
+            offset += len(docs)
+        retrieval_logger.debug("Batch reranked %d pairs for %d queries", len(pairs), len(queries))
+        return results
+
+reranker = components.lazy("reranker", Reranker)
@@ -1,35 +1,134 @@
-from typing import List, Tuple
+import sys
+from typing import Dict, List, Optional, Tuple
 from app.index.faiss_index import FAISSIndex
 from app.index.bm25 import BM25Index
+from app.index.filters import MetadataFilter, MetadataIndex
+from app.ingest.dedup import NearDuplicateIndex, DedupStats
 from app.ingest.parser import DocumentChunk
 from app.core.config import settings
-from app.core.logging import logger
+from app.core.logging import retrieval_logger
+from app.core.metrics import stage_timer, observe_candidates
 
 class HybridRetriever:
-    def __init__(self):
+    def __init__(self, index_dir: str = None):
+        self.index_dir = index_dir or settings.INDEX_DIR
         self.vector_index = FAISSIndex()
         self.bm25_index = BM25Index()
+        # 元数据 id 集合索引，行号与两路本地索引的文档顺序一致
+        self.metadata_index = MetadataIndex()
+        self.dedup_index = NearDuplicateIndex()
         
         # 尝试加载已有索引
-        self.vector_index.load(settings.INDEX_DIR)
-        self.bm25_index.load(settings.INDEX_DIR)
+        self.vector_index.load(self.index_dir)
+        self.bm25_index.load(self.index_dir)
+        self.dedup_index.load(self.index_dir)
 
-    def index_documents(self, documents: List[DocumentChunk]):
-        self.vector_index.add_documents(documents)
+    def index_documents(self, documents: List[DocumentChunk], save: bool = True) -> DedupStats:
+        """
+        近重复 chunk 在向量化之前合并/丢弃，返回去重统计；
+        save=False 时只写入内存中的索引 (分批导入的中间批次)，由调用方最后调用 save()
+        """
+        pending = None
+        if settings.DEDUP_ENABLED:
+            documents, stats, pending = self.dedup_index.deduplicate(documents)
+        else:
+            stats = DedupStats(total=len(documents), kept=len(documents))
+        # 向量化按长度分批乱序写入 FAISS，BM25 按 FAISS 的行号顺序写入
+        documents = self.vector_index.add_documents(documents)
         self.bm25_index.add_documents(documents)
-        
-        self.vector_index.save(settings.INDEX_DIR)
-        self.bm25_index.save(settings.INDEX_DIR)
+        # 两路索引都写入成功后才登记去重签名
+        if pending is not None:
+            self.dedup_index.commit(pending)
+        if save:
+            self.save()
+        return stats
+
+    def save(self):
+        # 两个索引共用同一份 chunk 存储，由 FAISS 写入
+        self.vector_index.save(self.index_dir)
+        self.bm25_index.save(self.index_dir, write_documents=not self.vector_index.documents)
+        if settings.DEDUP_ENABLED:
+            self.dedup_index.save(self.index_dir)
 
-    def retrieve(self, query: str, k: int = 50) -> List[DocumentChunk]:
+    def prepare_filters(self):
         """
-        混合检索：向量检索 + BM25，使用 RRF 或 加权融合
+        预先构建元数据索引 (多 worker 下在 fork 前调用以共享)
         """
+        self.metadata_index.sync(self.vector_index.documents)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        各索引的内存估算；两路索引共用同一份 chunk 对象 (或同一个 chunk 存储文件) 时只计一次
+        """
+        usage = self.vector_index.memory_usage()
+        for name, size in self.bm25_index.memory_usage().items():
+            usage[f"bm25_{name}"] = size
+        if _same_chunks(self.vector_index.documents, self.bm25_index.documents):
+            usage["bm25_chunk_text"] = sys.getsizeof(self.bm25_index.documents)
+        usage["metadata_index"] = self.metadata_index.nbytes()
+        usage["dedup_signatures"] = self.dedup_index.nbytes()
+        return usage
+
+    def retrieve(self, query: str, k: int = 50, filters: Optional[MetadataFilter] = None) -> List[DocumentChunk]:
+        """
+        混合检索：向量检索 + BM25，使用 RRF 或 加权融合。
+        filters 在两路检索内部生效 (FAISS id selector / BM25 打分 / ES filter)，返回的候选均满足条件
+        """
+        allowed = None
+        if filters is not None:
+            with stage_timer("filter"):
+                allowed = self.metadata_index.mask(filters, self.vector_index.documents)
+            observe_candidates("filter", int(allowed.sum()))
+
         # 1. 获取结果
-        vector_results = self.vector_index.search(query, k=k)
-        bm25_results = self.bm25_index.search(query, k=k)
+        vector_results = self.vector_index.search(query, k=k, filters=filters, allowed=allowed)
+        bm25_results = self.bm25_index.search(query, k=k, filters=filters, allowed=allowed)
+        observe_candidates("vector", len(vector_results))
+        observe_candidates("bm25", len(bm25_results))
+        
+        # 2. 融合
+        with stage_timer("fusion"):
+            final_docs = self.fuse(vector_results, bm25_results, k=k)
+        observe_candidates("fusion", len(final_docs))
         
-        # 2. 归一化分数 (Min-Max Normalization)
+        retrieval_logger.debug("Hybrid retrieval returned %d docs for query: %.100s", len(final_docs), query)
+        return final_docs
+
+    def retrieve_batch(self, queries: List[str], k: int = 50,
+                       filters: Optional[List[Optional[MetadataFilter]]] = None) -> List[List[DocumentChunk]]:
+        """
+        批量混合检索：查询向量一次编码、FAISS 多查询检索、BM25 分数矩阵一次计算，
+        结果与逐条调用 retrieve 一致。filters 与 queries 一一对应
+        """
+        filters = filters or [None] * len(queries)
+        allowed = [None] * len(queries)
+        if any(f is not None for f in filters):
+            with stage_timer("filter"):
+                for i, f in enumerate(filters):
+                    if f is not None:
+                        allowed[i] = self.metadata_index.mask(f, self.vector_index.documents)
+
+        vector_results = self.vector_index.search_batch(queries, k=k, filters=filters, allowed=allowed)
+        bm25_results = self.bm25_index.search_batch(queries, k=k, filters=filters, allowed=allowed)
+
+        final_docs = []
+        with stage_timer("fusion"):
+            for vec, bm25 in zip(vector_results, bm25_results):
+                observe_candidates("vector", len(vec))
+                observe_candidates("bm25", len(bm25))
+                final_docs.append(self.fuse(vec, bm25, k=k))
+                observe_candidates("fusion", len(final_docs[-1]))
+        retrieval_logger.debug("Hybrid batch retrieval for %d queries", len(queries))
+        return final_docs
+
+    @staticmethod
+    def fuse(vector_results: List[Tuple[DocumentChunk, float]], 
+             bm25_results: List[Tuple[DocumentChunk, float]], 
+             k: int = 50) -> List[DocumentChunk]:
+        """
+        归一化两路分数并加权融合，返回 Top K
+        """
+        # 1. 归一化分数 (Min-Max Normalization)
         def normalize(results):
             if not results:
                 return {}
@@ -42,7 +141,7 @@ class HybridRetriever:
         vec_norm = normalize(vector_results)
         bm25_norm = normalize(bm25_results)
         
-        # 3. 融合 (加权求和: 0.7 Vector + 0.3 BM25)
+        # 2. 融合 (加权求和: 0.7 Vector + 0.3 BM25)
         combined_scores = {}
         doc_map = {} # text -> DocumentChunk
         
@@ -54,9 +153,29 @@ class HybridRetriever:
             doc_map[doc.text] = doc
             combined_scores[doc.text] = combined_scores.get(doc.text, 0) + 0.3 * bm25_norm.get(doc.text, 0)
             
-        # 4. 排序并返回 Top K
+        # 3. 排序并返回 Top K
         sorted_docs = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)
-        final_docs = [doc_map[text] for text, score in sorted_docs[:k]]
-        
-        logger.info(f"Hybrid retrieval returned {len(final_docs)} docs for query: {query}")
-        return final_docs
+        return [doc_map[text] for text, score in sorted_docs[:k]]
+
+
+def _same_chunks(a, b) -> bool:
+    if a is b:
+        return True
+    if getattr(a, "path", None) is not None:
+        return getattr(b, "path", None) == a.path
+    # 导入后两个 list 引用同一批 chunk 对象；分别反序列化的 list 各占一份
+    return isinstance(a, list) and isinstance(b, list) and len(a) == len(b) > 0 and a[0] is b[0] and a[-1] is b[-1]
+
+
+def create_retriever(index_dir: str = None):
+    """
+    SHARDS > 1 时使用分片协调器，否则为单进程混合检索；默认加载当前生效的索引快照
+    """
+    from app.index.snapshots import resolve_index_dir
+
+    index_dir = index_dir or resolve_index_dir()
+    if settings.SHARDS > 1:
+        from app.search.sharded import ShardedRetriever
+
+        return ShardedRetriever(index_dir)
+    return HybridRetriever(index_dir)
@@ -0,0 +1,495 @@
+"""
+分片检索 (SHARDS > 1)
+
+chunk 按 SHARD_KEY 划分到 N 个分片：doc 按 doc_id 哈希 (同一文档的 chunk 在同一分片)，hash 按文本哈希。
+每个分片进程持有自己的 FAISS + 本地 BM25 + 元数据索引 (目录 INDEX_DIR/shard_{i})，
+通过 multiprocessing.connection 提供简单的 RPC (authkey 认证；消息为 JSON + float32 原始字节，不使用 pickle)。
+协调进程只负责查询编码与分词、并发下发、合并各分片 top-k、融合；近重复检测也在协调进程中全局进行。
+各分片的 BM25 使用分片内的 IDF (与 Elasticsearch 默认的 query_then_fetch 一致)。
+
+SHARD_ADDRESSES 为空时在本机以子进程启动分片 (unix socket，每个协调进程随机生成 authkey)；
+跨节点部署时在各节点以相同的 SHARD_AUTHKEY 启动分片并填写 host:port 列表 (未设置密钥时拒绝启动):
+    SHARD_AUTHKEY=<随机密钥> python -m app.search.sharded --shard 0 --listen 0.0.0.0:7100 --index-dir data/index/shard_0
+"""
+import argparse
+import dataclasses
+import json
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.index.filters import MetadataFilter
+from app.ingest.dedup import NearDuplicateIndex, DedupStats
+from app.ingest.embedder import document_embedder
+from app.ingest.parser import DocumentChunk
+from app.core.admission import remaining_time
+from app.core.config import settings
+from app.core.logging import logger, retrieval_logger
+from app.core.memory import current_rss
+from app.core.metrics import stage_timer, observe_candidates
+
+SHARD_KEYS = ("doc", "hash")
+
+
+def shard_of(doc: DocumentChunk, num_shards: int, key: str = None) -> int:
+    key = key or settings.SHARD_KEY
+    value = doc.doc_id if key == "doc" else doc.text
+    return zlib.crc32(value.encode("utf-8")) % num_shards
+
+
+def parse_address(address: str):
+    """
+    host:port 为 TCP 地址，其余视为 unix socket 路径
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host, int(port)
+    return address
+
+
+def shard_dir(index_dir: str, shard: int) -> str:
+    return os.path.join(index_dir, f"shard_{shard}")
+
+
+MIN_AUTHKEY_LENGTH = 16
+
+
+def shard_authkey() -> bytes:
+    """
+    跨节点分片的共享密钥：必须显式配置，公开的默认值等于没有认证
+    """
+    key = settings.SHARD_AUTHKEY or ""
+    if len(key) < MIN_AUTHKEY_LENGTH:
+        raise ValueError(f"SHARD_AUTHKEY must be set to a secret of at least {MIN_AUTHKEY_LENGTH} characters "
+                         "for shards reachable over the network")
+    return key.encode("utf-8")
+
+
+# RPC 消息：4 字节头长度 (小端) + JSON 头 + 头中 "arrays" 描述的若干 float32 数组的原始字节。
+# 对端即使通过了认证也只能发送数据，不会在反序列化时执行代码；chunk 只接受 DocumentChunk 的字段，
+# 过滤条件以表达式传输并在分片端重新校验。
+_CHUNK_FIELDS = tuple(f.name for f in dataclasses.fields(DocumentChunk))
+
+
+def pack_message(header: Dict[str, Any], arrays: Sequence[np.ndarray] = ()) -> bytes:
+    arrays = [np.ascontiguousarray(a, dtype=np.float32) for a in arrays]
+    head = json.dumps({**header, "arrays": [list(a.shape) for a in arrays]}, ensure_ascii=False,
+                      default=_json_default).encode("utf-8")
+    return b"".join([struct.pack("<I", len(head)), head] + [a.tobytes() for a in arrays])
+
+
+def unpack_message(data: bytes) -> Tuple[Dict[str, Any], List[np.ndarray]]:
+    if len(data) < 4:
+        raise ValueError("Truncated shard message")
+    (head_len,) = struct.unpack_from("<I", data)
+    header = json.loads(data[4:4 + head_len].decode("utf-8"))
+    if not isinstance(header, dict):
+        raise ValueError("Shard message header must be a JSON object")
+    offset, arrays = 4 + head_len, []
+    for shape in header.pop("arrays", []):
+        if not isinstance(shape, list) or not all(isinstance(n, int) and n >= 0 for n in shape):
+            raise ValueError(f"Invalid array shape: {shape}")
+        count = int(np.prod(shape, dtype=np.int64))
+        arrays.append(np.frombuffer(data, dtype=np.float32, count=count, offset=offset).reshape(shape))
+        offset += count * 4
+    if offset != len(data):
+        raise ValueError("Shard message size does not match its header")
+    return header, arrays
+
+
+def _json_default(value: Any):
+    # chunk metadata 中可能出现 numpy 标量
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def chunk_to_json(doc: DocumentChunk) -> Dict[str, Any]:
+    return {name: getattr(doc, name) for name in _CHUNK_FIELDS}
+
+
+def chunk_from_json(data: Dict[str, Any]) -> DocumentChunk:
+    if not isinstance(data, dict):
+        raise ValueError("Chunk must be a JSON object")
+    return DocumentChunk(**{name: data[name] for name in _CHUNK_FIELDS if name in data})
+
+
+def _results_to_json(results: List[Tuple[DocumentChunk, float]]) -> List[list]:
+    return [[chunk_to_json(doc), float(score)] for doc, score in results]
+
+
+def _results_from_json(results: List[list]) -> List[Tuple[DocumentChunk, float]]:
+    return [(chunk_from_json(doc), float(score)) for doc, score in results]
+
+
+def encode_request(method: str, args: tuple) -> bytes:
+    if method == "search":
+        embedding, tokens, k, filters = args
+        return pack_message({"method": method, "tokens": list(tokens), "k": int(k),
+                             "filters": filters.to_dict() if filters is not None else None}, [embedding])
+    if method == "add":
+        embeddings, documents = args
+        return pack_message({"method": method, "documents": [chunk_to_json(d) for d in documents]},
+                            [np.asarray(embeddings, dtype=np.float32)])
+    return pack_message({"method": method})
+
+
+def decode_result(method: str, result: Any) -> Any:
+    if method == "search":
+        return _results_from_json(result["vector"]), _results_from_json(result["bm25"])
+    return result
+
+
+class ShardServer:
+    """
+    分片进程：持有一个不含去重与 ES 的 HybridRetriever，按消息调用对应方法
+    """
+    def __init__(self, shard: int, index_dir: str):
+        from app.search.retrieve import HybridRetriever
+
+        self.shard = shard
+        self.retriever = HybridRetriever(index_dir)
+        self.retriever.prepare_filters()
+        self._write_lock = threading.Lock()
+
+    def search(self, embedding: np.ndarray, tokens: List[str], k: int,
+               filters: Optional[MetadataFilter]) -> Tuple[List, List]:
+        retriever = self.retriever
+        allowed = None
+        if filters is not None:
+            allowed = retriever.metadata_index.mask(filters, retriever.vector_index.documents)
+            if not allowed.any():
+                return [], []
+        vector_results = retriever.vector_index.search(None, k, filters, allowed, query_embedding=embedding)
+        bm25_results = retriever.bm25_index.search(None, k, filters, allowed, tokens=tokens)
+        return vector_results, bm25_results
+
+    def add(self, embeddings: np.ndarray, documents: List[DocumentChunk]) -> int:
+        if not documents:
+            return self.count()
+        with self._write_lock:
+            self.retriever.vector_index.add_embeddings(embeddings, documents)
+            self.retriever.bm25_index.add_documents(documents)
+            return len(self.retriever.vector_index.documents)
+
+    def save(self) -> int:
+        with self._write_lock:
+            retriever = self.retriever
+            retriever.vector_index.save(retriever.index_dir)
+            retriever.bm25_index.save(retriever.index_dir, write_documents=not retriever.vector_index.documents)
+            retriever.prepare_filters()
+            return len(retriever.vector_index.documents)
+
+    def count(self) -> int:
+        return len(self.retriever.vector_index.documents)
+
+    def memory(self) -> Dict[str, Any]:
+        return {"shard": self.shard, "rss": current_rss(), "breakdown": self.retriever.memory_usage()}
+
+    def _dispatch(self, header: Dict[str, Any], arrays: List[np.ndarray]) -> Any:
+        method = header.get("method")
+        if method == "search":
+            if len(arrays) != 1 or not isinstance(header.get("tokens"), list):
+                raise ValueError("search expects one embedding and a token list")
+            filters = MetadataFilter.parse(header.get("filters"))
+            vector_results, bm25_results = self.search(arrays[0], [str(t) for t in header["tokens"]],
+                                                       int(header["k"]), filters)
+            return {"vector": _results_to_json(vector_results), "bm25": _results_to_json(bm25_results)}
+        if method == "add":
+            documents = [chunk_from_json(d) for d in header.get("documents") or []]
+            if len(arrays) != 1 or arrays[0].ndim != 2 or len(arrays[0]) != len(documents):
+                raise ValueError("add expects one embedding row per document")
+            return self.add(arrays[0], documents)
+        if method in ("save", "count", "memory"):
+            return getattr(self, method)()
+        raise ValueError(f"Unknown shard method: {method!r}")
+
+    def _handle(self, conn, authkey: bytes):
+        with conn:
+            # 认证在各自的连接线程中进行：探测、断开或错误的 authkey 只结束该连接，不影响 accept 循环
+            try:
+                deliver_challenge(conn, authkey)
+                answer_challenge(conn, authkey)
+            except (EOFError, OSError, AuthenticationError) as e:
+                logger.warning("Shard %d rejected connection: %s", self.shard, e)
+                return
+            while True:
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError, OSError):
+                    return
+                method = None
+                try:
+                    header, arrays = unpack_message(data)
+                    method = header.get("method")
+                    reply = {"status": "ok", "result": self._dispatch(header, arrays)}
+                except Exception as e:
+                    logger.exception("Shard %d failed on %s", self.shard, method)
+                    reply = {"status": "error", "result": f"{type(e).__name__}: {e}"}
+                conn.send_bytes(pack_message(reply))
+
+    def serve(self, address: str, authkey: bytes):
+        with Listener(parse_address(address)) as listener:
+            logger.info("Shard %d serving %d chunks on %s", self.shard, self.count(), address)
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    logger.warning("Shard %d accept failed: %s", self.shard, e)
+                    continue
+                threading.Thread(target=self._handle, args=(conn, authkey), daemon=True).start()
+
+
+def run_shard(shard: int, index_dir: str, address: str, authkey: bytes):
+    # 分片只做本地检索：BM25 不走 ES，查询向量由协调进程计算，分片不加载模型
+    settings.ELASTICSEARCH_URL = None
+    ShardServer(shard, index_dir).serve(address, authkey)
+
+
+class ShardClient:
+    """
+    单个分片的 RPC 客户端，连接按线程复用 (连接池)，fork 后重建
+    """
+    def __init__(self, address: str, authkey: bytes, timeout: float = None):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout or settings.SHARD_TIMEOUT
+        self._pool: "queue.Queue" = queue.Queue()
+        self._pid = os.getpid()
+
+    def _connect(self):
+        if self._pid != os.getpid():
+            self._pool, self._pid = queue.Queue(), os.getpid()
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return Client(parse_address(self.address), authkey=self.authkey)
+
+    def call(self, method: str, *args, blocking: bool = False, timeout: float = None) -> Any:
+        """
+        检索受 SHARD_TIMEOUT (或调用方给出的更短 timeout) 约束；写入 (blocking=True) 一直等待分片完成
+        """
+        conn = self._connect()
+        try:
+            conn.send_bytes(encode_request(method, args))
+            if not blocking and not conn.poll(self.timeout if timeout is None else timeout):
+                raise TimeoutError(f"Shard {self.address} did not answer {method} in time")
+            reply, _ = unpack_message(conn.recv_bytes())
+        except BaseException:
+            # 超时或断开的连接可能残留未读响应，直接丢弃
+            conn.close()
+            raise
+        self._pool.put(conn)
+        if reply.get("status") != "ok":
+            raise RuntimeError(f"Shard {self.address} {method} failed: {reply.get('result')}")
+        return decode_result(method, reply["result"])
+
+    def wait_ready(self, deadline: float):
+        while True:
+            try:
+                return self.call("count")
+            except (OSError, EOFError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+
+def start_local_shards(num_shards: int, index_dir: str, authkey: bytes) -> Tuple[List[str], List[Any]]:
+    """
+    以 spawn 子进程在本机启动分片 (unix socket)，进程随协调进程退出；返回 (地址, 进程)
+    """
+    import multiprocessing
+
+    ctx = multiprocessing.get_context("spawn")
+    socket_dir = tempfile.mkdtemp(prefix="slope_shards_")
+    addresses, processes = [], []
+    for shard in range(num_shards):
+        address = os.path.join(socket_dir, f"shard_{shard}.sock")
+        process = ctx.Process(target=run_shard, args=(shard, shard_dir(index_dir, shard), address, authkey),
+                              name=f"shard-{shard}", daemon=True)
+        process.start()
+        addresses.append(address)
+        processes.append(process)
+    return addresses, processes
+
+
+class ShardedRetriever:
+    """
+    分片协调器，对外接口与 HybridRetriever 一致 (retrieve / index_documents / prepare_filters)
+    """
+    def __init__(self, index_dir: str = None, addresses: List[str] = None):
+        if settings.SHARD_KEY not in SHARD_KEYS:
+            raise ValueError(f"Unknown SHARD_KEY: {settings.SHARD_KEY}, expected one of {SHARD_KEYS}")
+        self.index_dir = index_dir or settings.INDEX_DIR
+        self._processes = []
+        self._owner_pid = os.getpid()
+        if addresses is None:
+            addresses = [a.strip() for a in settings.SHARD_ADDRESSES.split(",") if a.strip()]
+        if addresses:
+            authkey = shard_authkey()
+        else:
+            # 本机分片子进程使用本协调进程随机生成的密钥，经 spawn 参数传递
+            authkey = os.urandom(32)
+            addresses, self._processes = start_local_shards(settings.SHARDS, self.index_dir, authkey)
+        self.shards = [ShardClient(address, authkey) for address in addresses]
+        deadline = time.monotonic() + settings.SHARD_START_TIMEOUT
+        counts = [shard.wait_ready(deadline) for shard in self.shards]
+        logger.info("Connected to %d shards (%s chunks)", len(self.shards), counts)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_pid = None
+        self.dedup_index = NearDuplicateIndex()
+        self.dedup_index.load(self.index_dir)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # 线程池不能跨 fork 使用，多 worker 下每个进程各自创建
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    def _scatter(self, method: str, args_per_shard: List[tuple]) -> List[Any]:
+        futures = [self._executor().submit(shard.call, method, *args, blocking=True)
+                   for shard, args in zip(self.shards, args_per_shard)]
+        return [f.result() for f in futures]
+
+    def index_documents(self, documents: List[DocumentChunk], save: bool = True) -> DedupStats:
+        """
+        全局去重后在协调进程中向量化，按分片键路由并分批写入各分片；save=False 时各分片暂不落盘
+        """
+        pending = None
+        if settings.DEDUP_ENABLED:
+            documents, stats, pending = self.dedup_index.deduplicate(documents)
+        else:
+            stats = DedupStats(total=len(documents), kept=len(documents))
+        owners = np.array([shard_of(doc, len(self.shards)) for doc in documents], dtype=np.int64)
+
+        def sink(rows: np.ndarray, embeddings: np.ndarray):
+            args = []
+            for shard in range(len(self.shards)):
+                mine = np.flatnonzero(owners[rows] == shard)
+                args.append((embeddings[mine], [documents[rows[i]] for i in mine]))
+            self._scatter("add", args)
+
+        if documents:
+            # 第一批为随机样本，各分片首次写入时用其训练量化器
+            train_sample = settings.VECTOR_TRAIN_SAMPLE if settings.VECTOR_CODEC != "flat" else 0
+            document_embedder.embed_to(sink, [doc.text for doc in documents], train_sample=train_sample)
+        # 各分片写入成功后才登记去重签名
+        if pending is not None:
+            self.dedup_index.commit(pending)
+        if save:
+            self.save()
+        return stats
+
+    def save(self):
+        counts = self._scatter("save", [()] * len(self.shards))
+        if settings.DEDUP_ENABLED:
+            self.dedup_index.save(self.index_dir)
+        logger.info("Sharded ingest complete, chunks per shard: %s", counts)
+
+    def prepare_filters(self):
+        # 元数据索引由各分片自行维护
+        pass
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        协调进程只持有去重签名，各分片进程的内存见 shard_memory()
+        """
+        return {"dedup_signatures": self.dedup_index.nbytes()}
+
+    def shard_memory(self) -> List[Dict[str, Any]]:
+        return self._scatter("memory", [()] * len(self.shards))
+
+    def close(self):
+        """
+        停止本机启动的分片进程 (索引热加载替换后调用)
+        """
+        if os.getpid() != self._owner_pid:
+            # fork 出的 worker 不拥有分片进程
+            return
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=5)
+
+    def retrieve(self, query: str, k: int = 50, filters: Optional[MetadataFilter] = None) -> List[DocumentChunk]:
+        from app.llm.embedding import embedding_model
+
+        with stage_timer("embed"):
+            embedding = embedding_model.embed_query(query)
+        return self._retrieve(query, embedding, k, filters)
+
+    def retrieve_batch(self, queries: List[str], k: int = 50,
+                       filters: Optional[List[Optional[MetadataFilter]]] = None) -> List[List[DocumentChunk]]:
+        """
+        查询向量在协调进程中一次批量编码，各查询仍逐条分发到分片
+        """
+        from app.llm.embedding import embedding_model
+
+        filters = filters or [None] * len(queries)
+        with stage_timer("embed"):
+            embeddings = embedding_model.embed_queries(queries, batch_size=settings.EMBED_BATCH_SIZE)
+        return [self._retrieve(q, e, k, f) for q, e, f in zip(queries, embeddings, filters)]
+
+    def _retrieve(self, query: str, embedding: np.ndarray, k: int,
+                  filters: Optional[MetadataFilter]) -> List[DocumentChunk]:
+        from app.index.tokenizer import tokenizer
+        from app.search.retrieve import HybridRetriever
+
+        tokens = tokenizer.tokenize_query(query)
+        # 分片超时不超过当前请求的剩余时间
+        timeout = remaining_time(settings.SHARD_TIMEOUT)
+
+        with stage_timer("scatter"):
+            futures = [self._executor().submit(shard.call, "search", embedding, tokens, k, filters, timeout=timeout)
+                       for shard in self.shards]
+            vector_results, bm25_results = [], []
+            for shard, future in zip(self.shards, futures):
+                try:
+                    vec, bm25 = future.result()
+                except Exception as e:
+                    # 单个分片故障时返回其余分片的结果
+                    logger.warning("Shard %s search failed: %s", shard.address, e)
+                    continue
+                vector_results.extend(vec)
+                bm25_results.extend(bm25)
+
+        # 合并各分片 top-k 为全局 top-k
+        vector_results = sorted(vector_results, key=lambda r: r[1], reverse=True)[:k]
+        bm25_results = sorted(bm25_results, key=lambda r: r[1], reverse=True)[:k]
+        observe_candidates("vector", len(vector_results))
+        observe_candidates("bm25", len(bm25_results))
+
+        with stage_timer("fusion"):
+            final_docs = HybridRetriever.fuse(vector_results, bm25_results, k=k)
+        observe_candidates("fusion", len(final_docs))
+        retrieval_logger.debug("Sharded retrieval returned %d docs from %d shards for query: %.100s",
+                               len(final_docs), len(self.shards), query)
+        return final_docs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slope RAG retrieval shard")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--listen", required=True, help="host:port 或 unix socket 路径")
+    parser.add_argument("--index-dir", default=None, help="默认 INDEX_DIR/shard_{i}")
+    args = parser.parse_args()
+    try:
+        authkey = shard_authkey()
+    except ValueError as e:
+        parser.error(str(e))
+    run_shard(args.shard, args.index_dir or shard_dir(settings.INDEX_DIR, args.shard), args.listen, authkey)
+
+
+if __name__ == "__main__":
+    main()
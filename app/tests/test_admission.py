@@ -0,0 +1,59 @@
+import threading
+import pytest
+from app.core.admission import AdmissionController, Deadline, Overloaded, deadline_scope, degradation_plan
+from app.core.config import settings
+
+
+def test_admission_rejects_when_queue_full_and_on_queue_timeout():
+    controller = AdmissionController(max_inflight=1, max_queue=1)
+    running = controller.admit()
+    assert running.start(Deadline(1.0)) == 0.0
+    waiting = controller.admit()
+    with pytest.raises(Overloaded):
+        controller.admit()
+    with pytest.raises(Overloaded):
+        waiting.start(Deadline(0.05))
+    waiting.close()
+
+    # 执行槽位释放后排队的请求开始执行
+    queued = controller.admit()
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (queued.start(Deadline(5.0)), started.set()))
+    thread.start()
+    running.close()
+    thread.join(5)
+    assert started.is_set() and controller.status()["running"] == 1
+    queued.close()
+    running.close()
+    assert controller.status() == {"running": 0, "waiting": 0, "max_inflight": 1, "max_queue": 1}
+
+
+def test_degradation_plan_and_pipeline_report(monkeypatch):
+    from app.eval.stand_ins import install_stand_ins
+    from app.core.registry import components
+    from app.ingest.parser import DocumentChunk
+    from app.pipeline.rag_pipeline import rag_pipeline
+
+    assert degradation_plan(0.0, 30.0).applied == []
+    assert degradation_plan(settings.DEGRADE_LIGHT_RATIO, 30.0).applied == [
+        "retrieve_k", "rerank_truncated", "max_output_tokens"]
+    heavy = degradation_plan(0.0, settings.DEGRADE_MIN_GENERATE_SECONDS / 2)
+    assert heavy.level == 2 and heavy.rerank_candidates == 0 and "rerank_skipped" in heavy.applied
+
+    install_stand_ins(32)
+    docs = [DocumentChunk(doc_id="a.pdf", page=i, section_path="s", text=f"坡脚渗水 第{i}段") for i in range(8)]
+
+    class FixedRetriever:
+        def retrieve(self, query, k=50, filters=None):
+            return docs[:k]
+
+    components.override("retriever", FixedRetriever())
+    try:
+        assert rag_pipeline.run("坡脚渗水")["degraded"] == []
+        # 剩余时间不足时跳过重排
+        with deadline_scope(Deadline(settings.DEGRADE_MIN_GENERATE_SECONDS / 2)):
+            result = rag_pipeline.run("坡脚渗水")
+        assert result["degraded"] == ["rerank_skipped"]
+        assert len(result["evidence"]) == settings.RERANK_TOPN
+    finally:
+        components.reset("retriever")
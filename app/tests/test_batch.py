@@ -0,0 +1,45 @@
+import json
+from app.core.config import settings
+from app.core.registry import components
+from app.index.filters import MetadataFilter
+from app.ingest.parser import DocumentChunk
+from app.search.retrieve import HybridRetriever
+
+
+def test_batch_retrieval_matches_single_and_job_writes_jsonl(tmp_path, monkeypatch):
+    from app.eval.stand_ins import install_stand_ins
+    from app.pipeline.batch import BatchRunner
+
+    install_stand_ins(32)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", None)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", False)
+    monkeypatch.setattr(settings, "BATCH_QUESTION_SIZE", 3)
+    retriever = HybridRetriever(index_dir=str(tmp_path / "index"))
+    docs = [DocumentChunk(doc_id=f"doc{i % 4}.pdf", page=i, section_path="s",
+                          text=f"第{i}号边坡 监测点{i * 7} 位移{i * 3}毫米 降雨{i % 5}级")
+            for i in range(40)]
+    retriever.index_documents(docs)
+    retriever.prepare_filters()
+
+    queries = [docs[3].text, "降雨2级 位移", docs[25].text, "挡土墙"]
+    filters = [None, MetadataFilter.parse({"doc_id": "doc1.pdf"}), None, None]
+    batched = retriever.retrieve_batch(queries, k=10, filters=filters)
+    for query, f, result in zip(queries, filters, batched):
+        assert [d.text for d in result] == [d.text for d in retriever.retrieve(query, k=10, filters=f)]
+    assert all(d.doc_id == "doc1.pdf" for d in batched[1])
+
+    components.override("retriever", retriever)
+    runner = BatchRunner(output_dir=str(tmp_path / "batch"))
+    items = runner.parse_items([queries[0], {"id": "site-7", "question": queries[1]}, queries[2], queries[3]],
+                               filters={"page": {"gte": 0}})
+    job = runner.submit(items)
+    runner._executor().submit(lambda: None).result()  # 等待任务线程执行完
+    assert job.id not in runner._jobs  # 结束的任务不留在内存中，状态从文件读取
+    status = runner.status(job.id)
+    assert status["status"] == "done" and status["done"] == 4 and status["failed"] == 0
+    with open(runner.results_path(job.id), "r", encoding="utf-8") as f:
+        records = sorted((json.loads(line) for line in f), key=lambda r: r["index"])
+    assert [r["id"] for r in records] == [0, "site-7", 2, 3]
+    assert all("risk_level" in r and "evidence" in r for r in records)
+    assert runner.status("../etc/passwd") is None
+    components.reset("retriever")
@@ -0,0 +1,25 @@
+from app.ingest.parser import DocumentChunk
+from app.utils.citations import validate_citations
+
+DOCS = [
+    DocumentChunk(doc_id="GB50330.pdf", page=12, section_path="s",
+                  text="边坡工程安全等级为一级时，抗滑移稳定安全系数不应小于1.35。"),
+    DocumentChunk(doc_id="report.md", page=1, section_path="s",
+                  text="近三日累计降雨量达到120毫米，坡脚出现新的拉张裂缝。"),
+]
+
+
+def test_citations_are_normalised_and_claims_checked_against_evidence():
+    response = {
+        "rationale": "近三日累计降雨量达到120毫米，坡脚出现新的拉张裂缝。该区域历史上曾发生三次大型泥石流灾害。",
+        "citations": [
+            {"doc_id": " GB50330.PDF ", "page": "12", "quote": "安全系数不应小于1.35"},
+            {"doc_id": "report.md", "page": 1.0, "quote": "锚杆已全部失效"},
+            {"doc_id": "report.md", "page": "第一页"},
+            {"doc_id": "missing.pdf", "page": 1},
+            "not a citation",
+        ],
+    }
+    result = validate_citations(response, DOCS)
+    assert [c["doc_id"] for c in result["citations"]] == [" GB50330.PDF "]
+    assert result["unsupported_claims"] == ["锚杆已全部失效", "该区域历史上曾发生三次大型泥石流灾害。"]
@@ -0,0 +1,58 @@
+import pytest
+from app.ingest.dedup import NearDuplicateIndex
+from app.ingest.parser import DocumentChunk
+
+BASE = "边坡稳定性分析应采用极限平衡法，安全系数不应小于1.35。抗滑桩应嵌入稳定岩层，锚固段长度不宜小于桩长的三分之一。" * 3
+
+
+def _chunk(doc_id, text):
+    return DocumentChunk(doc_id=doc_id, page=1, section_path="s", text=text)
+
+
+def test_near_duplicates_are_collapsed_within_and_across_batches(tmp_path):
+    index = NearDuplicateIndex(threshold=0.8)
+    first = [
+        _chunk("GB50330-2013.pdf", BASE),
+        _chunk("GB50330-2002.pdf", BASE.replace("1.35", "1.30")),
+        _chunk("other.pdf", "降雨入渗导致孔隙水压力上升，有效应力降低，坡脚出现裂缝时应立即启动监测预警。" * 3),
+    ]
+    kept, stats, pending = index.deduplicate(first)
+    index.commit(pending)
+    assert [d.doc_id for d in kept] == ["GB50330-2013.pdf", "other.pdf"]
+    assert kept[0].metadata["duplicates"][0]["doc_id"] == "GB50330-2002.pdf"
+    assert stats.batch_duplicates == 1
+
+    index.save(str(tmp_path))
+    reloaded = NearDuplicateIndex(threshold=0.8)
+    reloaded.load(str(tmp_path))
+    kept, stats, _ = reloaded.deduplicate([_chunk("copy.pdf", " " + BASE), _chunk("new.pdf", "格构梁与土钉联合支护" * 10)])
+    assert [d.doc_id for d in kept] == ["new.pdf"]
+    assert stats.index_duplicates == 1 and stats.ratio == 0.5
+
+
+def test_failed_index_write_does_not_register_signatures(tmp_path, monkeypatch):
+    from app.core.config import settings
+    from app.eval.stand_ins import install_stand_ins
+    from app.search.retrieve import HybridRetriever
+
+    install_stand_ins(32)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", None)
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", True)
+    retriever = HybridRetriever(index_dir=str(tmp_path))
+    docs = [_chunk("a.pdf", BASE), _chunk("b.pdf", "格构梁与土钉联合支护" * 10)]
+
+    add_documents, calls = retriever.bm25_index.add_documents, []
+
+    def fail_once(documents):
+        calls.append(len(documents))
+        if len(calls) == 1:
+            raise OSError("disk full")
+        return add_documents(documents)
+
+    monkeypatch.setattr(retriever.bm25_index, "add_documents", fail_once)
+    with pytest.raises(OSError):
+        retriever.index_documents(docs)
+    assert len(retriever.dedup_index) == 0
+    # 重试时未入库的 chunk 不被当作已入库的重复
+    stats = retriever.index_documents(docs)
+    assert stats.kept == 2 and stats.index_duplicates == 0
@@ -0,0 +1,38 @@
+from functools import partial
+import numpy as np
+from app.eval.stand_ins import HashEmbeddingModel
+from app.ingest.embedder import DocumentEmbedder, length_batches
+
+
+def test_length_batches_group_similar_lengths():
+    texts = ["a" * n for n in [5, 100, 7, 90, 6, 95]]
+    batches = length_batches(texts, 3)
+    assert [sorted(b.tolist()) for b in batches] == [[1, 3, 5], [0, 2, 4]]
+
+
+def test_worker_pool_matches_single_process():
+    texts = [f"边坡第{i}段" * (i % 7 + 1) for i in range(50)]
+    model = HashEmbeddingModel(32)
+    embedder = DocumentEmbedder(workers=2, batch_size=8, model_factory=partial(HashEmbeddingModel, 32))
+    received = {}
+
+    def sink(rows, embeddings):
+        received.update(zip(rows.tolist(), embeddings))
+
+    embedder.embed_to(sink, texts, write_batch=16)
+    assert sorted(received) == list(range(len(texts)))
+    np.testing.assert_allclose(np.vstack([received[i] for i in range(len(texts))]),
+                               model.embed_documents(texts), rtol=1e-6)
+
+
+def test_train_sample_is_random_and_delivered_first():
+    from app.eval.stand_ins import install_stand_ins
+
+    install_stand_ins(32)
+    texts = ["坡" * (i + 1) for i in range(200)]
+    embedder = DocumentEmbedder(workers=1, batch_size=8)
+    calls = []
+    embedder.embed_to(lambda rows, embeddings: calls.append(rows), texts, write_batch=16, train_sample=50)
+    # 第一批为 50 条随机样本，覆盖长短不同的文本，而不是按长度排序后最长的 50 条
+    assert len(calls[0]) == 50 and calls[0].min() < 100 <= calls[0].max()
+    assert sorted(np.concatenate(calls).tolist()) == list(range(200))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from app.tools.engineering import engineering_tool
+
+
+def test_batch_matches_scalar_and_grid_chunks_cover_all_combinations():
+    params = dict(c=[10, 20, 0], phi=[25, 30, 35], gamma=18, h=[5, 10, 0], beta=[30, 45, 40], u=[0, 20, 0])
+    batch = engineering_tool.stability_factor_batch(**params)
+    for i in range(2):
+        scalar = engineering_tool.stability_factor(**{k: v[i] if isinstance(v, list) else v for k, v in params.items()})
+        assert round(float(batch["Fs"][i]), 3) == scalar["Fs"]
+        assert batch["status"][i] == scalar["status"]
+    assert np.isnan(batch["Fs"][2]) and batch["status"][2] == "Error"
+
+    grid = {"c": [10, 20], "phi": {"start": 20, "stop": 40, "num": 5}, "gamma": 18, "h": 10,
+            "beta": [30, 45, 60], "u": [0, 10]}
+    chunks = list(engineering_tool.iter_grid(grid, chunk_size=7))
+    assert engineering_tool.grid_size(grid) == 60
+    assert sum(len(c["Fs"]) for c in chunks) == 60
+    all_fs = np.concatenate([c["Fs"] for c in chunks])
+    summary = engineering_tool.sweep(grid)
+    assert summary["combinations"] == 60
+    assert summary["Fs_min"] == round(float(all_fs.min()), 3)
+    worst = engineering_tool.stability_factor(**summary["worst_case"])
+    assert worst["Fs"] == summary["Fs_min"]
+
+
+def test_oversized_grid_is_rejected_before_allocating_axes():
+    huge = {"phi": {"start": 0, "stop": 1, "num": 1e9}, "beta": [30, 45]}
+    assert engineering_tool.grid_size(huge) == 2_000_000_000
+    with pytest.raises(ValueError, match="limit"):
+        engineering_tool.iter_grid(huge)
+    assert "error" in engineering_tool.sweep(huge)
+    for num in (2.5, 0, -3, True, "10"):
+        with pytest.raises(ValueError, match="positive integer"):
+            engineering_tool.grid_size({"phi": {"start": 0, "stop": 1, "num": num}})
+    for grid in ({"phi": {"start": "a", "stop": 40, "num": 3}}, {"phi": {"start": 0, "stop": None, "num": 3}},
+                 {"beta": [30, "45"]}, {"beta": [[30, 45]]}, {"c": "10"}, {"h": True}):
+        with pytest.raises(ValueError, match="must be"):
+            engineering_tool.grid_size(grid)
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from app.index.filters import MetadataFilter, MetadataIndex
+from app.ingest.parser import DocumentChunk
+
+
+def _docs():
+    return [
+        DocumentChunk(doc_id=f"doc{i % 3}.pdf", page=i, section_path="s", text=f"边坡 第{i}段",
+                      is_table=i % 4 == 0, timestamp=f"2024-01-{i + 1:02d}", metadata={"tags": ["a", str(i % 2)]})
+        for i in range(20)
+    ]
+
+
+def test_metadata_index_matches_scan():
+    docs = _docs()
+    index = MetadataIndex()
+    index.sync(docs[:10])
+    expressions = [
+        {"is_table": True},
+        {"doc_id": ["doc0.pdf", "doc2.pdf"], "page": {"gte": 5, "lt": 15}},
+        {"metadata.tags": "1"},
+        {"timestamp": {"gt": "2024-01-10"}},
+    ]
+    for expr in expressions:
+        flt = MetadataFilter.parse(expr)
+        np.testing.assert_array_equal(index.mask(flt, docs), flt.scan(docs))
+
+
+def test_booleans_and_numbers_do_not_match_each_other():
+    docs = [DocumentChunk(doc_id="a.pdf", page=1, section_path="s", text="t", is_table=flag,
+                          metadata={"level": value})
+            for flag, value in [(True, 1), (False, True), (False, 1.0)]]
+    index = MetadataIndex()
+    for expr, expected in [({"metadata.level": 1}, [True, False, True]),
+                           ({"metadata.level": True}, [False, True, False]),
+                           ({"metadata.level": {"gte": 1}}, [True, False, True])]:
+        flt = MetadataFilter.parse(expr)
+        assert flt.scan(docs).tolist() == expected
+        assert index.mask(flt, docs).tolist() == expected
+    with pytest.raises(ValueError):
+        MetadataFilter.parse({"is_table": 1})
+    with pytest.raises(ValueError):
+        MetadataFilter.parse({"page": True})
+
+
+def test_es_filter_uses_keyword_subfields_for_metadata_strings():
+    flt = MetadataFilter.parse({"doc_id": "a.pdf", "metadata.source": ["design_code", 3],
+                                "metadata.date": {"gte": "2024-01-01"}, "metadata.level": {"gt": 2}})
+    assert flt.to_es() == [
+        {"terms": {"doc_id": ["a.pdf"]}},
+        {"bool": {"should": [{"terms": {"metadata.source.keyword": ["design_code"]}},
+                             {"terms": {"metadata.source": [3]}}], "minimum_should_match": 1}},
+        {"range": {"metadata.date.keyword": {"gte": "2024-01-01"}}},
+        {"range": {"metadata.level": {"gt": 2}}},
+    ]
+    assert MetadataFilter.parse(flt.to_dict()).to_es() == flt.to_es()
+
+
+def test_filter_rejects_unknown_fields():
+    assert MetadataFilter.parse({}) is None
+    with pytest.raises(ValueError):
+        MetadataFilter.parse({"author": "x"})
+    with pytest.raises(ValueError):
+        MetadataFilter.parse({"page": {"between": [1, 2]}})
+
+
+@pytest.mark.parametrize("codec", ["flat", "sq8", "pq"])
+def test_vector_search_only_returns_admissible_rows(codec):
+    from app.index.faiss_index import FAISSIndex
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((400, 16)).astype(np.float32)
+    docs = [DocumentChunk(doc_id="a.pdf", page=i, section_path="s", text=str(i), is_table=i % 5 == 0)
+            for i in range(400)]
+    index = FAISSIndex(codec=codec)
+    index.add_embeddings(vectors, docs)
+
+    allowed = MetadataFilter.parse({"is_table": True}).scan(docs)
+    scores, ids = index.search_vectors(vectors[:3], k=10, allowed=allowed)
+    assert (ids % 5 == 0).all()
+    expected = np.argsort(-(vectors[:3] @ vectors[allowed].T), axis=1)[:, :10]
+    np.testing.assert_array_equal(ids[:, 0], np.flatnonzero(allowed)[expected[:, 0]])
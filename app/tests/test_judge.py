@@ -0,0 +1,63 @@
+import numpy as np
+from app.eval.judge import JudgeEngine, parse_score
+from app.eval.stand_ins import HashEmbeddingModel, TemplateGenerator
+
+
+class CountingGenerator(TemplateGenerator):
+    def __init__(self):
+        self.batches = []
+
+    def generate_batch(self, prompts, schema=None, max_new_tokens=None):
+        self.batches.append(len(prompts))
+        return super().generate_batch(prompts, schema=schema, max_new_tokens=max_new_tokens)
+
+
+class CountingEmbedder(HashEmbeddingModel):
+    def __init__(self):
+        super().__init__(64)
+        self.calls = []
+
+    def embed_documents(self, texts, batch_size=32):
+        self.calls.append(len(texts))
+        return super().embed_documents(texts, batch_size)
+
+
+def test_judge_batches_caches_and_scores(tmp_path):
+    context = "坡脚渗水时应设置截水沟并加强位移监测"
+    items = [("坡脚渗水怎么办", "设置截水沟并加强位移监测", context),
+             ("坡脚渗水怎么办", "建议立即拆除整个挡土墙", context),
+             ("边坡位移", "加强位移监测", context)] * 2  # 重复项只评审一次
+    cache = str(tmp_path / "judge.jsonl")
+    generator, embedder = CountingGenerator(), CountingEmbedder()
+    engine = JudgeEngine(generator, embedder, cache_path=cache, workers=2, batch_size=2)
+
+    scores = engine.evaluate(items)
+    assert generator.batches == [2, 1]
+    assert scores[0]["faithfulness"] == 1.0 and scores[1]["faithfulness"] < 0.5
+    assert scores[3] == scores[0]
+
+    # 批量余弦与逐条计算一致；文本去重后一次向量化
+    assert embedder.calls == [5]
+    q, a = embedder._embed(items[0][0]), embedder._embed(items[0][1])
+    assert np.isclose(scores[0]["answer_relevancy"], max(0.0, float(q @ a)), atol=1e-5)
+
+    # 新进程从磁盘缓存恢复，只评审变化的回答
+    generator = CountingGenerator()
+    engine = JudgeEngine(generator, CountingEmbedder(), cache_path=cache, workers=2, batch_size=2)
+    changed = items[:2] + [("边坡位移", "加强位移监测，每日巡查", context)]
+    assert engine.faithfulness(changed)[:2] == [s["faithfulness"] for s in scores[:2]]
+    assert generator.batches == [1]
+
+    # 更换评审模型后不沿用旧模型的分数
+    other = CountingGenerator()
+    other.model_id = "another-judge"
+    JudgeEngine(other, CountingEmbedder(), cache_path=cache, workers=2, batch_size=2).faithfulness(items[:1])
+    assert other.batches == [1]
+
+    assert parse_score('好的 {"score": 0.7, "reason": "..."}') == 0.7
+    assert parse_score('{"score": true, "reason": "..."}') is None
+    assert parse_score('评审结果 "score": 0.6, 大部分有依据') == 0.6
+    assert parse_score("得分 score：1") == 1.0
+    assert parse_score("第1条陈述缺乏依据，与上下文矛盾") is None
+    assert parse_score("上下文共1段，回答完全无关") is None
+    assert parse_score("score: 7") is None
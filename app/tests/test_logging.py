@@ -0,0 +1,37 @@
+import json
+import logging
+import queue
+from app.core.logging import JsonFormatter, SamplingFilter, NonBlockingQueueHandler
+
+
+def _record(msg, *args, level=logging.INFO, **extra):
+    record = logging.LogRecord("slope_rag.test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    record = _record("Reranked %d docs", 5, stage_timings={"rerank": 12.5})
+    payload = json.loads(JsonFormatter().format(record))
+    assert payload["message"] == "Reranked 5 docs"
+    assert payload["level"] == "INFO"
+    assert payload["stage_timings"] == {"rerank": 12.5}
+
+
+def test_sampling_filter_rate_limits_info_but_not_warnings():
+    f = SamplingFilter(max_per_second=2)
+    passed = sum(f.filter(_record("x")) for _ in range(10))
+    assert passed == 2
+    assert f.dropped == 8
+    assert f.filter(_record("boom", level=logging.WARNING))
+
+
+def test_queue_handler_never_blocks_and_defers_formatting():
+    q = queue.Queue(maxsize=1)
+    handler = NonBlockingQueueHandler(q)
+    handler.handle(_record("first %s", "a"))
+    handler.handle(_record("second %s", "b"))
+    assert handler.dropped == 1
+    queued = q.get_nowait()
+    # 格式化留给 listener 线程
+    assert queued.msg == "first %s" and queued.args == ("a",)
@@ -0,0 +1,60 @@
+import pytest
+from app.core.config import settings
+from app.core.memory import MemoryBudgetExceeded, component_memory, traced_allocations
+from app.core.registry import components
+from app.ingest.buffer import IngestBuffer
+from app.ingest.parser import DocumentChunk
+from app.search.retrieve import HybridRetriever
+
+
+def _docs(n, offset=0):
+    return [DocumentChunk(doc_id=f"doc{i % 3}.pdf", page=i, section_path="s",
+                          text=f"第{i + offset}号边坡 坡脚渗水 监测点{(i + offset) * 7} 位移{i * 3}毫米")
+            for i in range(n)]
+
+
+def test_component_accounting_and_ingest_spill(tmp_path, monkeypatch):
+    from app.eval.stand_ins import install_stand_ins
+
+    install_stand_ins(32)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", None)
+    retriever = HybridRetriever(index_dir=str(tmp_path / "index"))
+    components.get("tokenizer")  # 词典在 tracemalloc 开启前加载
+
+    # 缓冲超过上限时分批写入索引，去重统计累加；索引文件只在 close() 时写一次
+    saves = []
+
+    def save():
+        saves.append(len(retriever.vector_index.documents))
+        retriever.save()
+
+    buffer = IngestBuffer(retriever.index_documents, limit_bytes=20000, save=save)
+    with traced_allocations("ingest", enabled=True) as allocations:
+        for start in range(0, 120, 30):
+            buffer.extend(_docs(30, offset=start))
+        assert buffer.spills >= 2 and not (tmp_path / "index").exists()
+        stats = buffer.close()
+    assert stats.total == 120 and stats.kept == len(retriever.vector_index.documents)
+    assert saves == [stats.kept] and HybridRetriever(index_dir=str(tmp_path / "index")).vector_index.index.ntotal == stats.kept
+    assert allocations["top"] and allocations["peak"] > 0
+
+    retriever.prepare_filters()
+    usage = retriever.memory_usage()
+    assert usage["index_vectors"] == stats.kept * 32 * 4
+    assert usage["chunk_text"] > usage["bm25_chunk_text"]  # 两路索引共用 chunk 对象，只计一次
+    assert usage["bm25_postings"] > 0 and usage["metadata_index"] > 0
+
+    components.override("retriever", retriever)
+    try:
+        report = component_memory()
+        assert report["components"]["retriever"]["bytes"] == sum(usage.values())
+        assert report["accounted"] + report["unaccounted"] >= report["rss"]
+    finally:
+        components.reset("retriever")
+
+    # 进程内存超出预算：spill 后仍超出则拒绝继续导入
+    monkeypatch.setattr(settings, "MEMORY_BUDGET_MB", 1)
+    buffer = IngestBuffer(retriever.index_documents)
+    with pytest.raises(MemoryBudgetExceeded):
+        buffer.extend(_docs(5, offset=500))
+    assert buffer.chunks == [] and buffer.stats.total == 5
@@ -0,0 +1,54 @@
+from app.core.metrics import (MetricsRegistry, STAGE_LATENCY, LLM_DRAFT_ACCEPTANCE, LLM_TOKENS_PER_SECOND,
+                              stage_timer, timed, record_generation)
+
+
+def test_histogram_exposition():
+    reg = MetricsRegistry()
+    hist = reg.histogram("demo_seconds", "Demo latency", ["stage"], buckets=(0.1, 1.0))
+    hist.labels("rerank").observe(0.05)
+    hist.labels("rerank").observe(0.5)
+    hist.labels("rerank").observe(5.0)
+
+    text = reg.render()
+    assert "# TYPE demo_seconds histogram" in text
+    assert 'demo_seconds_bucket{stage="rerank",le="0.1"} 1' in text
+    assert 'demo_seconds_bucket{stage="rerank",le="1"} 2' in text
+    assert 'demo_seconds_bucket{stage="rerank",le="+Inf"} 3' in text
+    assert 'demo_seconds_count{stage="rerank"} 3' in text
+
+
+def test_counter_and_gauge():
+    reg = MetricsRegistry()
+    counter = reg.counter("demo_total", "Demo counter", ["result"])
+    counter.labels("hit").inc()
+    counter.labels("hit").inc(2)
+    gauge = reg.gauge("demo_depth", "Demo gauge")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    text = reg.render()
+    assert 'demo_total{result="hit"} 3' in text
+    assert "demo_depth 1" in text
+
+
+def test_stage_timer_records_latency():
+    before = STAGE_LATENCY.labels("unit_test").count
+    with stage_timer("unit_test"):
+        pass
+
+    @timed("unit_test")
+    def work():
+        return 42
+
+    assert work() == 42
+    assert STAGE_LATENCY.labels("unit_test").count == before + 2
+
+
+def test_record_generation_reports_draft_acceptance():
+    child = LLM_DRAFT_ACCEPTANCE.labels("unit_test")
+    before = child.sum
+    # 300 个输出 token 只用了 120 次目标模型前向：180 个来自被接受的草稿
+    record_generation("unit_test", tokens_out=300, steps=120, seconds=10.0)
+    assert abs(child.sum - before - 0.6) < 1e-9
+    assert LLM_TOKENS_PER_SECOND.labels("unit_test").sum >= 30
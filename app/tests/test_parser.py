@@ -0,0 +1,50 @@
+from app.ingest.parser import DocumentParser
+
+
+def _write_pdf(path, pages):
+    """
+    生成最小 PDF：每页一段正文与一个 2x2 带边框表格
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for body, cells in pages:
+        lines = ["BT /F1 12 Tf 72 720 Td (%s) Tj ET" % body]
+        for x0, y0 in [(72, 500), (172, 500), (72, 470), (172, 470)]:
+            lines.append("%d %d 100 30 re S" % (x0, y0))
+        for (x, y), cell in zip([(80, 510), (180, 510), (80, 480), (180, 480)], cells):
+            lines.append("BT /F1 10 Tf %d %d Td (%s) Tj ET" % (x, y, cell))
+        stream = "\n".join(lines)
+        objects.append("<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       "/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects))
+        kids.append("%d 0 R" % len(objects))
+    objects[1] = "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += ("%d 0 obj\n%s\nendobj\n" % (i, obj)).encode("latin-1")
+    xref = len(out)
+    out += ("xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)).encode()
+    out += "".join("%010d 00000 n \n" % o for o in offsets).encode()
+    out += ("trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)).encode()
+    path.write_bytes(bytes(out))
+
+
+def test_pdf_pages_stream_with_tables_cropped_from_text(tmp_path, monkeypatch):
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "PDF_PAGE_WINDOW", 2)
+    pdf_path = tmp_path / "manual.pdf"
+    _write_pdf(pdf_path, [(f"Slope body {i}", [f"H{i}a", f"H{i}b", f"v{i}a", f"v{i}b"]) for i in range(1, 6)])
+
+    chunks = list(DocumentParser().iter_parse(str(pdf_path)))
+    tables = [c for c in chunks if c.is_table]
+    texts = [c for c in chunks if not c.is_table]
+    assert [c.page for c in tables] == [1, 2, 3, 4, 5]
+    assert [c.page for c in texts] == [1, 2, 3, 4, 5]
+    assert tables[2].text == "|H3a|H3b|\n|---|---|\n|v3a|v3b|\n"
+    # 表格内容不再出现在正文中
+    assert texts[2].text.strip() == "Slope body 3"
@@ -0,0 +1,43 @@
+import threading
+from app.core.registry import ComponentRegistry
+
+
+class _Model:
+    loads = 0
+
+    def __init__(self):
+        _Model.loads += 1
+        self.dim = 8
+
+
+def test_lazy_proxy_defers_and_loads_once():
+    _Model.loads = 0
+    reg = ComponentRegistry()
+    proxy = reg.lazy("model", _Model)
+    assert _Model.loads == 0
+    assert not reg.ready()
+
+    threads = [threading.Thread(target=lambda: proxy.dim) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert _Model.loads == 1
+    assert reg.ready()
+    assert reg.status()["model"]["loaded"]
+
+
+def test_override_and_warmup_errors():
+    reg = ComponentRegistry()
+    proxy = reg.lazy("model", _Model)
+    reg.override("model", type("Stub", (), {"dim": 2})())
+    assert proxy.dim == 2
+
+    def broken():
+        raise RuntimeError("no weights")
+
+    reg.register("broken", broken)
+    reg.warmup()
+    assert not reg.ready()
+    assert "no weights" in reg.status()["broken"]["error"]
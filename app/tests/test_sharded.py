@@ -0,0 +1,60 @@
+import pickle
+import socket
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+import numpy as np
+import pytest
+from app.core.config import settings
+from app.index.filters import MetadataFilter
+from app.ingest.parser import DocumentChunk
+from app.search.sharded import ShardClient, ShardedRetriever, encode_request, shard_of, unpack_message
+
+
+@pytest.fixture
+def sharded(tmp_path, monkeypatch):
+    from app.eval.stand_ins import install_stand_ins
+
+    install_stand_ins(32)
+    monkeypatch.setattr(settings, "SHARDS", 3)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", None)
+    return ShardedRetriever(index_dir=str(tmp_path))
+
+
+def test_scatter_gather_merges_shards_and_applies_filters(sharded):
+    docs = [DocumentChunk(doc_id=f"doc{i % 6}.pdf", page=i, section_path="s",
+                          text=f"第{i}号边坡 监测点{i * 7} 位移{i * 3}毫米 降雨{i % 5}级")
+            for i in range(60)]
+    stats = sharded.index_documents(docs)
+    assert stats.kept == 60
+    assert sorted(shard.call("count") for shard in sharded.shards) == sorted(
+        sum(shard_of(d, 3) == s for d in docs) for s in range(3))
+
+    results = sharded.retrieve(docs[17].text, k=5)
+    assert results[0].page == 17
+    filtered = sharded.retrieve(docs[17].text, k=10, filters=MetadataFilter.parse({"doc_id": "doc2.pdf"}))
+    assert filtered and all(d.doc_id == "doc2.pdf" for d in filtered)
+
+
+def test_rpc_is_pickle_free_and_remote_shards_require_authkey(monkeypatch):
+    expr = {"doc_id": ["a.pdf"], "page": {"gte": 3}}
+    header, arrays = unpack_message(encode_request("search", (np.ones(4), ("坡脚",), 5, MetadataFilter.parse(expr))))
+    assert header == {"method": "search", "tokens": ["坡脚"], "k": 5, "filters": expr}
+    assert arrays[0].dtype == np.float32 and arrays[0].shape == (4,)
+    with pytest.raises(ValueError):
+        unpack_message(pickle.dumps(("count", ())))
+
+    monkeypatch.setattr(settings, "SHARD_AUTHKEY", None)
+    with pytest.raises(ValueError, match="SHARD_AUTHKEY"):
+        ShardedRetriever(addresses=["127.0.0.1:7100"])
+
+
+def test_shard_survives_probes_and_wrong_authkey(sharded):
+    shard = sharded.shards[0]
+    assert shard.call("count") == 0
+    probe = socket.socket(socket.AF_UNIX)
+    probe.connect(shard.address)  # 连接后立即断开 (端口扫描)
+    probe.close()
+    with pytest.raises((AuthenticationError, EOFError, OSError)):
+        Client(shard.address, authkey=b"x" * 32).send_bytes(b"{}")
+    # 新建连接 (不复用连接池) 确认分片仍在接受请求
+    assert ShardClient(shard.address, shard.authkey).call("count") == 0
@@ -0,0 +1,62 @@
+import numpy as np
+from rank_bm25 import BM25Okapi
+from app.index.chunk_store import ChunkStore
+from app.index.postings import BM25Postings
+from app.ingest.parser import DocumentChunk
+
+
+def test_chunk_store_roundtrip(tmp_path):
+    docs = [
+        DocumentChunk(doc_id="a.pdf", page=i, section_path="s", text=f"边坡第{i}段", metadata={"i": i})
+        for i in range(5)
+    ]
+    ChunkStore.write(str(tmp_path), docs)
+    store = ChunkStore(str(tmp_path))
+    assert len(store) == 5
+    assert store[3] == docs[3]
+    assert store[-1] == docs[-1]
+    assert [d.page for d in store[1:3]] == [1, 2]
+
+
+def test_postings_match_rank_bm25_and_support_incremental_add(tmp_path):
+    corpus = [
+        ["边坡", "稳定性", "降雨"],
+        ["安全系数", "边坡", "边坡"],
+        ["抗滑桩", "加固"],
+        ["降雨", "入渗", "孔隙水压力", "降雨"],
+    ]
+    query = ["边坡", "降雨", "未知词"]
+    expected = BM25Okapi(corpus).get_scores(query)
+
+    postings = BM25Postings()
+    postings.add(corpus[:2])
+    postings.add(corpus[2:])
+    np.testing.assert_allclose(postings.get_scores(query), expected, rtol=1e-6)
+
+    postings.save(str(tmp_path))
+    loaded = BM25Postings.load(str(tmp_path), mmap=True)
+    np.testing.assert_allclose(loaded.get_scores(query), expected, rtol=1e-6)
+
+
+def test_compressed_codec_rescores_from_mmapped_vectors(tmp_path):
+    from app.index.faiss_index import FAISSIndex
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((500, 32)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    docs = [DocumentChunk(doc_id="a.pdf", page=i, section_path="s", text=str(i)) for i in range(500)]
+    queries = vectors[:10] + 0.1 * rng.standard_normal((10, 32)).astype(np.float32)
+    expected = np.argsort(-(queries @ vectors.T), axis=1)[:, :5]
+
+    index = FAISSIndex(codec="pq")
+    index.add_embeddings(vectors, docs)
+    index.save(str(tmp_path))
+    loaded = FAISSIndex()
+    loaded.load(str(tmp_path))
+    assert loaded.codec == "pq"
+    assert isinstance(loaded.full_vectors, np.memmap)
+    assert loaded.code_bytes() < vectors.nbytes
+
+    scores, ids = loaded.search_vectors(queries, k=5)
+    np.testing.assert_array_equal(ids, expected)
+    np.testing.assert_allclose(scores, np.take_along_axis(queries @ vectors.T, expected, axis=1), rtol=1e-5)
@@ -0,0 +1,74 @@
+import os
+import pytest
+from app.core.config import settings
+from app.core.registry import components
+from app.index import snapshots
+from app.index.build import build_snapshot
+
+
+def test_build_publish_and_hot_reload(tmp_path, monkeypatch):
+    from app.eval.stand_ins import install_stand_ins
+    from app.search.reload import index_reloader
+
+    install_stand_ins(32)
+    data_dir, index_root = tmp_path / "docs", tmp_path / "index"
+    data_dir.mkdir()
+    (data_dir / "a.md").write_text("# 边坡\n\n坡脚出现拉张裂缝，建议加密监测。", encoding="utf-8")
+    monkeypatch.setattr(settings, "INDEX_DIR", str(index_root))
+    monkeypatch.setattr(settings, "SHARDS", 1)
+    monkeypatch.setattr(settings, "ELASTICSEARCH_URL", None)
+    monkeypatch.setattr(settings, "SNAPSHOT_GRACE_SECONDS", 0.0)
+
+    first = build_snapshot(str(data_dir), version="v1")
+    snapshots.publish("v1")
+    components.reset("retriever")
+    assert index_reloader.reload()["version"] == "v1"
+    old = components.get("retriever")
+
+    (data_dir / "b.md").write_text("# 排水\n\n截水沟堵塞导致坡面冲刷。", encoding="utf-8")
+    second = build_snapshot(str(data_dir), version="v2")
+    assert second["chunks"] > first["chunks"]
+    snapshots.publish("v2")
+    result = index_reloader.reload()
+    assert result["reloaded"] and result["previous"] == "v1"
+    assert components.get("retriever") is not old
+    assert any("截水沟" in d.text for d in components.get("retriever").retrieve("截水沟", k=5))
+    assert not index_reloader.reload()["reloaded"]
+
+    # 快照被篡改时拒绝加载，继续使用已加载的版本
+    with open(os.path.join(snapshots.snapshot_path("v1"), "chunks.bin"), "ab") as f:
+        f.write(b"x")
+    with pytest.raises(ValueError):
+        index_reloader.reload("v1")
+    assert index_reloader.loaded_version() == "v2"
+
+    # 版本名不能指向 snapshots/ 之外的目录
+    for version in ("../../index/snapshots/v1", "..", "v3"):
+        with pytest.raises(ValueError):
+            index_reloader.reload(version)
+    with pytest.raises(ValueError):
+        snapshots.publish("../v1")
+    assert index_reloader.loaded_version() == "v2"
+    components.reset("retriever")
+
+
+def test_watcher_survives_transient_errors_reading_current(monkeypatch):
+    import time
+    from app.search.reload import IndexReloader
+
+    calls = []
+
+    def flaky_current_version(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError("transient read error")
+        return None
+
+    monkeypatch.setattr(snapshots, "current_version", flaky_current_version)
+    reloader = IndexReloader()
+    reloader.start_watcher(interval=0.01)
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(calls) >= 3 and reloader._watcher.is_alive()
+    assert reloader._failed_version is None
@@ -0,0 +1,24 @@
+from app.llm.structured import JSONObjectScanner, iter_json_object, parse_json_object
+
+
+def test_scanner_stops_when_top_level_object_closes():
+    scanner = JSONObjectScanner()
+    pieces = ['好的，结果如下：{"rationale": "括号 } 与 \\"引号\\" 不', '影响", "citations": [{"page": 1}]', '}\n以上。{"x": 1}']
+    ends = [scanner.feed(p) for p in pieces]
+    assert ends[:2] == [-1, -1] and ends[2] == 1
+    assert scanner.done
+    assert parse_json_object("".join(pieces))["citations"] == [{"page": 1}]
+
+
+def test_stream_is_cut_at_object_end_and_invalid_output_falls_back():
+    consumed = []
+
+    def chunks():
+        for piece in ["说明文字 ", '{"risk_level"', ': "low"}', " 多余的文字", "不应被读取"]:
+            consumed.append(piece)
+            yield piece
+
+    assert "".join(iter_json_object(chunks())) == '{"risk_level": "low"}'
+    assert len(consumed) == 3
+    assert parse_json_object('{"risk_level": "high", "rationale": "被截断')["risk_level"] == "unknown"
+    assert parse_json_object("没有 JSON")["rationale"] == "没有 JSON"
@@ -0,0 +1,24 @@
+from app.core.config import settings
+from app.core.metrics import CACHE_REQUESTS
+from app.index.tokenizer import JiebaTokenizer
+
+
+def test_domain_terms_query_cache_and_parallel_ingest(monkeypatch):
+    tok = JiebaTokenizer(user_dict="", cache_size=2)
+    tokens = tok.tokenize("边坡的安全系数与抗剪强度、孔隙水压力有关")
+    assert {"安全系数", "抗剪强度", "孔隙水压力"} <= set(tokens)
+    assert "、" not in tokens
+
+    hits = CACHE_REQUESTS.labels("query_tokens", "hit")
+    before = hits.value
+    first = tok.tokenize_query("坡脚渗水")
+    assert tok.tokenize_query("坡脚渗水") is first
+    assert hits.value == before + 1
+    tok.tokenize_query("格构梁")
+    tok.tokenize_query("截水沟")
+    assert tok.cache_info()["size"] == 2
+
+    # 多进程分词与单进程结果一致
+    texts = ["抗滑桩与格构梁支护", "坡脚设置截水沟", "强风化层与软弱夹层", "内摩擦角 30 度"] * 3
+    monkeypatch.setattr(settings, "TOKENIZER_PARALLEL_MIN", 1)
+    assert tok.tokenize_documents(texts, workers=2) == [tok.tokenize(t) for t in texts]
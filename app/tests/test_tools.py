@@ -0,0 +1,62 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from app.core.config import settings
+from app.tools.executor import tool_executor
+from app.tools.weather import weather_tool
+
+
+class _StubWeather(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，便于验证连接复用
+    requests = 0
+    connections = set()
+    delay = 0.0
+
+    def do_GET(self):
+        type(self).requests += 1
+        type(self).connections.add(self.client_address)
+        time.sleep(type(self).delay)
+        body = json.dumps({"condition": "Heavy Rain", "precip_mm": 55.0}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_weather(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubWeather)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _StubWeather.requests, _StubWeather.connections, _StubWeather.delay = 0, set(), 0.0
+    monkeypatch.setattr(settings, "WEATHER_API_KEY", "test_key")
+    monkeypatch.setattr(settings, "WEATHER_API_URL", f"http://127.0.0.1:{server.server_port}")
+    tool_executor.cache.clear()
+    yield _StubWeather
+    server.shutdown()
+    tool_executor.cache.clear()
+
+
+def test_weather_calls_are_cached_and_reuse_connections(stub_weather):
+    for _ in range(3):
+        assert tool_executor.call("weather", city="Area A")["condition"] == "Heavy Rain"
+    assert stub_weather.requests == 1
+
+    weather_tool.query("Area B")
+    weather_tool.query("Area C")
+    assert stub_weather.requests == 3
+    assert len(stub_weather.connections) == 1
+
+
+def test_slow_tool_does_not_block_past_deadline(stub_weather):
+    stub_weather.delay = 1.0
+    start = time.monotonic()
+    future = tool_executor.submit("weather", city="Area A")
+    result = tool_executor.result(future, "weather", deadline=start + 0.2)
+    assert result == {"error": "timeout"}
+    assert time.monotonic() - start < 0.8
@@ -0,0 +1,55 @@
+import json
+from app.core.tracing import Tracer, TailSampler, span, annotate, current_trace
+
+
+def test_tail_sampler_keeps_slowest():
+    sampler = TailSampler(keep_ratio=0.1, window=100, min_samples=10)
+    for i in range(50):
+        sampler.should_keep(0.01 * (i % 10 + 1))
+    assert sampler.should_keep(5.0)
+    assert not sampler.should_keep(0.001)
+
+
+def test_trace_export_with_nested_spans(tmp_path):
+    trace_file = tmp_path / "traces.jsonl"
+    tracer = Tracer(trace_file=str(trace_file), keep_ratio=1.0, enabled=True)
+
+    with tracer.trace("ask", question="q") as trace:
+        with span("retrieve") as outer:
+            with span("faiss"):
+                pass
+            outer.set(candidates=3)
+        annotate(tokens_out=12)
+        assert current_trace() is trace
+    assert current_trace() is None
+
+    record = json.loads(trace_file.read_text(encoding="utf-8").strip())
+    assert record["trace_id"] == trace.trace_id
+    assert record["attributes"] == {"question": "q", "tokens_out": 12}
+    spans = {s["name"]: s for s in record["spans"]}
+    assert spans["retrieve"]["attributes"] == {"candidates": 3}
+    assert spans["faiss"]["parent_id"] == spans["retrieve"]["span_id"]
+
+
+def test_trace_dropped_when_not_sampled(tmp_path):
+    trace_file = tmp_path / "traces.jsonl"
+    tracer = Tracer(trace_file=str(trace_file), keep_ratio=0.0, enabled=True)
+    with tracer.trace("ask"):
+        with span("rerank"):
+            pass
+    assert not trace_file.exists()
+
+
+def test_untrusted_trace_id_cannot_escape_profile_dir(tmp_path):
+    profile_dir = tmp_path / "profiles"
+    tracer = Tracer(trace_file=str(tmp_path / "traces.jsonl"), keep_ratio=1.0, enabled=True,
+                    profile_rate=1.0, profiler="cprofile", profile_dir=str(profile_dir))
+    with tracer.trace("ask", trace_id="../../x") as trace:
+        pass
+    assert trace.trace_id != "../../x" and len(trace.trace_id) == 32
+    assert [p.name for p in profile_dir.iterdir()] == [f"{trace.trace_id}.prof"]
+    assert not (tmp_path / "x.prof").exists()
+
+    with tracer.trace("ask", trace_id="req-42") as trace:
+        pass
+    assert trace.trace_id == "req-42"
@@ -1,19 +1,81 @@
-from typing import Dict, Any
+import math
+from typing import Dict, Any, Iterator, List, Tuple, Union, Sequence
+import numpy as np
+from app.core.config import settings
+from app.tools.executor import tool_executor
+
+# 无限边坡模型: Fs = (c + (gamma * h * cos^2(beta) - u) * tan(phi)) / (gamma * h * sin(beta) * cos(beta))
+PARAMS = ("c", "phi", "gamma", "h", "beta", "u")
+# 网格参数取值：标量、取值列表或 {"start", "stop", "num"} (等间距，含端点)
+GridValue = Union[float, Sequence[float], Dict[str, float]]
+
+
+def _status(fs: np.ndarray) -> np.ndarray:
+    return np.select([np.isnan(fs), fs > 1.3, fs < 1.0], ["Error", "Stable", "Unstable"], "Critical")
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)) \
+        and math.isfinite(value)
+
+
+def _axis_length(name: str, value: GridValue) -> int:
+    """
+    校验取值类型并只根据 num / 列表长度计算取值个数，不分配数组 (超限的网格在创建任何数组之前拒绝)
+    """
+    if isinstance(value, dict):
+        if set(value) != {"start", "stop", "num"}:
+            raise ValueError(f"Grid range for {name} needs start, stop and num")
+        if not _is_number(value["start"]) or not _is_number(value["stop"]):
+            raise ValueError(f"Grid start and stop for {name} must be numbers")
+        num = value["num"]
+        if not _is_number(num) or not float(num).is_integer() or num < 1:
+            raise ValueError(f"Grid num for {name} must be a positive integer")
+        return int(num)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if not len(value) or not all(_is_number(v) for v in value):
+            raise ValueError(f"Grid values for {name} must be a number or a non-empty list of numbers")
+        return len(value)
+    if not _is_number(value):
+        raise ValueError(f"Grid values for {name} must be a number or a non-empty list of numbers")
+    return 1
+
+
+def _grid_shape(grid: Dict[str, GridValue]) -> Tuple[int, ...]:
+    unknown = set(grid) - set(PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown grid parameters: {sorted(unknown)}")
+    return tuple(_axis_length(k, grid.get(k, 0.0)) for k in PARAMS)
+
+
+def _grid_axis(name: str, value: GridValue) -> np.ndarray:
+    if isinstance(value, dict):
+        return np.linspace(value["start"], value["stop"], int(value["num"]))
+    axis = np.atleast_1d(np.asarray(value, dtype=np.float64))
+    if axis.ndim != 1:
+        raise ValueError(f"Grid values for {name} must be a scalar or a non-empty list")
+    return axis
+
+
+def _grid_axes(grid: Dict[str, GridValue]) -> List[np.ndarray]:
+    size = math.prod(_grid_shape(grid))
+    if size > settings.STABILITY_MAX_GRID:
+        raise ValueError(f"Grid has {size} combinations, limit is {settings.STABILITY_MAX_GRID}")
+    return [_grid_axis(k, grid.get(k, 0.0)) for k in PARAMS]
+
 
 class EngineeringTool:
-    def stability_factor(self, c: float, phi: float, gamma: float, h: float, beta: float) -> Dict[str, Any]:
+    def stability_factor(self, c: float, phi: float, gamma: float, h: float, beta: float, u: float = 0.0) -> Dict[str, Any]:
         """
         简化边坡稳定性安全系数计算 (瑞典条分法简化或无限边坡模型)
         这里使用无限边坡模型作为示例: Fs = (c + (gamma * h * cos^2(beta) - u) * tan(phi)) / (gamma * h * sin(beta) * cos(beta))
-        假设无孔隙水压力 u=0
+        u 为滑动面上的孔隙水压力 (kPa)，默认 0
         """
-        import math
-        
         try:
             beta_rad = math.radians(beta)
             phi_rad = math.radians(phi)
             
-            numerator = c + (gamma * h * (math.cos(beta_rad)**2)) * math.tan(phi_rad)
+            numerator = c + (gamma * h * (math.cos(beta_rad)**2) - u) * math.tan(phi_rad)
             denominator = gamma * h * math.sin(beta_rad) * math.cos(beta_rad)
             
             if denominator == 0:
@@ -23,9 +85,82 @@ class EngineeringTool:
             return {
                 "Fs": round(fs, 3),
                 "status": "Stable" if fs > 1.3 else ("Unstable" if fs < 1.0 else "Critical"),
-                "params": {"c": c, "phi": phi, "gamma": gamma, "h": h, "beta": beta}
+                "params": {"c": c, "phi": phi, "gamma": gamma, "h": h, "beta": beta, "u": u}
             }
         except Exception as e:
             return {"error": str(e)}
 
+    def stability_factor_batch(self, c, phi, gamma, h, beta, u=0.0) -> Dict[str, np.ndarray]:
+        """
+        向量化计算：参数为标量或数组，按 NumPy 广播规则组合。
+        返回 Fs 与 status 数组，分母为 0 的组合 Fs 为 NaN、status 为 "Error"
+        """
+        c, phi, gamma, h, beta, u = (np.asarray(x, dtype=np.float64) for x in (c, phi, gamma, h, beta, u))
+        beta_rad = np.radians(beta)
+        cos_beta = np.cos(beta_rad)
+        numerator = c + (gamma * h * cos_beta ** 2 - u) * np.tan(np.radians(phi))
+        denominator = gamma * h * np.sin(beta_rad) * cos_beta
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fs = np.where(denominator == 0, np.nan, numerator / denominator)
+        return {"Fs": fs, "status": _status(fs)}
+
+    def grid_size(self, grid: Dict[str, GridValue]) -> int:
+        """
+        组合数 (校验网格参数但不创建取值数组)
+        """
+        return math.prod(_grid_shape(grid))
+
+    def iter_grid(self, grid: Dict[str, GridValue], chunk_size: int = 100_000) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        按笛卡尔积网格分块计算，每块返回参数列与 Fs / status，内存占用与块大小成正比。
+        网格参数与组合数上限 (STABILITY_MAX_GRID) 在调用时即校验，非法时立即抛出 ValueError
+        """
+        axes = _grid_axes(grid)
+        return self._iter_chunks(axes, chunk_size)
+
+    def _iter_chunks(self, axes: List[np.ndarray], chunk_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        shape = tuple(len(a) for a in axes)
+        total = int(np.prod(shape))
+        for start in range(0, total, chunk_size):
+            flat = np.arange(start, min(start + chunk_size, total))
+            columns = {k: axis[idx] for k, axis, idx in zip(PARAMS, axes, np.unravel_index(flat, shape))}
+            yield {**columns, **self.stability_factor_batch(**columns)}
+
+    def sweep(self, grid: Dict[str, GridValue], chunk_size: int = 100_000) -> Dict[str, Any]:
+        """
+        网格敏感性分析汇总 (供 Pipeline 作为工具调用)：Fs 统计、各状态数量与最不利参数组合
+        """
+        size = self.grid_size(grid)
+        if size > settings.STABILITY_MAX_GRID:
+            return {"error": f"Grid has {size} combinations, limit is {settings.STABILITY_MAX_GRID}"}
+        count, total_fs, valid = 0, 0.0, 0
+        min_fs, max_fs, worst = np.inf, -np.inf, None
+        statuses: Dict[str, int] = {}
+        for chunk in self.iter_grid(grid, chunk_size):
+            fs = chunk["Fs"]
+            count += len(fs)
+            labels, counts = np.unique(chunk["status"], return_counts=True)
+            for label, n in zip(labels.tolist(), counts.tolist()):
+                statuses[label] = statuses.get(label, 0) + n
+            ok = ~np.isnan(fs)
+            if not ok.any():
+                continue
+            valid += int(ok.sum())
+            total_fs += float(fs[ok].sum())
+            i = int(np.nanargmin(fs))
+            if fs[i] < min_fs:
+                min_fs = float(fs[i])
+                worst = {k: float(chunk[k][i]) for k in PARAMS}
+            max_fs = max(max_fs, float(np.nanmax(fs)))
+        return {
+            "combinations": count,
+            "Fs_min": round(min_fs, 3) if valid else None,
+            "Fs_max": round(max_fs, 3) if valid else None,
+            "Fs_mean": round(total_fs / valid, 3) if valid else None,
+            "status_counts": statuses,
+            "worst_case": worst,
+        }
+
 engineering_tool = EngineeringTool()
+tool_executor.register("engineering", engineering_tool.stability_factor, ttl=settings.ENGINEERING_CACHE_TTL)
+tool_executor.register("engineering_sweep", engineering_tool.sweep, ttl=settings.ENGINEERING_CACHE_TTL)
@@ -0,0 +1,133 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from app.core.config import settings
+from app.core.logging import logger
+from app.core.metrics import stage_timer, record_cache
+
+# 工具执行层：
+#   - 所有 HTTP 工具共用一个带连接池的 requests.Session (按进程创建，fork 后不复用父进程连接)
+#   - 调用结果按 (工具名, 参数) 做 TTL 缓存，错误结果不缓存
+#   - 工具在线程池中执行，可与检索并发；等待结果时受 TOOL_TIMEOUT 截止时间约束
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key: Hashable, value: Any, ttl: float):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """
+    进程内共享的 requests.Session (keep-alive 连接池)
+    """
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.TOOL_MAX_WORKERS)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+def http_timeout() -> Tuple[float, float]:
+    return settings.TOOL_CONNECT_TIMEOUT, settings.TOOL_TIMEOUT
+
+
+class ToolExecutor:
+    def __init__(self, max_workers: int = None):
+        self._tools: Dict[str, Tuple[Callable[..., Dict[str, Any]], float]] = {}
+        self._max_workers = max_workers or settings.TOOL_MAX_WORKERS
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self.cache = TTLCache(settings.TOOL_CACHE_SIZE)
+
+    def register(self, name: str, func: Callable[..., Dict[str, Any]], ttl: float):
+        self._tools[name] = (func, ttl)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        # 线程池不能跨 fork 使用，多 worker 下每个进程各自创建
+        if self._pool is None or self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pool_pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="tool")
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+    def call(self, name: str, **kwargs) -> Dict[str, Any]:
+        func, ttl = self._tools[name]
+        key = (name, json.dumps(kwargs, sort_keys=True, ensure_ascii=False, default=str))
+        hit, value = self.cache.get(key)
+        record_cache(f"tool_{name}", hit)
+        if hit:
+            return value
+        with stage_timer(f"tool_{name}"):
+            try:
+                value = func(**kwargs)
+            except Exception as e:
+                logger.warning("Tool %s failed: %s", name, e)
+                value = {"error": str(e)}
+        if ttl > 0 and "error" not in value:
+            self.cache.set(key, value, ttl)
+        return value
+
+    def submit(self, name: str, **kwargs) -> Future:
+        """
+        异步执行工具调用；复制当前 contextvars，使工具耗时记录在发起请求的 trace 中
+        """
+        ctx = contextvars.copy_context()
+        return self._executor().submit(ctx.run, self.call, name, **kwargs)
+
+    def result(self, future: Future, name: str, deadline: float) -> Dict[str, Any]:
+        """
+        在截止时间 (time.monotonic()) 前等待工具结果，超时返回错误而不阻塞请求
+        """
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeout:
+            logger.warning("Tool %s timed out after %.1fs", name, settings.TOOL_TIMEOUT)
+            return {"error": "timeout"}
+
+
+tool_executor = ToolExecutor()
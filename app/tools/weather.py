@@ -1,6 +1,6 @@
-import requests
 from typing import Dict, Any
 from app.core.config import settings
+from app.tools.executor import tool_executor, http_session, http_timeout
 
 class WeatherTool:
     def query(self, city: str, date: str = None) -> Dict[str, Any]:
@@ -22,10 +22,11 @@ class WeatherTool:
         try:
             url = f"{settings.WEATHER_API_URL}/history.json"
             params = {"key": settings.WEATHER_API_KEY, "q": city, "dt": date}
-            resp = requests.get(url, params=params)
+            resp = http_session().get(url, params=params, timeout=http_timeout())
             resp.raise_for_status()
             return resp.json()
         except Exception as e:
             return {"error": str(e)}
 
 weather_tool = WeatherTool()
+tool_executor.register("weather", weather_tool.query, ttl=settings.WEATHER_CACHE_TTL)
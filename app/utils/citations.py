@@ -1,32 +1,191 @@
-from typing import List, Dict, Any
+import re
+import unicodedata
+from typing import List, Dict, Any, Hashable, Optional, Sequence, Tuple, Union
+import numpy as np
 from app.ingest.parser import DocumentChunk
+from app.core.config import settings
+
+# 证据片段比对按字符 n-gram 进行：去掉空白与标点后取连续 n 个字符并哈希为 uint64，
+# 一句话的 n-gram 在上下文中出现的比例 (覆盖率) 低于阈值即视为缺乏证据支撑。
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;])|\n+|(?<=\.)\s+")
+
+
+def _normalize_doc_id(value: Any) -> str:
+    return unicodedata.normalize("NFKC", str(value)).strip().casefold()
+
+
+def _normalize_page(value: Any) -> Optional[Hashable]:
+    """
+    页码统一为 int；"12"、12.0 均视为 12，无法解析为整数的页码按规范化字符串比较
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else value
+    text = unicodedata.normalize("NFKC", str(value)).strip()
+    return int(text) if text.isdigit() else text.casefold()
+
+
+_KEEP = None
+
+
+def _keep_table() -> np.ndarray:
+    """
+    BMP 字符是否保留 (字母/数字/汉字)，等价于去掉 \\W 与下划线；\\0 作为分隔符保留
+    """
+    global _KEEP
+    if _KEEP is None:
+        keep = np.fromiter((chr(i).isalnum() for i in range(0x10000)), dtype=bool, count=0x10000)
+        keep[0] = True
+        _KEEP = keep
+    return _KEEP
+
+
+def _rolling_hashes(codes: np.ndarray, n: int) -> np.ndarray:
+    """
+    所有长度为 n 的窗口的多项式哈希 (数组运算中 uint64 溢出即取模，不会告警)
+    """
+    hashes = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+    for j in range(n):
+        hashes = hashes * np.uint64(1000003) + codes[j:len(codes) - n + 1 + j]
+    return hashes
+
+
+def _windows(texts: List[str], n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    多段文本以 \\0 拼接后一次性规范化 (NFKC、ASCII 小写、去空白与标点) 并计算 n-gram 哈希。
+    返回 (哈希, 所属文本下标, 各文本规范化后的长度)；跨越分隔符的窗口丢弃
+    """
+    codes = np.frombuffer(unicodedata.normalize("NFKC", "\0".join(texts)).encode("utf-32-le"), dtype=np.uint32)
+    if len(codes) and codes.max() < 0x10000:
+        codes = codes[_keep_table()[codes]]
+    else:
+        bmp = codes < 0x10000
+        keep = np.ones(len(codes), dtype=bool)
+        keep[bmp] = _keep_table()[codes[bmp]]
+        codes = codes[keep]
+    codes = codes.astype(np.uint64)
+    upper = (codes >= 65) & (codes <= 90)
+    codes[upper] += np.uint64(32)
+
+    separators = np.flatnonzero(codes == 0)
+    bounds = np.concatenate([[-1], separators, [len(codes)]])
+    lengths = np.diff(bounds) - 1
+    if len(codes) < n:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), lengths
+    starts = np.arange(len(codes) - n + 1)
+    owners = np.searchsorted(separators, starts)
+    # 窗口内不含分隔符：下一个分隔符位于窗口末尾之后
+    inside = bounds[owners + 1] >= starts + n
+    return _rolling_hashes(codes, n)[inside], owners[inside], lengths
+
+
+def _mix(hashes: np.ndarray, source_ids: np.ndarray) -> np.ndarray:
+    # 将来源编号混入哈希，使「某 n-gram 出现在某来源中」也能用一个有序数组查询
+    return hashes ^ ((source_ids.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15))
+
+
+def _contains(sorted_grams: np.ndarray, query: np.ndarray) -> np.ndarray:
+    if not len(sorted_grams):
+        return np.zeros(len(query), dtype=bool)
+    pos = np.minimum(np.searchsorted(sorted_grams, query), len(sorted_grams) - 1)
+    return sorted_grams[pos] == query
+
+
+class CitationVerifier:
+    """
+    针对一次请求的上下文构建：引用来源集合 + 全部上下文 chunk 的 n-gram 哈希索引 (有序数组)。
+    所有待校验文本 (引用摘录、rationale 各句) 合并为一次向量化的哈希与二分查找
+    """
+    def __init__(self, context_docs: List[DocumentChunk], n: int = None, threshold: float = None):
+        self.n = n or settings.CITATION_NGRAM
+        self.threshold = settings.CITATION_SUPPORT_THRESHOLD if threshold is None else threshold
+        self.docs = context_docs
+        self.sources: Dict[Tuple[str, Hashable], int] = {}
+        self._doc_sources = np.array(
+            [self.sources.setdefault((_normalize_doc_id(doc.doc_id), _normalize_page(doc.page)), len(self.sources))
+             for doc in context_docs], dtype=np.int64)
+        self._windows: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._index: Dict[bool, np.ndarray] = {}
+
+    def _grams(self, scoped: bool) -> np.ndarray:
+        """
+        上下文 n-gram 有序哈希；scoped=True 时混入来源编号。两者都仅在需要时构建
+        """
+        if self._windows is None:
+            self._windows = _windows([doc.text for doc in self.docs], self.n)[:2]
+        if scoped not in self._index:
+            hashes, owners = self._windows
+            self._index[scoped] = np.sort(_mix(hashes, self._doc_sources[owners]) if scoped else hashes)
+        return self._index[scoped]
+
+    def source_key(self, citation: Dict[str, Any]) -> Optional[Tuple[str, Hashable]]:
+        if not isinstance(citation, dict) or citation.get("doc_id") is None:
+            return None
+        key = (_normalize_doc_id(citation["doc_id"]), _normalize_page(citation.get("page")))
+        return key if key in self.sources else None
+
+    def coverage(self, texts: List[str], sources: List[Optional[Tuple[str, Hashable]]] = None,
+                 min_length: Union[int, Sequence[int]] = 0) -> np.ndarray:
+        """
+        每段文本的 n-gram 在证据中的覆盖率；sources[i] 不为 None 时只与该来源的 chunk 比对。
+        规范化后短于 max(n, min_length) 的文本无法判断，覆盖率记为 NaN (min_length 可逐段指定)
+        """
+        sources = sources or [None] * len(texts)
+        if not texts:
+            return np.empty(0)
+        hashes, owners, lengths = _windows(texts, self.n)
+        scoped = np.array([-1 if s is None else self.sources[s] for s in sources], dtype=np.int64)[owners]
+        found = np.zeros(len(hashes), dtype=bool)
+        general = scoped < 0
+        if general.any():
+            found[general] = _contains(self._grams(False), hashes[general])
+        if not general.all():
+            found[~general] = _contains(self._grams(True), _mix(hashes[~general], scoped[~general]))
+        with np.errstate(invalid="ignore"):
+            result = np.bincount(owners, weights=found, minlength=len(texts)) / np.bincount(owners, minlength=len(texts))
+        result[lengths < np.maximum(self.n, min_length)] = np.nan
+        return result
+
+    def support(self, text: str, source: Optional[Tuple[str, Hashable]] = None) -> float:
+        return float(self.coverage([text], [source])[0])
+
+    def verify(self, response_json: Dict[str, Any]) -> Dict[str, Any]:
+        raw_citations = response_json.get("citations") or []
+        cited = []
+        for cit in raw_citations if isinstance(raw_citations, list) else []:
+            key = self.source_key(cit)
+            if key is not None:
+                cited.append((cit, key))
+
+        if not settings.CITATION_SPAN_CHECK:
+            response_json["citations"] = [cit for cit, _ in cited]
+            return response_json
+
+        # 引用摘录 (与所引来源比对) 与 rationale 各句 (与全部上下文比对) 一次完成校验
+        quotes = [(i, cit["quote"]) for i, (cit, _) in enumerate(cited) if isinstance(cit.get("quote"), str) and cit["quote"]]
+        rationale = response_json.get("rationale")
+        sentences = [s.strip() for s in _SENTENCE_END.split(rationale) if s and s.strip()] if isinstance(rationale, str) else []
+        # 过短的摘录/句子 (如 "综上。") 不足以判断，覆盖率为 NaN，不计入 unsupported；
+        # 摘录应逐字来自原文，只要求不短于 n，句子允许改写，要求至少 2n 个字符
+        scores = self.coverage([q for _, q in quotes] + sentences,
+                               [cited[i][1] for i, _ in quotes] + [None] * len(sentences),
+                               min_length=[self.n] * len(quotes) + [2 * self.n] * len(sentences))
+
+        # 摘录内容不在所引用的 chunk 中的引用被剔除
+        rejected = {i for (i, _), score in zip(quotes, scores) if score < self.threshold}
+        response_json["citations"] = [cit for i, (cit, _) in enumerate(cited) if i not in rejected]
+        unsupported = [q for (i, q) in quotes if i in rejected]
+        unsupported += [s for s, score in zip(sentences, scores[len(quotes):]) if score < self.threshold]
+        response_json["unsupported_claims"] = unsupported
+        return response_json
+
 
 def validate_citations(response_json: Dict[str, Any], context_docs: List[DocumentChunk]) -> Dict[str, Any]:
     """
-    校验引用一致性：citations 中的 doc_id/page 必须来自本次检索结果
-    """
-    valid_citations = []
-    
-    # 构建有效引用集合
-    valid_sources = set()
-    for doc in context_docs:
-        valid_sources.add((doc.doc_id, doc.page))
-        
-    raw_citations = response_json.get("citations", [])
-    
-    for cit in raw_citations:
-        doc_id = cit.get("doc_id")
-        page = cit.get("page")
-        
-        # 宽松匹配：如果 doc_id 包含在 context 中，或者 context 包含 doc_id
-        is_valid = False
-        for v_doc_id, v_page in valid_sources:
-            if (doc_id == v_doc_id) and (int(page) == int(v_page)):
-                is_valid = True
-                break
-        
-        if is_valid:
-            valid_citations.append(cit)
-            
-    response_json["citations"] = valid_citations
-    return response_json
+    校验引用一致性：citations 中的 doc_id/page 必须来自本次检索结果；
+    开启 CITATION_SPAN_CHECK 时，引用摘录与 rationale 中缺乏证据支撑的句子记入 unsupported_claims
+    """
+    return CitationVerifier(context_docs).verify(response_json)